@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .driver_pool import DriverPoll, QueryDriverTimeout
+from .common.killer import killer
+
+
+class _DriverContext(object):
+    def __init__(self, pool, timeout=None, affinity=None):
+        self._pool = pool
+        self._timeout = timeout
+        self._affinity = affinity
+        self._driver = None
+
+    async def __aenter__(self):
+        self._driver = await self._pool.acquire(timeout=self._timeout, affinity=self._affinity)
+        return self._driver
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._driver is not None:
+            await self._pool.release(self._driver, delete_cookies=self._affinity is None)
+
+
+class AsyncDriverPool(object):
+    def __init__(self, max_workers=None, **driver_poll_kwargs):
+        """
+        the asyncio interface of DriverPoll, waiting for a driver costs no thread, the blocking selenium calls run in
+        a bounded thread pool executor
+        :param max_workers: the max number of the blocking selenium calls at the same time, default driver_size
+        :param driver_poll_kwargs: the params of DriverPoll
+        """
+        self.driver_poll = DriverPoll(**driver_poll_kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers if max_workers else self.driver_poll.driver_size)
+        self.metrics = self.driver_poll.metrics
+        self._loop = None
+        self._available = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._loop is not None:
+                self.driver_poll.remove_available_callback(self._on_available)
+            self._loop = loop
+            self._available = asyncio.Event()
+            self.driver_poll.add_available_callback(self._on_available)
+        return loop
+
+    def _on_available(self):
+        # called in the thread returning the driver
+        try:
+            self._loop.call_soon_threadsafe(self._wake_up)
+        except RuntimeError:
+            # the event loop is closed
+            pass
+
+    def _wake_up(self):
+        available, self._available = self._available, asyncio.Event()
+        available.set()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        run a blocking call, e.g. a selenium driver method, in the executor
+        """
+        loop = self._bind_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def acquire(self, timeout=None, affinity=None):
+        """
+        :param timeout: seconds to wait for an idle driver, default None wait until one is returned
+        :param affinity: the affinity key, the driver pinned to it is waited for affinity_wait seconds of the pool,
+                         see DriverPoll.query_driver, release the driver with delete_cookies=False to keep its session
+        :raise QueryDriverTimeout: no driver can be used before the timeout expired
+        """
+        self._bind_loop()
+        start_time = time.time()
+        affinity_deadline = start_time + self.driver_poll.affinity_wait
+
+        async def _query_driver():
+            driver, clear_session = self.driver_poll.query_driver_nowait(
+                affinity=affinity, affinity_wait=max(affinity_deadline - time.time(), 0))
+            if clear_session:
+                # the cookies are deleted by selenium, out of the event loop
+                await self.run(self.driver_poll.clear_session, driver)
+            return driver
+
+        driver = await _query_driver()
+        if driver is not None:
+            self.driver_poll.metrics.observe("checkout_wait_seconds", time.time() - start_time)
+            return driver
+        deadline = start_time + timeout if timeout is not None else None
+        self.driver_poll.add_waiter()
+        try:
+            while True:
+                if killer.kill_now:
+                    return None
+                # take the event before checking, so that a driver returned in between is not missed
+                available = self._available
+                driver = await _query_driver()
+                if driver is not None:
+                    self.driver_poll.metrics.observe("checkout_wait_seconds", time.time() - start_time)
+                    return driver
+                remaining = deadline - time.time() if deadline is not None else 1
+                if remaining <= 0:
+                    self.driver_poll.metrics.inc("checkout_timeouts_total")
+                    raise QueryDriverTimeout('no idle driver in the driver pool after waiting {} seconds'.format(
+                        timeout))
+                if affinity is not None and time.time() < affinity_deadline:
+                    remaining = min(remaining, affinity_deadline - time.time())
+                try:
+                    await asyncio.wait_for(available.wait(), min(remaining, 1))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.driver_poll.remove_waiter()
+
+    async def release(self, driver, delete_cookies=True):
+        if delete_cookies:
+            try:
+                await self.run(driver.delete_all_cookies)
+            except Exception as e:
+                self.driver_poll.logger.warning('Fail to delete the cookies of the driver, error info: {}'.format(e))
+        # a stale driver is reset in out_of_use
+        await self.run(self.driver_poll.out_of_use, driver)
+
+    def driver(self, timeout=None, affinity=None):
+        """
+        async with pool.driver() as driver:
+        """
+        return _DriverContext(self, timeout=timeout, affinity=affinity)
+
+    async def goto(self, driver, url, retry_times=0, wait_for=None, wait_timeout=None):
+        return await self.run(self.driver_poll.goto, driver, url, retry_times=retry_times, wait_for=wait_for,
+                              wait_timeout=wait_timeout)
+
+    async def warm_up(self, size, parallel=True):
+        return await self.run(self.driver_poll.warm_up, size, parallel=parallel)
+
+    async def close(self):
+        await self.run(self.driver_poll.clear_driver_pool)
+        await self.run(self.driver_poll.join_downloads)
+        if self._loop is not None:
+            self.driver_poll.remove_available_callback(self._on_available)
+            self._loop = None
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
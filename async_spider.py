@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import abc
+import asyncio
+import inspect
+import logging
+import time
+from collections.abc import Iterable
+from .async_driver_pool import AsyncDriverPool
+from .core_spider import Task
+from .common.log import Logger
+from .common.killer import Killer
+
+_logger = Logger(__name__).logger
+
+_exhausted = object()
+
+
+class AsyncCoreSpider(abc.ABC):
+    def __init__(self, concurrent=64, driver="chrome", proxy_url="", save_folder="./file_download",
+                 only_html=False, no_js=False, headless=False, driver_log_path="driver.log",
+                 logger=None, proxy_scheme="http", timeout=60, driver_time_limit=60 * 5, driver_use_limit=8,
+                 execute_path="", window_size=None, min_idle=0, idle_timeout=None, pre_warm=True, pipelines=None,
+                 max_workers=None, max_per_host=None, host_delay=0, block_url_patterns=None, health_check_interval=None,
+                 max_driver_memory=None, affinity_wait=5, download_handler=None, download_done_folder=None):
+        """
+        the handle_func of the tasks can be a coroutine function, an async generator function or a normal function,
+        a normal handle_func runs in the executor of the driver pool
+        :param max_workers: the max number of the blocking selenium calls at the same time, default concurrent
+        :param max_per_host: the max number of goto in flight per host, default None unlimited
+        :param host_delay: the min seconds between two goto to the same host, backing off after the failed goto
+        :param block_url_patterns: the url patterns the drivers never load, e.g. the ads and the trackers, chrome only
+        :param health_check_interval: ping the idle drivers and kill the orphan driver services every
+                                      health_check_interval seconds, default None no health check
+        :param max_driver_memory: restart the idle driver using more memory than it in MB, default None no limit
+        :param affinity_wait: the seconds a task with an affinity key waits for the driver pinned to the key, before
+                              it runs on another driver
+        :param download_handler: called in a background thread with the path of every file a task downloaded, after
+                                 the task returns, default None
+        :param download_done_folder: the files the tasks downloaded are moved into it when there is no
+                                     download_handler, default None the files are kept under save_folder when
+                                     neither is set
+        """
+        self._concurrent = concurrent
+        self._task_queue = None
+        self.driver_pool = AsyncDriverPool(max_workers=max_workers, driver=driver, proxy_url=proxy_url,
+                                           save_folder=save_folder, only_html=only_html, no_js=no_js,
+                                           headless=headless, driver_log_path=driver_log_path, logger=logger,
+                                           proxy_scheme=proxy_scheme, timeout=timeout, driver_size=concurrent,
+                                           driver_time_limit=driver_time_limit, driver_use_limit=driver_use_limit,
+                                           execute_path=execute_path, window_size=window_size, min_idle=min_idle,
+                                           idle_timeout=idle_timeout, max_per_host=max_per_host,
+                                           host_delay=host_delay, block_url_patterns=block_url_patterns,
+                                           health_check_interval=health_check_interval,
+                                           max_driver_memory=max_driver_memory, affinity_wait=affinity_wait,
+                                           download_handler=download_handler,
+                                           download_done_folder=download_done_folder)
+        self.metrics = self.driver_pool.metrics
+        self.metrics.add_gauge_callback("task_queue_size",
+                                        lambda: self._task_queue.qsize() if self._task_queue else 0)
+        self._pre_warm = pre_warm
+        self._pipelines = list(pipelines) if pipelines else []
+        self.killed = Killer()
+        self.logger = _logger if not logger else logger
+
+    def _task_push(self, task):
+        if task:
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("enqueue task kw:{} url:{}".format(task.kw, task.url),
+                                 extra={"event": "task_enqueue"})
+        self._task_queue.put_nowait(task)
+
+    @abc.abstractmethod
+    def task_create(self):
+        """
+        the initial task(s) of the spider, return a Task, an iterable of Task or a coroutine returning them
+        """
+
+    async def init_task_enqueue(self):
+        result = self.task_create()
+        if inspect.isawaitable(result):
+            result = await result
+        if isinstance(result, Task) or result is None:
+            result = [result]
+        for task in result:
+            if task:
+                self._task_push(task)
+
+    async def process_item(self, item):
+        for pipeline in self._pipelines:
+            item = pipeline.process_item(item, self)
+            if inspect.isawaitable(item):
+                item = await item
+            if item is None:
+                break
+
+    async def _handle_output(self, output, task):
+        if output is None:
+            return
+        if isinstance(output, Task):
+            if output.depth is None:
+                output.depth = (task.depth or 0) + 1
+            self._task_push(output)
+        else:
+            await self.process_item(output)
+
+    async def _handle_task(self, task, driver):
+        handle_func = task.handle_func
+        if inspect.isasyncgenfunction(handle_func):
+            async for output in handle_func(task, driver):
+                await self._handle_output(output, task)
+            return
+        if inspect.iscoroutinefunction(handle_func):
+            result = await handle_func(task, driver)
+        else:
+            result = await self.driver_pool.run(handle_func, task, driver)
+        if isinstance(result, Iterable) and not isinstance(result, (str, bytes, dict)):
+            iterator = iter(result)
+            while True:
+                # a generator handle_func runs its body while being iterated, so step it in the executor too
+                output = await self.driver_pool.run(next, iterator, _exhausted)
+                if output is _exhausted:
+                    break
+                await self._handle_output(output, task)
+        else:
+            await self._handle_output(result, task)
+
+    async def _consumer(self):
+        while True:
+            task = await self._task_queue.get()
+            if task is None:
+                self._task_queue.task_done()
+                break
+            affinity = getattr(task, "affinity", None)
+            driver = await self.driver_pool.acquire(affinity=affinity)
+            if driver is None:
+                self._task_queue.task_done()
+                break
+            start_time = time.time()
+            status = "ok"
+            try:
+                await self._handle_task(task, driver)
+            except Exception as e:
+                status = "error"
+                self.logger.exception("fail to handle task kw:{} url:{}, error: {}".format(task.kw, task.url, e),
+                                      extra={"event": "task_error"})
+            finally:
+                self.metrics.observe("task_seconds", time.time() - start_time)
+                self.metrics.inc("tasks_total", status=status)
+                self.metrics.mark("tasks")
+                self._task_queue.task_done()
+                # the session of a pinned driver is kept for the next task with the same affinity
+                await self.driver_pool.release(driver, delete_cookies=affinity is None)
+
+    async def _wait_for_kill(self):
+        while not self.killed.kill_now:
+            await asyncio.sleep(1)
+        self.logger.info("receive kill signal, the producer is stopping.")
+
+    async def async_schedule(self):
+        self._task_queue = asyncio.Queue()
+        if self._pre_warm:
+            asyncio.ensure_future(self.driver_pool.warm_up(self._concurrent))
+        for pipeline in self._pipelines:
+            pipeline.open_spider(self)
+        await self.init_task_enqueue()
+        consumer_list = [asyncio.ensure_future(self._consumer()) for _ in range(self._concurrent)]
+        self.logger.info("AsyncCoreSpider schedule is started successfully, waiting for task to start.")
+        join_future = asyncio.ensure_future(self._task_queue.join())
+        kill_future = asyncio.ensure_future(self._wait_for_kill())
+        await asyncio.wait([join_future, kill_future], return_when=asyncio.FIRST_COMPLETED)
+        for future in (join_future, kill_future):
+            future.cancel()
+        if self.killed.kill_now:
+            # drop the tasks left in the queue, the consumers stop after their current task
+            while not self._task_queue.empty():
+                self._task_queue.get_nowait()
+                self._task_queue.task_done()
+        for i in range(self._concurrent):
+            self._task_push(None)
+        await asyncio.gather(*consumer_list, return_exceptions=True)
+        await self.driver_pool.close()
+        for pipeline in self._pipelines:
+            pipeline.close_spider(self)
+
+    def schedule(self):
+        asyncio.run(self.async_schedule())
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from .common.log import Logger
+from .common.process import available_memory, load_average
+
+_logger = Logger(__name__).logger
+
+MB = 1024 * 1024
+
+
+class Autoscaler(object):
+    def __init__(self, driver_poll, min_size, max_size, queue_size_func=None, on_resize=None, interval=10,
+                 scale_up_wait=0.5, scale_down_ticks=3, step_ratio=0.25, max_load_per_cpu=2.0, min_free_memory=1024,
+                 driver_memory=300, logger=None):
+        """
+        grow the driver pool while the tasks wait for the drivers and the host has the cpu and the memory to spare,
+        shrink it while the drivers are idle or the host is overloaded
+        :param driver_poll: the DriverPoll to resize
+        :param min_size: the pool never shrinks below it
+        :param max_size: the pool never grows over it
+        :param queue_size_func: returns the number of the tasks waiting in the task queue, default None no task queue
+        :param on_resize: called with the new size after the pool is resized, e.g. to start or stop the consumers
+        :param interval: the seconds between two checks
+        :param scale_up_wait: grow when tasks are queued and all the drivers are used, or the average checkout wait
+                              since the last check is longer than it in seconds
+        :param scale_down_ticks: shrink after the task queue is empty and some drivers are idle for this number of
+                                 checks in a row
+        :param step_ratio: the pool grows or shrinks by this ratio of its size at a time, at least one driver
+        :param max_load_per_cpu: shrink when the 1 minute load average per cpu is over it, and never grow then
+        :param min_free_memory: shrink when less memory than it in MB is available, and never grow over it
+        :param driver_memory: the memory in MB a new browser is expected to use
+        """
+        if min_size < 1 or max_size < min_size:
+            raise Exception("the autoscaler needs 1 <= min_size <= max_size, min_size:{} max_size:{}".format(
+                min_size, max_size))
+        self.driver_poll = driver_poll
+        self.min_size = min_size
+        self.max_size = max_size
+        self.queue_size_func = queue_size_func
+        self.on_resize = on_resize
+        self.interval = interval
+        self.scale_up_wait = scale_up_wait
+        self.scale_down_ticks = scale_down_ticks
+        self.step_ratio = step_ratio
+        self.max_load_per_cpu = max_load_per_cpu
+        self.min_free_memory = min_free_memory
+        self.driver_memory = driver_memory
+        self.logger = _logger if not logger else logger
+        self._cpu_size = os.cpu_count() or 1
+        self._idle_ticks = 0
+        self._last_checkout = (0, 0.0)
+        self._stop = threading.Event()
+        self._thd = None
+
+    def _checkout_wait(self):
+        """
+        :return: the average checkout wait in seconds since the last call, None if there was no checkout
+        """
+        histogram = self.driver_poll.metrics.snapshot()["histograms"].get("checkout_wait_seconds")
+        if not histogram:
+            return None
+        last_count, last_sum = self._last_checkout
+        self._last_checkout = (histogram["count"], histogram["sum"])
+        if histogram["count"] <= last_count:
+            return None
+        return (histogram["sum"] - last_sum) / (histogram["count"] - last_count)
+
+    def _step(self, size):
+        return max(1, int(size * self.step_ratio))
+
+    def decide(self):
+        """
+        :return: (the new size, the reason), the size is the current one if the pool should not be resized
+        """
+        stats = self.driver_poll.pool_stats()
+        size = stats["driver_size"]
+        queue_size = self.queue_size_func() if self.queue_size_func else 0
+        checkout_wait = self._checkout_wait()
+        load = load_average()
+        load_per_cpu = load / self._cpu_size if load is not None else None
+        free_memory = available_memory()
+        free_memory_mb = free_memory / MB if free_memory is not None else None
+        if load_per_cpu is not None:
+            self.driver_poll.metrics.set_gauge("host_load_per_cpu", load_per_cpu)
+        if free_memory is not None:
+            self.driver_poll.metrics.set_gauge("host_available_memory_bytes", free_memory)
+        cpu_overloaded = load_per_cpu is not None and load_per_cpu > self.max_load_per_cpu
+        memory_short = free_memory_mb is not None and free_memory_mb < self.min_free_memory
+        if cpu_overloaded or memory_short:
+            self._idle_ticks = 0
+            return max(self.min_size, size - self._step(size)), "memory" if memory_short else "cpu"
+        # the consumers match the drivers, so the tasks wait in the task queue rather than for a driver
+        saturated = stats["idle"] == 0 and stats["busy"] >= size
+        slow_checkout = checkout_wait is not None and checkout_wait >= self.scale_up_wait
+        if queue_size > 0 and (saturated or slow_checkout) and size < self.max_size:
+            self._idle_ticks = 0
+            step = self._step(size)
+            if free_memory_mb is not None:
+                # the browsers launched must leave min_free_memory available
+                step = min(step, int((free_memory_mb - self.min_free_memory) // self.driver_memory))
+            return min(self.max_size, size + max(step, 0)), "demand"
+        if queue_size == 0 and stats["idle"] > 0:
+            self._idle_ticks += 1
+            if self._idle_ticks >= self.scale_down_ticks:
+                self._idle_ticks = 0
+                return max(self.min_size, size - min(stats["idle"], self._step(size))), "idle"
+        else:
+            self._idle_ticks = 0
+        return size, None
+
+    def check(self):
+        """
+        resize the pool once if it should be
+        :return: the new size, None if the pool is not resized
+        """
+        size = self.driver_poll.driver_size
+        new_size, reason = self.decide()
+        if new_size == size:
+            return None
+        self.driver_poll.resize(new_size)
+        if self.on_resize is not None:
+            self.on_resize(new_size)
+        self.driver_poll.metrics.inc("autoscale_total", direction="up" if new_size > size else "down", reason=reason)
+        self.logger.info("autoscale the driver pool from {} to {} drivers, reason: {}".format(size, new_size, reason))
+        return new_size
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.warning("Fail to autoscale the driver pool, error info: {}".format(e))
+
+    def start(self):
+        if self._thd is None:
+            self._stop.clear()
+            self._thd = threading.Thread(target=self._run)
+            self._thd.setDaemon(True)
+            self._thd.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thd is not None:
+            self._thd.join()
+            self._thd = None
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# the benchmarks of DriverPoll and CoreSpider with fake drivers, run them with python -m <package>.benchmarks
+from .fake_driver import FakeDriver, FakeDriverSettings, fake_webdriver
+from .fake_proxy import FakeProxyServer
+from .bench import bench_pool, bench_spider, compare, format_report, percentiles, run
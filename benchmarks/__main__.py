@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import sys
+from .bench import DEFAULT_POOL_SIZES, compare, format_report, run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark DriverPoll and CoreSpider with fake drivers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_POOL_SIZES),
+                        help="the pool sizes, also the concurrent of the spider")
+    parser.add_argument("--bench", choices=("pool", "spider"), nargs="+", default=["pool", "spider"])
+    parser.add_argument("--launch-latency", type=float, default=0.05)
+    parser.add_argument("--page-load-latency", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--launch-failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--tasks-per-client", type=int, default=10)
+    parser.add_argument("--tasks-per-consumer", type=int, default=20)
+    parser.add_argument("--output", help="write the results as json to the file")
+    parser.add_argument("--baseline", help="the json results of an earlier run, exit with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    settings_kwargs = dict(launch_latency=args.launch_latency, page_load_latency=args.page_load_latency,
+                           failure_rate=args.failure_rate, launch_failure_rate=args.launch_failure_rate,
+                           seed=args.seed)
+    results = run(pool_sizes=args.sizes, benches=args.bench, settings_kwargs=settings_kwargs,
+                  tasks_per_client=args.tasks_per_client, tasks_per_consumer=args.tasks_per_consumer)
+    print(format_report(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
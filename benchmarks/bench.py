@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import threading
+import time
+from ..common.log import Logger
+from ..core_spider import CoreSpider, Task
+from ..driver_pool import DriverPoll
+from .fake_driver import FakeDriverSettings, fake_webdriver
+from .fake_proxy import FakeProxyServer
+
+_logger = Logger(__name__).logger
+
+DEFAULT_POOL_SIZES = (4, 16, 64, 256)
+
+
+def percentiles(values, quantiles=(0.5, 0.9, 0.99)):
+    """
+    :return: {"p50": ..., "max": ...} of the values by the nearest rank, the values are None if there is none
+    """
+    ordered = sorted(values)
+    result = {}
+    for q in quantiles:
+        name = "p{}".format(int(q * 100) if q * 100 == int(q * 100) else q * 100)
+        result[name] = ordered[max(int(math.ceil(q * len(ordered))) - 1, 0)] if ordered else None
+    result["max"] = ordered[-1] if ordered else None
+    return result
+
+
+class LockStats(object):
+    __slots__ = ("acquire_size", "contended_size", "wait_seconds", "max_wait_seconds")
+
+    def __init__(self):
+        self.acquire_size = 0
+        self.contended_size = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def snapshot(self):
+        return {
+            "acquires": self.acquire_size,
+            "contended": self.contended_size,
+            "contention_ratio": self.contended_size / float(self.acquire_size) if self.acquire_size else 0.0,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+class ContentionLock(object):
+    """
+    a Lock or an RLock counting the blocking acquires that had to wait, and how long they waited, the counters are
+    only updated by the thread holding the lock
+    """
+
+    def __init__(self, lock, stats=None):
+        self._lock = lock
+        self.stats = stats if stats else LockStats()
+        # threading.Condition uses them to release an RLock held recursively around wait
+        for name in ("_is_owned", "_release_save", "_acquire_restore"):
+            if hasattr(lock, name):
+                setattr(self, name, getattr(lock, name))
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self.stats.acquire_size += 1
+            return True
+        if not blocking:
+            return False
+        start_time = time.time()
+        if not self._lock.acquire(True, timeout):
+            return False
+        wait_seconds = time.time() - start_time
+        self.stats.acquire_size += 1
+        self.stats.contended_size += 1
+        self.stats.wait_seconds += wait_seconds
+        self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, wait_seconds)
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def instrument_lock(obj, lock_name, condition_names=()):
+    """
+    replace the lock of obj and the conditions built on it with instrumented ones, it must be called before any
+    thread uses them
+    :rtype: LockStats
+    """
+    lock = ContentionLock(getattr(obj, lock_name))
+    setattr(obj, lock_name, lock)
+    for condition_name in condition_names:
+        setattr(obj, condition_name, threading.Condition(lock))
+    return lock.stats
+
+
+def _quiet_logger():
+    logger = Logger("driver_pool.benchmarks").logger
+    logger.setLevel(logging.ERROR)
+    return logger
+
+
+def _bench_url(index):
+    return "http://bench{}.test/page/{}".format(index % 50, index)
+
+
+def bench_pool(pool_size, settings=None, clients=None, tasks_per_client=10, proxy=True, **pool_kwargs):
+    """
+    the clients query a driver, goto a page and return the driver in a loop
+    :param clients: the number of client threads, default twice the pool size so that they wait for the drivers
+    :param proxy: the drivers get their proxies from a local FakeProxyServer
+    :param pool_kwargs: the other params of DriverPoll
+    :rtype: dict
+    """
+    clients = clients if clients else pool_size * 2
+    settings = settings if settings else FakeDriverSettings()
+    pool_kwargs.setdefault("save_folder", "")
+    pool_kwargs.setdefault("retry_delay", 0.01)
+    pool_kwargs.setdefault("replenish_workers", min(pool_size, 16))
+    checkout_waits, task_seconds = [], []
+    failures = [0]
+    result_lock = threading.Lock()
+    proxy_server = FakeProxyServer().start() if proxy else None
+    try:
+        with fake_webdriver(settings):
+            driver_poll = DriverPoll(driver="chrome", driver_size=pool_size, logger=_quiet_logger(),
+                                     proxy_url=proxy_server.url if proxy_server else "", **pool_kwargs)
+            lock_stats = instrument_lock(driver_poll, "_lock", ("_driver_available", "_replenish_needed"))
+            start_time = time.time()
+            driver_poll.warm_up(pool_size)
+            warm_up_seconds = time.time() - start_time
+
+            def _client(client_index):
+                for task_index in range(tasks_per_client):
+                    task_start_time = time.time()
+                    driver = driver_poll.query_driver()
+                    checkout_wait = time.time() - task_start_time
+                    failed = False
+                    try:
+                        driver_poll.goto(driver, _bench_url(client_index * tasks_per_client + task_index))
+                    except Exception:
+                        failed = True
+                    finally:
+                        driver_poll.out_of_use(driver)
+                    with result_lock:
+                        checkout_waits.append(checkout_wait)
+                        task_seconds.append(time.time() - task_start_time)
+                        failures[0] += failed
+
+            client_thd_list = [threading.Thread(target=_client, args=(index, )) for index in range(clients)]
+            start_time = time.time()
+            for thd in client_thd_list:
+                thd.start()
+            for thd in client_thd_list:
+                thd.join()
+            seconds = time.time() - start_time
+            driver_poll.clear_driver_pool(dont_output=True)
+    finally:
+        if proxy_server:
+            proxy_server.close()
+    return {
+        "bench": "pool",
+        "size": pool_size,
+        "clients": clients,
+        "tasks": len(task_seconds),
+        "failures": failures[0],
+        "seconds": seconds,
+        "warm_up_seconds": warm_up_seconds,
+        "tasks_per_second": len(task_seconds) / seconds if seconds else None,
+        "checkout_wait": percentiles(checkout_waits),
+        "task_seconds": percentiles(task_seconds),
+        "locks": {"pool": lock_stats.snapshot()},
+        "launches": settings.launched_size,
+    }
+
+
+class _BenchSpider(CoreSpider):
+    """
+    every task loads its page and yields the next two tasks of a binary tree, until task_size tasks are enqueued
+    """
+
+    def __init__(self, task_size, **kwargs):
+        super(_BenchSpider, self).__init__(**kwargs)
+        self.task_size = task_size
+        self.finish_times = []
+        self.failure_size = 0
+        self._bench_lock = threading.Lock()
+
+    def task_create(self):
+        return Task(self.parse, kw=0, url=_bench_url(0))
+
+    def parse(self, task, driver):
+        try:
+            self.driver_poll.goto(driver, task.url)
+        except Exception:
+            with self._bench_lock:
+                self.failure_size += 1
+        for index in (task.kw * 2 + 1, task.kw * 2 + 2):
+            if index < self.task_size:
+                yield Task(self.parse, kw=index, url=_bench_url(index))
+        with self._bench_lock:
+            self.finish_times.append(time.time())
+
+
+def bench_spider(concurrent, settings=None, task_size=None, proxy=True, **spider_kwargs):
+    """
+    run CoreSpider.schedule over a tree of task_size tasks
+    :param task_size: the number of tasks, default 20 per consumer
+    :param spider_kwargs: the other params of CoreSpider
+    :rtype: dict
+    """
+    task_size = task_size if task_size else concurrent * 20
+    settings = settings if settings else FakeDriverSettings()
+    checkout_waits = []
+    result_lock = threading.Lock()
+    proxy_server = FakeProxyServer().start() if proxy else None
+    try:
+        with fake_webdriver(settings):
+            spider = _BenchSpider(task_size, concurrent=concurrent, driver="chrome", logger=_quiet_logger(),
+                                  proxy_url=proxy_server.url if proxy_server else "",
+                                  save_folder=spider_kwargs.pop("save_folder", ""), **spider_kwargs)
+            spider.driver_poll.retry_delay = 0.01
+            pool_lock_stats = instrument_lock(spider.driver_poll, "_lock", ("_driver_available", "_replenish_needed"))
+            queue_lock_stats = instrument_lock(spider._task_queue, "mutex",
+                                               ("not_empty", "not_full", "all_tasks_done"))
+            query_driver = spider.driver_poll.query_driver
+
+            def _timed_query_driver(*args, **kwargs):
+                query_start_time = time.time()
+                driver = query_driver(*args, **kwargs)
+                with result_lock:
+                    checkout_waits.append(time.time() - query_start_time)
+                return driver
+
+            spider.driver_poll.query_driver = _timed_query_driver
+            start_time = time.time()
+            spider.schedule()
+            schedule_seconds = time.time() - start_time
+    finally:
+        if proxy_server:
+            proxy_server.close()
+    # schedule polls the task queue every second, the last task tells when the work was done
+    seconds = (max(spider.finish_times) - start_time) if spider.finish_times else schedule_seconds
+    return {
+        "bench": "spider",
+        "size": concurrent,
+        "tasks": len(spider.finish_times),
+        "failures": spider.failure_size,
+        "seconds": seconds,
+        "schedule_seconds": schedule_seconds,
+        "tasks_per_second": len(spider.finish_times) / seconds if seconds else None,
+        "checkout_wait": percentiles(checkout_waits),
+        "locks": {"pool": pool_lock_stats.snapshot(), "task_queue": queue_lock_stats.snapshot()},
+        "launches": settings.launched_size,
+    }
+
+
+def run(pool_sizes=DEFAULT_POOL_SIZES, benches=("pool", "spider"), settings_kwargs=None, tasks_per_client=10,
+        tasks_per_consumer=20):
+    """
+    :param settings_kwargs: the params of FakeDriverSettings of every run
+    :return: the results of every bench and pool size
+    """
+    results = []
+    for pool_size in pool_sizes:
+        for bench in benches:
+            settings = FakeDriverSettings(**(settings_kwargs or {}))
+            if bench == "pool":
+                result = bench_pool(pool_size, settings=settings, tasks_per_client=tasks_per_client)
+            elif bench == "spider":
+                result = bench_spider(pool_size, settings=settings, task_size=pool_size * tasks_per_consumer)
+            else:
+                raise Exception("the bench can only be set to pool or spider, bench:{}".format(bench))
+            _logger.info("{} size:{} tasks/s:{:.1f}".format(bench, pool_size, result["tasks_per_second"] or 0))
+            results.append(result)
+    return results
+
+
+def _ms(seconds):
+    return "-" if seconds is None else "{:.1f}".format(seconds * 1000)
+
+
+def format_report(results):
+    """
+    :return: a text table of the results
+    """
+    lines = ["{:<7}{:>6}{:>8}{:>10}{:>9}{:>9}{:>9}{:>10}{:>12}".format(
+        "bench", "size", "tasks", "tasks/s", "p50 ms", "p90 ms", "p99 ms", "lock %", "lock wait s")]
+    for result in results:
+        checkout_wait = result["checkout_wait"]
+        lock_stats = result["locks"]["pool"]
+        lines.append("{:<7}{:>6}{:>8}{:>10.1f}{:>9}{:>9}{:>9}{:>10.2f}{:>12.3f}".format(
+            result["bench"], result["size"], result["tasks"], result["tasks_per_second"] or 0,
+            _ms(checkout_wait["p50"]), _ms(checkout_wait["p90"]), _ms(checkout_wait["p99"]),
+            lock_stats["contention_ratio"] * 100, lock_stats["wait_seconds"]))
+    return "\n".join(lines)
+
+
+def compare(results, baseline, tolerance=0.2, min_latency=0.005):
+    """
+    :param baseline: the results of an earlier run
+    :param tolerance: the relative drop of tasks/s or rise of the p99 checkout wait regarded as a regression
+    :param min_latency: the p99 checkout waits under it in seconds are noise and never regressions
+    :return: the descriptions of the regressions, empty if there is none
+    """
+    baseline_results = dict(((result["bench"], result["size"]), result) for result in baseline)
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get((result["bench"], result["size"]))
+        if baseline_result is None:
+            continue
+        name = "{} size:{}".format(result["bench"], result["size"])
+        if result["tasks_per_second"] < baseline_result["tasks_per_second"] * (1 - tolerance):
+            regressions.append("{} tasks/s {:.1f} < baseline {:.1f}".format(
+                name, result["tasks_per_second"], baseline_result["tasks_per_second"]))
+        p99, baseline_p99 = result["checkout_wait"]["p99"], baseline_result["checkout_wait"]["p99"]
+        if p99 is not None and baseline_p99 is not None and p99 > min_latency and \
+                p99 > baseline_p99 * (1 + tolerance):
+            regressions.append("{} checkout p99 {} ms > baseline {} ms".format(name, _ms(p99), _ms(baseline_p99)))
+    return regressions
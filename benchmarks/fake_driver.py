@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+_driver_ids = itertools.count(1)
+
+
+class FakeDriverSettings(object):
+    def __init__(self, launch_latency=0.05, page_load_latency=0.02, jitter=0.5, failure_rate=0.0,
+                 launch_failure_rate=0.0, page_size=2048, seed=None):
+        """
+        the behavior of the fake drivers, the latencies are in seconds
+        :param launch_latency: the seconds a fake browser takes to start
+        :param page_load_latency: the seconds driver.get takes
+        :param jitter: the latencies are drawn uniformly from latency * (1 - jitter) to latency * (1 + jitter)
+        :param failure_rate: the probability of driver.get raising a TimeoutException, about:blank never fails
+        :param launch_failure_rate: the probability of a launch raising a WebDriverException
+        :param page_size: the number of characters of the fake pages
+        :param seed: the seed of the random failures and latencies, default None not reproducible
+        """
+        self.launch_latency = launch_latency
+        self.page_load_latency = page_load_latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.launch_failure_rate = launch_failure_rate
+        self.page_size = page_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.launched_size = 0
+        self.quit_size = 0
+        self.get_size = 0
+
+    def latency(self, mean):
+        if mean <= 0:
+            return 0
+        with self._lock:
+            return mean * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def fails(self, rate):
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+class _FakeSwitchTo(object):
+    def __init__(self, driver):
+        self._driver = driver
+
+    def window(self, handle):
+        self._driver.current_window_handle = handle
+
+
+class FakeDriver(object):
+    """
+    answers the calls DriverPoll makes to a selenium driver, without any browser process
+    """
+
+    def __init__(self, settings, *args, **kwargs):
+        time.sleep(settings.latency(settings.launch_latency))
+        if settings.fails(settings.launch_failure_rate):
+            raise WebDriverException("fake driver failed to launch")
+        settings.count("launched_size")
+        self.settings = settings
+        self.session_id = "fake-{}".format(next(_driver_ids))
+        self.options = kwargs.get("chrome_options") or kwargs.get("firefox_options")
+        self.window_handles = ["main"]
+        self.current_window_handle = "main"
+        self.switch_to = _FakeSwitchTo(self)
+        self.current_url = "about:blank"
+        self.page_source = "<html><head></head><body></body></html>"
+        self.page_load_timeout = None
+        self.quitted = False
+
+    def set_page_load_timeout(self, timeout):
+        self.page_load_timeout = timeout
+
+    def set_window_size(self, width, height):
+        pass
+
+    def _check_session(self):
+        if self.quitted:
+            raise WebDriverException("invalid session id")
+
+    def get(self, url):
+        self._check_session()
+        latency = self.settings.latency(self.settings.page_load_latency)
+        if self.page_load_timeout is not None and latency > self.page_load_timeout:
+            time.sleep(self.page_load_timeout)
+            raise TimeoutException("timeout: Timed out receiving message from renderer")
+        time.sleep(latency)
+        self.settings.count("get_size")
+        # the blank page of a reset never reaches the network
+        if not url.startswith("about:") and self.settings.fails(self.settings.failure_rate):
+            raise TimeoutException("timeout: Timed out receiving message from renderer")
+        self.current_url = url
+        body = ("<p>{}</p>".format(url) * (self.settings.page_size // (len(url) + 7) + 1))[:self.settings.page_size]
+        self.page_source = "<html><head><title>{}</title></head><body>{}</body></html>".format(url, body)
+
+    def execute_script(self, script, *args):
+        self._check_session()
+        # the ping of the health check
+        if script.strip() == "return 1":
+            return 1
+        return None
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        self._check_session()
+        return {}
+
+    def delete_all_cookies(self):
+        self._check_session()
+
+    def close(self):
+        if len(self.window_handles) > 1:
+            self.window_handles.remove(self.current_window_handle)
+
+    def quit(self):
+        if not self.quitted:
+            self.quitted = True
+            self.settings.count("quit_size")
+
+
+@contextmanager
+def fake_webdriver(settings=None):
+    """
+    replace webdriver.Chrome and webdriver.Firefox with FakeDriver in the with block, the options and the profiles
+    are the real selenium ones
+    :param settings: the FakeDriverSettings, default the default settings
+    :return: the FakeDriverSettings, its counters tell the launches, the quits and the page loads
+    """
+    settings = settings if settings else FakeDriverSettings()
+
+    def _fake_driver(*args, **kwargs):
+        return FakeDriver(settings, *args, **kwargs)
+
+    real_drivers = webdriver.Chrome, webdriver.Firefox
+    webdriver.Chrome = webdriver.Firefox = _fake_driver
+    try:
+        yield settings
+    finally:
+        webdriver.Chrome, webdriver.Firefox = real_drivers
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeProxyServer(object):
+    def __init__(self, size=16, host="127.0.0.1", port=0, first_proxy_port=20000):
+        """
+        a local endpoint answering the proxy list in the format ProxyPool expects, the proxies are never connected
+        to by the fake drivers
+        :param size: the number of proxies in the list
+        :param port: the port to listen on, default 0 any free port
+        """
+        self.proxy_list = [{"ip": "127.0.0.{}".format(index % 250 + 2), "port": first_proxy_port + index}
+                           for index in range(size)]
+        self.request_size = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.request_size += 1
+                body = json.dumps({"code": 20000, "data": {"ips": server.proxy_list}}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer((host, port), _Handler)
+        self._server_thd = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}/proxies".format(host, port)
+
+    def start(self):
+        if self._server_thd is None:
+            self._server_thd = threading.Thread(target=self._server.serve_forever)
+            self._server_thd.setDaemon(True)
+            self._server_thd.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
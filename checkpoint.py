@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import uuid
+from .common.log import Logger
+
+_logger = Logger(__name__).logger
+
+
+class TaskJournal(object):
+    def __init__(self, path, compact_threshold=10000, logger=None):
+        """
+        the append only journal of the enqueued and the completed tasks, one json object per line, so that a killed
+        spider resumes the tasks not completed
+        :param path: the journal file, the dedupe filter of the frontier is saved next to it as path.seen
+        :param compact_threshold: rewrite the journal with only the pending tasks when this number of lines are
+                                  appended since the last rewrite and most of them are completed
+        """
+        self.path = path
+        self.seen_path = path + ".seen"
+        self.compact_threshold = compact_threshold
+        self.logger = _logger if not logger else logger
+        self._lock = threading.Lock()
+        self._file = None
+        # journal id -> the put line of the pending tasks
+        self._pending_lines = {}
+        self._appended_size = 0
+        self._unserializable_size = 0
+        self._seen_state_func = None
+        # the ids given to the tasks whose put lines are not written yet
+        self._putting_ids = set()
+        # the tasks completed before their put lines are written
+        self._early_done_ids = set()
+
+    def load(self):
+        """
+        read the journal left by the last run and open it for appending
+        :return: (the states of the pending tasks, the fingerprints of all the tasks enqueued, the saved dedupe filter
+                 state), the states are empty if there is nothing to resume
+        """
+        put_lines, done_ids, fingerprints = {}, set(), []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line may be cut by the kill
+                        continue
+                    if record["op"] == "put":
+                        put_lines[record["id"]] = line if line.endswith("\n") else line + "\n"
+                        if record.get("fingerprint"):
+                            fingerprints.append(record["fingerprint"])
+                    elif record["op"] == "done":
+                        done_ids.add(record["id"])
+        seen_state = None
+        if os.path.exists(self.seen_path):
+            with open(self.seen_path, "rb") as f:
+                seen_state = f.read()
+        with self._lock:
+            # the done line of a task may be written before its put line, the order does not matter
+            self._pending_lines = dict((journal_id, line) for journal_id, line in put_lines.items()
+                                       if journal_id not in done_ids)
+            pending_states = [json.loads(line)["task"] for line in self._pending_lines.values()]
+            self._appended_size = len(put_lines) + len(done_ids)
+        if pending_states or fingerprints or seen_state:
+            self.logger.info("resume {} pending tasks from the journal {}.".format(len(pending_states), self.path))
+        return pending_states, fingerprints, seen_state
+
+    def set_seen_state_func(self, seen_state_func):
+        """
+        :param seen_state_func: returns the bytes of the dedupe filter, saved when the journal is rewritten
+        """
+        self._seen_state_func = seen_state_func
+
+    def _append(self, line):
+        if self._file is None:
+            self._file = open(self.path, "a")
+        self._file.write(line)
+        # the lines survive a killed process once they are in the os buffer
+        self._file.flush()
+        self._appended_size += 1
+
+    def assign_id(self, task):
+        """
+        give the task its journal id, before it can be got from the task queue, put or cancel must follow
+        """
+        if not getattr(task, "journal_id", None):
+            task.journal_id = uuid.uuid4().hex
+            with self._lock:
+                self._putting_ids.add(task.journal_id)
+
+    def cancel(self, task):
+        """
+        the task given its id is not put, e.g. it is dropped as a duplicate or can not be serialized
+        """
+        journal_id = getattr(task, "journal_id", None)
+        if journal_id is None:
+            return
+        task.journal_id = None
+        with self._lock:
+            self._putting_ids.discard(journal_id)
+            self._early_done_ids.discard(journal_id)
+
+    def put(self, task, state, fingerprint=None):
+        """
+        :param state: the json serializable state of the task
+        :return: False if the state can not be serialized, the task is not resumed after a kill then
+        """
+        self.assign_id(task)
+        journal_id = task.journal_id
+        try:
+            line = json.dumps({"op": "put", "id": journal_id, "fingerprint": fingerprint,
+                               "task": dict(state, journal_id=journal_id)}) + "\n"
+        except (TypeError, ValueError) as e:
+            self._unserializable_size += 1
+            if self._unserializable_size == 1:
+                self.logger.warning("the task kw:{} url:{} can not be saved to the journal, it is not resumed after a "
+                                    "kill. a task is saved when its kw is json serializable and its handle_func is a "
+                                    "method of the spider or a module level function, error info: {}".format(
+                                        task.kw, task.url, e))
+            self.cancel(task)
+            return False
+        with self._lock:
+            self._putting_ids.discard(journal_id)
+            if journal_id in self._early_done_ids:
+                self._early_done_ids.discard(journal_id)
+            else:
+                self._pending_lines[journal_id] = line
+            self._append(line)
+        return True
+
+    def done(self, journal_id):
+        if journal_id is None:
+            return
+        with self._lock:
+            if self._pending_lines.pop(journal_id, None) is None:
+                if journal_id not in self._putting_ids:
+                    # the task is not in the journal, e.g. it can not be serialized
+                    return
+                self._early_done_ids.add(journal_id)
+            self._append(json.dumps({"op": "done", "id": journal_id}) + "\n")
+            if self._appended_size >= self.compact_threshold and \
+                    self._appended_size > 2 * len(self._pending_lines):
+                self._rewrite()
+
+    def _rewrite(self):
+        """
+        replace the journal with the put lines of the pending tasks, the caller must hold the lock
+        """
+        if self._seen_state_func is not None:
+            seen_state = self._seen_state_func()
+            if seen_state is not None:
+                self._write_atomically(self.seen_path, seen_state, "wb")
+        self._write_atomically(self.path, "".join(self._pending_lines.values()), "w")
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "a")
+        self._appended_size = 0
+
+    @staticmethod
+    def _write_atomically(path, content, mode):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def compact(self):
+        """
+        rewrite the journal now, e.g. after the dedupe filter is restored from it
+        """
+        with self._lock:
+            self._rewrite()
+
+    def close(self, remove=False):
+        """
+        :param remove: delete the journal, all the tasks are completed
+        """
+        with self._lock:
+            if self._file is not None:
+                if not remove:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+            if remove:
+                for path in (self.path, self.seen_path):
+                    if os.path.exists(path):
+                        os.remove(path)
@@ -1,12 +1,23 @@
 # coding=utf-8
 import signal
+import weakref
+
+# every Killer of the process receives the signal, the Killers of the finished spiders are dropped with them
+_killers = weakref.WeakSet()
+
+
+def _graceful_exit(signum, frame):
+    for registered_killer in list(_killers):
+        registered_killer.graceful_exit(signum, frame)
 
 
 class Killer(object):
     def __init__(self):
         self._kill_now = False
-        signal.signal(signal.SIGINT, self.graceful_exit)
-        signal.signal(signal.SIGTERM, self.graceful_exit)
+        _killers.add(self)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            if signal.getsignal(signum) is not _graceful_exit:
+                signal.signal(signum, _graceful_exit)
 
     def graceful_exit(self, signum, frame):
         self._kill_now = True
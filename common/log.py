@@ -1,7 +1,223 @@
 # -*- coding: utf-8 -*-
+import atexit
+import itertools
+import json
 import logging
+import multiprocessing.util
 import os
-from logging.handlers import TimedRotatingFileHandler
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from queue import Full, Queue
+
+# the attributes every LogRecord has, the others are the extra fields of the log call
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))) | {"message", "asctime"}
+# the names of the loggers created by Logger -> the handlers Logger attached to them
+_logger_handlers = {}
+_log_config = None
+_log_config_lock = threading.RLock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    one json object per record, the extra fields of the log call, e.g. extra={"event": "task_enqueue"}, are kept
+    """
+
+    def format(self, record):
+        data = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + ".{:03d}".format(
+                int(record.msecs)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        """
+        keep 1 of every n records of the high volume events, the kept records get the sampled field n
+        :param rates: {event or logger name: n}, the event is the event field of the extra of the log call
+        """
+        super(SamplingFilter, self).__init__()
+        self.rates = dict(rates)
+        self._counters = dict((key, itertools.count()) for key in self.rates)
+
+    def filter(self, record):
+        key = getattr(record, "event", None)
+        if key not in self.rates:
+            key = record.name
+            if key not in self.rates:
+                return True
+        rate = self.rates[key]
+        # next on an itertools.count is atomic, no lock is needed
+        if next(self._counters[key]) % rate:
+            return False
+        if rate > 1:
+            record.sampled = rate
+        return True
+
+
+class _AsyncQueueHandler(QueueHandler):
+    """
+    the records are put in a bounded queue and written by the listener thread, they are dropped when it is full
+    instead of blocking the crawl
+    """
+
+    def __init__(self, queue):
+        super(_AsyncQueueHandler, self).__init__(queue)
+        self.dropped_size = 0
+
+    def prepare(self, record):
+        # only the message is rendered in the calling thread, the listener formats the record
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped_size += 1
+
+
+class _AsyncQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # the queue may be full of dropped records, the stop waits for the listener to make room
+        self.queue.put(self._sentinel)
+
+
+def _apply_config(logger, name):
+    """
+    the caller must hold _log_config_lock
+    """
+    for handler in _logger_handlers.get(name, []):
+        logger.removeHandler(handler)
+    handlers = list(_log_config["handlers"])
+    for handler in handlers:
+        logger.addHandler(handler)
+    _logger_handlers[name] = handlers
+    level = _log_config["level"]
+    matched_length = -1
+    for logger_name, logger_level in _log_config["levels"].items():
+        if (name == logger_name or name.startswith(logger_name + ".")) and len(logger_name) > matched_length:
+            level, matched_length = logger_level, len(logger_name)
+    logger.setLevel(level)
+
+
+def setup_logging(async_mode=True, json_format=False, level=logging.DEBUG, levels=None, sample=None, log_folder="",
+                  queue_size=10000, stream=None):
+    """
+    replace the handlers of the loggers created by Logger, before and after the call, the loggers passed to the
+    classes as the logger param are not changed
+    :param async_mode: the log calls only put the records in a queue, a background thread writes them, so that the
+                       io never blocks the workers, the records are dropped when queue_size records are waiting
+    :param json_format: write one json object per record
+    :param level: the level of the loggers
+    :param levels: {logger name: level}, the level of the loggers and their children, e.g.
+                   {"DriverPool.core_spider": "WARNING"}
+    :param sample: {event or logger name: n}, keep 1 of every n records, e.g. {"task_enqueue": 100}, the events are
+                   task_enqueue, goto_retry and task_error
+    :param log_folder: also write to a daily rotating file in it
+    :param stream: the stream written to, default sys.stderr
+    """
+    global _log_config
+    formatter = JsonFormatter() if json_format else Logger.get_formatter()
+    target_handlers = [logging.StreamHandler(stream)]
+    if log_folder:
+        if not os.path.exists(log_folder):
+            os.makedirs(log_folder, exist_ok=True)
+        file_handler = TimedRotatingFileHandler(filename=os.path.join(log_folder, "driver_pool_pid_{}.log".format(
+            os.getpid())), when="D", interval=1, backupCount=30)
+        file_handler.suffix = "%Y-%m-%d"
+        target_handlers.append(file_handler)
+    for handler in target_handlers:
+        handler.setFormatter(formatter)
+    with _log_config_lock:
+        stop_logging()
+        listener = None
+        if async_mode:
+            handlers = [_AsyncQueueHandler(Queue(queue_size))]
+            listener = _AsyncQueueListener(handlers[0].queue, *target_handlers)
+            listener.start()
+        else:
+            handlers = target_handlers
+        if sample:
+            for handler in handlers:
+                handler.addFilter(SamplingFilter(sample))
+        _log_config = {
+            "handlers": handlers,
+            "target_handlers": target_handlers,
+            "listener": listener,
+            "level": level,
+            "levels": dict(levels) if levels else {},
+        }
+        for name in list(_logger_handlers):
+            _apply_config(logging.getLogger(name), name)
+
+
+def stop_logging():
+    """
+    write the records waiting in the queue and stop the listener thread of the async mode, the loggers write
+    synchronously after it
+    """
+    with _log_config_lock:
+        if not _log_config or _log_config["listener"] is None:
+            return
+        _log_config["listener"].stop()
+        _log_config["listener"] = None
+        # the loggers write synchronously from now on, with the same sampling
+        for queue_handler in _log_config["handlers"]:
+            for log_filter in queue_handler.filters:
+                for handler in _log_config["target_handlers"]:
+                    handler.addFilter(log_filter)
+        _log_config["handlers"] = _log_config["target_handlers"]
+        for name in list(_logger_handlers):
+            _apply_config(logging.getLogger(name), name)
+
+
+def dropped_log_size():
+    """
+    :return: the number of records dropped because the queue of the async mode was full
+    """
+    with _log_config_lock:
+        if not _log_config:
+            return 0
+        return sum(getattr(handler, "dropped_size", 0) for handler in _log_config["handlers"])
+
+
+def _restart_listener_in_child():
+    # the listener thread is not forked, the child writes its records with a new queue and listener
+    global _log_config_lock
+    _log_config_lock = threading.RLock()
+    if not _log_config or _log_config["listener"] is None:
+        return
+    handler = _log_config["handlers"][0]
+    handler.queue = Queue(handler.queue.maxsize)
+    _log_config["listener"] = _AsyncQueueListener(handler.queue, *_log_config["target_handlers"])
+    _log_config["listener"].start()
+    # a multiprocessing worker exits with os._exit, atexit does not flush the queue there
+    multiprocessing.util.Finalize(None, stop_logging, exitpriority=0)
+
+
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_in_child)
 
 
 class Logger(object):
@@ -34,6 +250,17 @@ class Logger(object):
         return file_handler
 
     def setting_logger(self):
+        with _log_config_lock:
+            if _log_config is not None:
+                # setup_logging was called, the logger shares its handlers
+                _apply_config(self.logger, self.name)
+                self.stream_handler.close()
+                self.stream_handler = None
+                if self.file_holder:
+                    self.file_holder.close()
+                    self.file_holder = None
+                return
+            _logger_handlers[self.name] = [handler for handler in (self.file_holder, self.stream_handler) if handler]
         self.logger.setLevel(logging.DEBUG)
         if self.file_holder:
             self.file_holder.setLevel(logging.INFO)
@@ -47,4 +274,5 @@ class Logger(object):
     def __del__(self):
         if self.file_holder:
             self.file_holder.close()
-        self.stream_handler.close()
\ No newline at end of file
+        if self.stream_handler:
+            self.stream_handler.close()
\ No newline at end of file
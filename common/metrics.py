@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key):
+    if not label_key:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in label_key) + "}"
+
+
+class Histogram(object):
+    __slots__ = ("buckets", "bucket_counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """
+        the upper bound of the bucket the q quantile falls in
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "avg": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Meter(object):
+    """
+    the event rate over the last window seconds, counted in one second buckets
+    """
+    __slots__ = ("window", "_buckets")
+
+    def __init__(self, window=60):
+        self.window = window
+        self._buckets = deque()
+
+    def mark(self, value=1):
+        second = int(time.time())
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += value
+        else:
+            self._buckets.append([second, value])
+        self._expire(second)
+
+    def _expire(self, second):
+        while self._buckets and self._buckets[0][0] <= second - self.window:
+            self._buckets.popleft()
+
+    def rate(self):
+        self._expire(int(time.time()))
+        return sum(value for _, value in self._buckets) / float(self.window)
+
+
+class Metrics(object):
+    def __init__(self, prefix="driver_pool"):
+        """
+        the counters, gauges, histograms and meters of the driver pool and the spider, all the methods are thread safe
+        :param prefix: the prefix of the metric names in the prometheus text
+        """
+        self.prefix = prefix
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_callbacks = {}
+        self._histograms = {}
+        self._meters = {}
+        self._dump_thd = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def add_gauge_callback(self, name, callback, **labels):
+        """
+        :param callback: called without arguments when a snapshot is taken, returns the gauge value
+        """
+        with self._lock:
+            self._gauge_callbacks[(name, _label_key(labels))] = callback
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def mark(self, name, value=1):
+        with self._lock:
+            meter = self._meters.get(name)
+            if meter is None:
+                meter = self._meters[name] = Meter()
+            meter.mark(value)
+
+    def snapshot(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            gauge_callbacks = dict(self._gauge_callbacks)
+            histograms = dict((key, histogram.snapshot()) for key, histogram in self._histograms.items())
+            meters = dict((name, meter.rate()) for name, meter in self._meters.items())
+        for key, callback in gauge_callbacks.items():
+            try:
+                gauges[key] = callback()
+            except Exception:
+                continue
+
+        def _flatten(metric_dict):
+            return dict((name + _format_labels(label_key), value) for (name, label_key), value in metric_dict.items())
+
+        return {
+            "uptime": time.time() - self.start_time,
+            "counters": _flatten(counters),
+            "gauges": _flatten(gauges),
+            "histograms": _flatten(histograms),
+            "rates": meters,
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def to_prometheus(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict((key, (histogram.buckets, list(histogram.bucket_counts), histogram.count,
+                                     histogram.sum)) for key, histogram in self._histograms.items())
+            meters = dict((name, meter.rate()) for name, meter in self._meters.items())
+            gauge_callbacks = dict(self._gauge_callbacks)
+            gauges = dict(self._gauges)
+        for key, callback in gauge_callbacks.items():
+            try:
+                gauges[key] = callback()
+            except Exception:
+                continue
+        lines = []
+        for (name, label_key), value in sorted(counters.items()):
+            lines.append("{}_{}{} {}".format(self.prefix, name, _format_labels(label_key), value))
+        for (name, label_key), value in sorted(gauges.items()):
+            lines.append("{}_{}{} {}".format(self.prefix, name, _format_labels(label_key), value))
+        for name, value in sorted(meters.items()):
+            lines.append("{}_{}_per_second {}".format(self.prefix, name, value))
+        for (name, label_key), (buckets, bucket_counts, count, total) in sorted(histograms.items()):
+            cumulative = 0
+            for bucket, bucket_count in zip(list(buckets) + ["+Inf"], bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(label_key + (("le", bucket), ))
+                lines.append("{}_{}_bucket{} {}".format(self.prefix, name, bucket_labels, cumulative))
+            lines.append("{}_{}_count{} {}".format(self.prefix, name, _format_labels(label_key), count))
+            lines.append("{}_{}_sum{} {}".format(self.prefix, name, _format_labels(label_key), total))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, file_path, fmt="json"):
+        """
+        :param fmt: json or prometheus
+        """
+        content = self.to_prometheus() if fmt == "prometheus" else self.to_json()
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+
+    def start_dump(self, file_path, interval=60, fmt="json"):
+        """
+        dump the metrics to file_path every interval seconds in a daemon thread
+        """
+        def _dump_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(file_path, fmt=fmt)
+                except Exception:
+                    continue
+
+        if self._dump_thd is None:
+            self._dump_thd = threading.Thread(target=_dump_loop)
+            self._dump_thd.setDaemon(True)
+            self._dump_thd.start()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# the process helpers of the driver health checks, they read /proc and find nothing on the systems without it
+import os
+import signal
+import time
+
+_PROC = "/proc"
+
+
+def _read_stat(pid):
+    """
+    :return: the fields of /proc/<pid>/stat after the process name, and the process name
+    """
+    with open(os.path.join(_PROC, str(pid), "stat")) as f:
+        content = f.read()
+    # the process name is in parentheses and may contain spaces
+    name = content[content.index("(") + 1:content.rindex(")")]
+    return content[content.rindex(")") + 2:].split(), name
+
+
+def children_map():
+    """
+    :return: {pid: [child pid, ...]} of all the processes
+    """
+    children = {}
+    if not os.path.isdir(_PROC):
+        return children
+    for entry in os.listdir(_PROC):
+        if not entry.isdigit():
+            continue
+        try:
+            fields, _ = _read_stat(entry)
+        except (IOError, OSError, ValueError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    return children
+
+
+def process_tree(pid, children=None):
+    """
+    :return: the pid and the pids of all its descendants
+    """
+    children = children if children is not None else children_map()
+    pid_list = [pid]
+    index = 0
+    while index < len(pid_list):
+        pid_list.extend(children.get(pid_list[index], []))
+        index += 1
+    return pid_list
+
+
+def process_rss(pid):
+    """
+    :return: the resident memory of the process in bytes, None if it is gone
+    """
+    try:
+        with open(os.path.join(_PROC, str(pid), "statm")) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def tree_rss(pid, children=None):
+    """
+    :return: the resident memory of the process and all its descendants in bytes
+    """
+    return sum(rss for rss in (process_rss(tree_pid) for tree_pid in process_tree(pid, children)) if rss)
+
+
+def process_info(pid):
+    """
+    :return: (name, parent pid, age in seconds) of the process, None if it is gone
+    """
+    try:
+        fields, name = _read_stat(pid)
+        with open(os.path.join(_PROC, "stat")) as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+    except (IOError, OSError, ValueError, StopIteration):
+        return None
+    start_time = boot_time + int(fields[19]) / float(os.sysconf("SC_CLK_TCK"))
+    return name, int(fields[1]), time.time() - start_time
+
+
+def kill_process_tree(pid, children=None):
+    """
+    kill the process and all its descendants
+    :return: the number of processes killed
+    """
+    killed_size = 0
+    for tree_pid in reversed(process_tree(pid, children)):
+        try:
+            os.kill(tree_pid, signal.SIGKILL)
+            killed_size += 1
+        except OSError:
+            continue
+    return killed_size
+
+
+def load_average():
+    """
+    :return: the 1 minute load average of the system, None if it is unknown
+    """
+    try:
+        with open(os.path.join(_PROC, "loadavg")) as f:
+            return float(f.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def available_memory():
+    """
+    :return: the bytes of memory available for new processes without swapping, None if it is unknown
+    """
+    fields = {}
+    try:
+        with open(os.path.join(_PROC, "meminfo")) as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                fields[name] = int(value.split()[0]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    if "MemAvailable" in fields:
+        return fields["MemAvailable"]
+    # the kernels before 3.14 do not estimate it
+    if "MemFree" in fields:
+        return fields["MemFree"] + fields.get("Cached", 0) + fields.get("Buffers", 0)
+    return None
@@ -1,10 +1,21 @@
-from .driver_pool import DriverPoll
+from .driver_pool import DriverPoll, LazyDriver, SpiderKilled
+from .frontier import TaskFrontier
+from .checkpoint import TaskJournal
+from .autoscaler import Autoscaler
+from .redis_intake import RedisTaskIntake
 from redis import StrictRedis
 from .common.log import Logger
 import threading
-from queue import Queue
-from collections import Iterable
+from queue import Empty
+from collections.abc import Iterable
 import abc
+import importlib
+import inspect
+import logging
+import multiprocessing
+import os
+import signal
+import socket
 from .common.killer import Killer
 import time
 
@@ -12,26 +23,223 @@ _logger = Logger(__name__).logger
 
 
 class Task(object):
-    def __init__(self, handle_func, kw=None, url=None):
+    def __init__(self, handle_func, kw=None, url=None, priority=0, depth=None, dont_filter=False, fetch=None,
+                 affinity=None):
+        """
+        :param priority: the task with the higher priority is handled first, default 0
+        :param depth: default None the depth of the task generating it plus 1, 0 for the initial tasks
+        :param dont_filter: do not drop the task even if a task with the same url and kw was enqueued before
+        :param fetch: browser, http or auto, how goto loads the pages of the task, default None the fetch_mode of
+                      the spider
+        :param affinity: the affinity key, e.g. the account the task is logged in with, the tasks with the same key
+                         run on the same driver with its cookies kept, pass affinity=task.affinity to the tasks
+                         yielded from a logged in page, default None any driver with its cookies deleted
+        """
         self.kw = kw
         self.url = url
         self.handle_func = handle_func
+        self.priority = priority
+        self.depth = depth
+        self.dont_filter = dont_filter
+        self.fetch = fetch
+        self.affinity = affinity
+
+    def __getstate__(self):
+        # a bound method of the spider is sent by name, the process receiving it binds it to its own spider
+        state = self.__dict__.copy()
+        if inspect.ismethod(self.handle_func) and isinstance(self.handle_func.__self__, CoreSpider):
+            state["handle_func"] = self.handle_func.__name__
+        return state
+
+    def journal_state(self):
+        """
+        the state of __getstate__ with a module level handle_func referenced as module:qualname, so that it can be
+        saved as json
+        """
+        state = self.__getstate__()
+        if not isinstance(state["handle_func"], str):
+            reference = "{}:{}".format(getattr(self.handle_func, "__module__", None),
+                                       getattr(self.handle_func, "__qualname__", None))
+            try:
+                if _resolve_handle_func(reference) == self.handle_func:
+                    state["handle_func"] = reference
+            except (ImportError, AttributeError, ValueError):
+                # e.g. a lambda or a nested function, the journal warns that the task can not be saved
+                pass
+        return state
+
+    @classmethod
+    def from_state(cls, state, spider):
+        """
+        the task of a state from __getstate__ or journal_state, its handle_func is bound to the spider
+        """
+        task = cls.__new__(cls)
+        task.__dict__.update(state)
+        if isinstance(task.handle_func, str):
+            if ":" in task.handle_func:
+                task.handle_func = _resolve_handle_func(task.handle_func)
+            else:
+                task.handle_func = getattr(spider, task.handle_func)
+        return task
+
+
+def _resolve_handle_func(reference):
+    """
+    :param reference: module:qualname of a module level function, or of a method of a module level class
+    """
+    module_name, _, qualname = reference.partition(":")
+    if "<" in qualname:
+        raise ValueError("{} is not reachable from its module".format(reference))
+    handle_func = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        handle_func = getattr(handle_func, name)
+    return handle_func
+
+
+class _ProcessTaskQueue(object):
+    """
+    the task queue of a worker process, the tasks come from the spider process and the generated tasks are sent back
+    """
+
+    def __init__(self, spider, work_queue, result_queue):
+        self._spider = spider
+        self._work_queue = work_queue
+        self._result_queue = result_queue
+        self._local = threading.local()
+
+    def get(self):
+        self._local.task = None
+        while True:
+            if self._spider.killed.kill_now:
+                return None
+            try:
+                task = self._work_queue.get(timeout=1)
+            except Empty:
+                continue
+            if task is not None and isinstance(task.handle_func, str):
+                task.handle_func = getattr(self._spider, task.handle_func)
+            self._local.task = task
+            return task
+
+    def put(self, task):
+        self._result_queue.put(("task", task))
+
+    def task_done(self):
+        # the stop signal is not a task of the spider process
+        if self._local.task is not None:
+            self._result_queue.put(("done", getattr(self._local.task, "journal_id", None)))
+
+    def qsize(self):
+        return self._work_queue.qsize()
 
 
 class CoreSpider(abc.ABC):
     def __init__(self, concurrent=8, driver="chrome", proxy_url="", save_folder="./file_download",
                  only_html=False, no_js=False, headless=False, driver_log_path="driver.log",
                  logger=None, proxy_scheme="http", timeout=60, driver_time_limit=60 * 5, driver_use_limit=8,
-                 execute_path="", window_size=None):
+                 execute_path="", window_size=None, min_idle=0, idle_timeout=None, pre_warm=True, pipelines=None,
+                 processes=1, metrics_path=None, metrics_interval=60, metrics_format="json", max_queue_size=0,
+                 dedupe=True, bloom_capacity=1000000, max_per_host=None, host_delay=0, block_url_patterns=None,
+                 health_check_interval=None, max_driver_memory=None, page_cache=None, fetch_mode="browser",
+                 checkpoint_path=None, checkpoint_compact_threshold=10000, affinity_wait=5, autoscale=False,
+                 min_concurrent=1, max_concurrent=None, autoscale_interval=10, download_handler=None,
+                 download_done_folder=None):
+        """
+        :param processes: the number of worker processes, each one owns a shard of the concurrent drivers and runs
+                          the handle_func of its tasks, default 1 run everything in this process. the handle_func
+                          of the tasks must be a method of the spider or a module level function when it is
+                          greater than 1
+        :param metrics_path: dump the metrics of the pool and the spider to the file every metrics_interval seconds,
+                             the worker processes dump to metrics_path.worker_<n>, default None do not dump
+        :param metrics_format: json or prometheus, default json
+        :param max_queue_size: the max number of tasks waiting in the task queue, the producers block when it is
+                               full, default 0 unbounded
+        :param dedupe: drop the tasks whose url and kw were enqueued before, default True
+        :param bloom_capacity: the number of task fingerprints the dedupe filter is sized for
+        :param max_per_host: the max number of goto in flight per host, the tasks of the other hosts are handled
+                             first while a host is busy, with processes > 1 it is the limit of each worker process
+        :param host_delay: the min seconds between two goto to the same host, backing off after the failed goto
+        :param block_url_patterns: the url patterns the drivers never load, e.g. the ads and the trackers, chrome only
+        :param health_check_interval: ping the idle drivers and kill the orphan driver services every
+                                      health_check_interval seconds, default None no health check
+        :param max_driver_memory: restart the idle driver using more memory than it in MB, default None no limit
+        :param page_cache: the PageCache of goto, a task only loading the cached pages never waits for a driver,
+                           default None no cache
+        :param fetch_mode: browser, http or auto, http and auto fetch the static pages with plain http requests and
+                           only query a driver for the pages needing javascript, default browser
+        :param checkpoint_path: the journal of the enqueued and the completed tasks, a killed spider resumes the tasks
+                                not completed from it instead of calling task_create, it is deleted when all the
+                                tasks are completed, only the tasks whose kw is json serializable and whose
+                                handle_func is a method of the spider or a module level function are saved,
+                                default None no journal
+        :param checkpoint_compact_threshold: the number of journal lines after which the completed tasks are
+                                             removed from the journal
+        :param affinity_wait: the seconds a task with an affinity key waits for the driver pinned to the key, before
+                              it runs on another driver and has to log in again, with processes > 1 only the tasks
+                              sent to the same worker process share the pinned driver
+        :param autoscale: resize the driver pool and the consumers between min_concurrent and max_concurrent by the
+                          task queue depth, the checkout wait, the cpu load and the free memory, concurrent is the
+                          initial size, only with processes = 1
+        :param min_concurrent: the min size of the autoscaled driver pool
+        :param max_concurrent: the max size of the autoscaled driver pool, default twice concurrent
+        :param autoscale_interval: the seconds between two checks of the autoscaler
+        :param download_handler: called in a background thread with the path of every file a task downloaded, after
+                                 the task returns, the file is deleted after it returns unless it is moved away,
+                                 it must be a module level function when processes is greater than 1, default None
+        :param download_done_folder: the files the tasks downloaded are moved into it when there is no
+                                     download_handler, default None the files are kept under save_folder when
+                                     neither is set
+        """
         self._concurrent = concurrent
-        self._task_queue = Queue()
-        self.driver_poll = DriverPoll(driver=driver, proxy_url=proxy_url, save_folder=save_folder, only_html=only_html,
-                                      no_js=no_js, headless=headless, driver_log_path=driver_log_path, logger=logger,
-                                      proxy_scheme=proxy_scheme, timeout=timeout, driver_size=concurrent,
-                                      driver_time_limit=driver_time_limit, driver_use_limit=driver_use_limit,
-                                      execute_path=execute_path, window_size=window_size)
+        self._processes = max(1, min(processes, concurrent))
+        self._consumer_thd_list = []
+        self._consumer_lock = threading.Lock()
+        # the consumers asked to quit after their current task, the pool was autoscaled down
+        self._retiring_consumer_size = 0
+        self._consumers_stopping = False
+        self._driver_poll_kwargs = dict(
+            driver=driver, proxy_url=proxy_url, save_folder=save_folder, only_html=only_html, no_js=no_js,
+            headless=headless, driver_log_path=driver_log_path, logger=logger, proxy_scheme=proxy_scheme,
+            timeout=timeout, driver_size=concurrent, driver_time_limit=driver_time_limit,
+            driver_use_limit=driver_use_limit, execute_path=execute_path, window_size=window_size, min_idle=min_idle,
+            idle_timeout=idle_timeout, max_per_host=max_per_host, host_delay=host_delay,
+            block_url_patterns=block_url_patterns, health_check_interval=health_check_interval,
+            max_driver_memory=max_driver_memory, page_cache=page_cache, fetch_mode=fetch_mode,
+            affinity_wait=affinity_wait, download_handler=download_handler,
+            download_done_folder=download_done_folder)
+        self.driver_poll = DriverPoll(**self._driver_poll_kwargs)
+        self._metrics_path = metrics_path
+        self._metrics_interval = metrics_interval
+        self._metrics_format = metrics_format
+        self._init_metrics()
+        # a consumer is always left to drain the full queue while the others block putting their generated tasks
+        self._task_queue = TaskFrontier(max_size=max_queue_size, dedupe=dedupe, bloom_capacity=bloom_capacity,
+                                        max_waiting_putters=max(concurrent - 1, 1), metrics=self.metrics,
+                                        host_ready=self._host_ready)
+        self._journal = TaskJournal(checkpoint_path, compact_threshold=checkpoint_compact_threshold,
+                                    logger=logger) if checkpoint_path else None
+        self._pre_warm = pre_warm
+        self._pipelines = list(pipelines) if pipelines else []
         self.killed = Killer()
         self.logger = _logger if not logger else logger
+        self.autoscaler = None
+        if autoscale and self._processes == 1:
+            max_concurrent = max_concurrent if max_concurrent else concurrent * 2
+            self.autoscaler = Autoscaler(self.driver_poll, min(min_concurrent, concurrent),
+                                         max(max_concurrent, concurrent), queue_size_func=self._task_queue.qsize,
+                                         on_resize=self._resize_consumers, interval=autoscale_interval,
+                                         logger=logger)
+        elif autoscale:
+            self.logger.warning("the autoscaler only works with processes = 1, the driver pools are not resized.")
+
+    def _init_metrics(self):
+        self.metrics = self.driver_poll.metrics
+        self.metrics.add_gauge_callback("task_queue_size", lambda: self._task_queue.qsize())
+
+    def _start_metrics_dump(self, suffix=""):
+        if self._metrics_path:
+            self.metrics.start_dump(self._metrics_path + suffix, interval=self._metrics_interval,
+                                    fmt=self._metrics_format)
 
     def _task_pop(self):
         task = self._task_queue.get()
@@ -40,10 +248,60 @@ class CoreSpider(abc.ABC):
         else:
             return None
 
-    def _task_push(self, task):
+    def _host_ready(self, url):
+        host_scheduler = self.driver_poll.host_scheduler
+        return host_scheduler is None or host_scheduler.ready(url)
+
+    def _task_push(self, task, dedupe=True):
+        """
+        :param dedupe: drop the task if it is a duplicate, default True
+        :return: False if the task is dropped as a duplicate
+        """
         if task:
-            self.logger.info("enqueue task kw:{} url:{}".format(task.kw, task.url))
-        self._task_queue.put(task)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("enqueue task kw:{} url:{}".format(task.kw, task.url),
+                                 extra={"event": "task_enqueue"})
+            if self._journal is not None:
+                self._journal.assign_id(task)
+        if self._task_queue.put(task, dedupe=dedupe) is False:
+            if task and self._journal is not None:
+                self._journal.cancel(task)
+            return False
+        if task and self._journal is not None:
+            self._journal.put(task, task.journal_state(), fingerprint=self._task_queue.fingerprint(task))
+        return True
+
+    def _resume_tasks(self):
+        """
+        push the tasks the killed run left in the journal
+        :return: False if there is no journal to resume from
+        """
+        if self._journal is None:
+            return False
+        pending_states, fingerprints, seen_state = self._journal.load()
+        self._task_queue.restore_seen(seen_state, fingerprints)
+        self._journal.set_seen_state_func(self._task_queue.seen_state)
+        # the fingerprints of the completed tasks are kept in the saved dedupe filter from now on
+        self._journal.compact()
+        if not (pending_states or fingerprints or seen_state):
+            return False
+        for state in pending_states:
+            # they are in the journal and the dedupe filter already
+            self._task_queue.put(Task.from_state(state, self), dedupe=False)
+        return True
+
+    def _init_tasks(self):
+        if not self._resume_tasks():
+            self.init_task_enqueue()
+
+    def _close_journal(self):
+        if self._journal is None:
+            return
+        if self.killed.kill_now:
+            self._journal.compact()
+            self._journal.close()
+        else:
+            self._journal.close(remove=True)
 
     @abc.abstractmethod
     def task_create(self):
@@ -58,78 +316,345 @@ class CoreSpider(abc.ABC):
         self._task_push(task)
 
     def exchange_driver(self, driver):
+        if isinstance(driver, LazyDriver):
+            # the task keeps the LazyDriver, it is given the new driver, which the consumer returns to the pool
+            if driver.acquired and not self.driver_poll.dequeue_driver(driver):
+                self.logger.warning("fail to exchange driver, the deriver is not belong to driver pool")
+                return None
+            driver.forget()
+            return driver.acquire()
         if self.driver_poll.dequeue_driver(driver):
             return self.driver_poll.query_driver()
         else:
             self.logger.warning("fail to exchange driver, the deriver is not belong to driver pool")
 
+    def process_item(self, item):
+        for pipeline in self._pipelines:
+            item = pipeline.process_item(item, self)
+            if item is None:
+                break
+
+    def _handle_output(self, output, task):
+        if output is None:
+            return
+        if isinstance(output, Task):
+            if output.depth is None:
+                output.depth = (task.depth or 0) + 1
+            self._task_push(output)
+        else:
+            self.process_item(output)
+
+    def _handle_task(self, task, driver):
+        result = task.handle_func(task, driver)
+        if isinstance(result, Iterable) and not isinstance(result, (str, bytes, dict)):
+            # the generated tasks are pushed while the handler is still running
+            for output in result:
+                self._handle_output(output, task)
+        else:
+            self._handle_output(result, task)
+
+    def _finish_task(self, task):
+        """
+        called after the handle_func of the task returned or raised
+        """
+        if self._journal is not None:
+            self._journal.done(getattr(task, "journal_id", None))
+
+    def _start_consumers(self, size):
+        """
+        the caller must hold the consumer lock
+        """
+        # the consumers retired by the autoscaler are forgotten
+        self._consumer_thd_list = [thd for thd in self._consumer_thd_list if thd.is_alive()]
+        for _ in range(size):
+            thd = threading.Thread(target=self._consumer)
+            self._consumer_thd_list.append(thd)
+            thd.start()
+
+    def _resize_consumers(self, size):
+        """
+        start or stop consumers so that there is one for every driver of the autoscaled pool
+        """
+        with self._consumer_lock:
+            if self._consumers_stopping:
+                return
+            difference = size - self._concurrent
+            if difference > 0:
+                # the consumers not quit yet are kept first
+                kept_size = min(difference, self._retiring_consumer_size)
+                self._retiring_consumer_size -= kept_size
+                self._start_consumers(difference - kept_size)
+            else:
+                self._retiring_consumer_size -= difference
+            self._concurrent = size
+            self._task_queue.max_waiting_putters = max(size - 1, 1)
+
+    def _consumer_retiring(self):
+        with self._consumer_lock:
+            if self._retiring_consumer_size and not self._consumers_stopping:
+                self._retiring_consumer_size -= 1
+                return True
+            return False
+
+    def _stop_consumers(self):
+        """
+        let every consumer quit after the tasks are done, or after its current task once killed, and wait for them
+        """
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+        with self._consumer_lock:
+            self._consumers_stopping = True
+            consumer_thd_list = list(self._consumer_thd_list)
+        for _ in range(sum(1 for thd in consumer_thd_list if thd.is_alive())):
+            self._task_push(None)
+        for thd in consumer_thd_list:
+            thd.join()
+
     def _consumer(self):
         while True:
+            if self._consumer_retiring():
+                break
             task = self._task_pop()
             if task is None:
                 self._task_queue.task_done()
                 break
-            handle_func = task.handle_func
-            driver = self.driver_poll.query_driver()
-            if isinstance(handle_func(task, driver), Iterable):
-                for task_gen in handle_func(task, driver):
-                    self._task_push(task_gen)
-            self._task_queue.task_done()
-            driver.delete_all_cookies()
-            self.driver_poll.out_of_use(driver)
+            fetch = getattr(task, "fetch", None)
+            affinity = getattr(task, "affinity", None)
+            if self.driver_poll.page_cache is not None or self.driver_poll.fetch_mode != "browser" or \
+                    fetch not in (None, "browser"):
+                # the driver is queried when the task loads a page neither in the cache nor fetched with http
+                driver = LazyDriver(self.driver_poll, fetch=fetch, affinity=affinity)
+            else:
+                driver = self.driver_poll.query_driver(affinity=affinity)
+                if driver is None:
+                    # the pool is killed and the task is not handled, it stays pending in the journal
+                    task.journal_id = None
+                    self._task_queue.task_done()
+                    break
+            start_time = time.time()
+            status = "ok"
+            try:
+                self._handle_task(task, driver)
+            except SpiderKilled:
+                status = "killed"
+            except Exception as e:
+                status = "error"
+                self.logger.exception("fail to handle task kw:{} url:{}, error: {}".format(task.kw, task.url, e),
+                                      extra={"event": "task_error"})
+            finally:
+                self.metrics.observe("task_seconds", time.time() - start_time)
+                self.metrics.inc("tasks_total", status=status)
+                self.metrics.mark("tasks")
+                if status == "killed":
+                    # the task is not handled, it stays pending in the journal
+                    task.journal_id = None
+                else:
+                    self._finish_task(task)
+                self._task_queue.task_done()
+                if isinstance(driver, LazyDriver):
+                    driver = driver.driver
+                if driver is not None:
+                    self._return_driver(driver, affinity)
+            if status == "killed":
+                break
+
+    def _return_driver(self, driver, affinity):
+        """
+        put the driver of a finished task back to the pool, the driver is dequeued if the browser is dead
+        """
+        try:
+            # the session of a pinned driver is kept for the next task with the same affinity
+            if affinity is None:
+                driver.delete_all_cookies()
+        except Exception as e:
+            self.logger.warning("fail to delete the cookies of the driver, it is dequeued, error info: {}".format(e))
+            self.driver_poll.dequeue_driver(driver)
+            return
+        self.driver_poll.out_of_use(driver)
+
+    def _open_pipelines(self):
+        for pipeline in self._pipelines:
+            pipeline.open_spider(self)
+
+    def _close_pipelines(self):
+        for pipeline in self._pipelines:
+            pipeline.close_spider(self)
 
     def schedule(self):
-        consumer_thd_list = [threading.Thread(target=self._consumer) for _ in range(self._concurrent)]
-        self.init_task_enqueue()
+        if self._processes > 1:
+            return self._schedule_processes()
+        self._start_metrics_dump()
+        if self._pre_warm:
+            self.driver_poll.warm_up(self._concurrent, wait=False)
+        self._open_pipelines()
+        self._init_tasks()
+        with self._consumer_lock:
+            self._start_consumers(self._concurrent)
+        if self.autoscaler is not None:
+            self.autoscaler.start()
+        self.logger.info("CoreSpider schedule is started successfully, waiting for task to start.")
+        while self._task_queue.unfinished_tasks:
+            if self.killed.kill_now:
+                self.logger.info("receive kill signal, the producer is stopping.")
+                break
+            time.sleep(1)
+        # the consumers quit after all the tasks are done, or after their current task once killed
+        self._stop_consumers()
+        self._close_journal()
+        self.driver_poll.clear_driver_pool()
+        self.driver_poll.join_downloads()
+        self._close_pipelines()
+
+    def _process_main(self, worker_index, concurrent, work_queue, result_queue):
+        """
+        the entry of a worker process forked by _schedule_processes
+        """
+        driver_poll_kwargs = dict(self._driver_poll_kwargs)
+        driver_poll_kwargs["driver_size"] = concurrent
+        driver_poll_kwargs["min_idle"] = min(driver_poll_kwargs["min_idle"], concurrent)
+        driver_poll_kwargs["save_folder"] = os.path.join(driver_poll_kwargs["save_folder"],
+                                                         "worker_{}".format(worker_index))
+        self._concurrent = concurrent
+        self.driver_poll = DriverPoll(**driver_poll_kwargs)
+        self._task_queue = _ProcessTaskQueue(self, work_queue, result_queue)
+        # the tasks are journaled by the spider process
+        self._journal = None
+        self._init_metrics()
+        self._start_metrics_dump(".worker_{}".format(worker_index))
+        consumer_thd_list = [threading.Thread(target=self._consumer) for _ in range(concurrent)]
+        if self._pre_warm:
+            self.driver_poll.warm_up(concurrent, wait=False)
+        self._open_pipelines()
         for thd in consumer_thd_list:
             thd.start()
-        self.logger.info("CoreSpider schedule is started successfully, waiting for task to start.")
+        for thd in consumer_thd_list:
+            thd.join()
+        self.driver_poll.clear_driver_pool()
+        self.driver_poll.join_downloads()
+        self._close_pipelines()
+
+    def _feed_work_queue(self, work_queue):
+        while True:
+            task = self._task_queue.get()
+            if task is None:
+                self._task_queue.task_done()
+                break
+            work_queue.put(task)
+
+    def _collect_results(self, result_queue):
         while True:
-            if self._task_queue.qsize() == 0:
+            # the task of a done message is its journal id
+            message, task = result_queue.get()
+            if message == "task":
+                self._task_push(task)
+            elif message == "done":
+                self.metrics.mark("tasks")
+                if self._journal is not None:
+                    self._journal.done(task)
+                self._task_queue.task_done()
+            else:
+                break
+
+    def _schedule_processes(self):
+        """
+        this process keeps the task queue and feeds the tasks to the worker processes, the tasks generated by the
+        workers are sent back to the task queue
+        """
+        context = multiprocessing.get_context("fork")
+        # a small work queue keeps the pending tasks here, so that they are not lost inside a killed worker
+        work_queue = context.Queue(maxsize=self._concurrent)
+        result_queue = context.Queue()
+        shard_size_list = [self._concurrent // self._processes + (1 if index < self._concurrent % self._processes
+                                                                  else 0) for index in range(self._processes)]
+        process_list = [context.Process(target=self._process_main,
+                                        args=(index + 1, shard_size, work_queue, result_queue))
+                        for index, shard_size in enumerate(shard_size_list)]
+        for process in process_list:
+            process.start()
+        feeder_thd = threading.Thread(target=self._feed_work_queue, args=(work_queue, ))
+        collector_thd = threading.Thread(target=self._collect_results, args=(result_queue, ))
+        feeder_thd.setDaemon(True)
+        collector_thd.setDaemon(True)
+        feeder_thd.start()
+        collector_thd.start()
+        self._start_metrics_dump()
+        self._init_tasks()
+        self.logger.info("CoreSpider schedule is started successfully with {} worker processes, waiting for task "
+                         "to start.".format(self._processes))
+        while True:
+            if self._task_queue.unfinished_tasks == 0:
                 break
             if self.killed.kill_now:
                 self.logger.info("receive kill signal, the producer is stopping.")
-                for i in range(self._concurrent):
-                    self._task_push(None)
+                # the signal may be sent to this process only
+                for process in process_list:
+                    if process.is_alive():
+                        os.kill(process.pid, signal.SIGTERM)
                 break
             time.sleep(1)
-        self._task_queue.join()
-        self.driver_poll.clear_driver_pool()
+        self._task_push(None)
+        if not self.killed.kill_now:
+            for i in range(self._concurrent):
+                work_queue.put(None)
+        for process in process_list:
+            process.join()
+        result_queue.put(("exit", None))
+        collector_thd.join()
+        self._close_journal()
 
 
-class CoreRedisSpider(abc.ABC):
+class CoreRedisSpider(CoreSpider):
     redis_key = ""
 
     def __init__(self, concurrent=4, driver="chrome", proxy_url="", save_folder="./file_download",
                  only_html=False, no_js=False, headless=False, driver_log_path="driver.log",
                  logger=None, proxy_scheme="http", timeout=60, driver_time_limit=60 * 5, driver_use_limit=8,
-                 execute_path="", window_size=None, **redis_kwargs):
-        self._concurrent = concurrent
-        self._task_queue = Queue()
-        self._redis_queue = self._create_redis_cursor(**redis_kwargs) if redis_kwargs else None
+                 execute_path="", window_size=None, min_idle=0, idle_timeout=None, pre_warm=True,
+                 pipelines=None, redis_cursor=None, batch_size=16, worker_id=None, metrics_path=None,
+                 metrics_interval=60, metrics_format="json", max_queue_size=0, dedupe=True, bloom_capacity=1000000,
+                 max_per_host=None, host_delay=0, block_url_patterns=None, health_check_interval=None,
+                 max_driver_memory=None, page_cache=None, fetch_mode="browser", affinity_wait=5, autoscale=False,
+                 min_concurrent=1, max_concurrent=None, autoscale_interval=10, download_handler=None,
+                 download_done_folder=None, **redis_kwargs):
+        """
+        :param redis_cursor: the redis client, created from redis_kwargs when it is not set
+        :param batch_size: the max number of tasks pulled from redis in one round trip
+        :param worker_id: the id of the redis processing list, the unacked tasks of the same worker_id are
+                          requeued when the spider is restarted, default None the host name and the spider class
+                          name. a spider started while another running one holds the worker_id gets a processing
+                          list of its own, set a worker_id for each spider run side by side on the same host
+        :param dedupe: drop the tasks generated by the handlers whose url and kw were enqueued before, the tasks
+                       pulled from redis are never dropped, so that a page submitted again is crawled again,
+                       default True
+        """
+        super(CoreRedisSpider, self).__init__(
+            concurrent=concurrent, driver=driver, proxy_url=proxy_url, save_folder=save_folder, only_html=only_html,
+            no_js=no_js, headless=headless, driver_log_path=driver_log_path, logger=logger, proxy_scheme=proxy_scheme,
+            timeout=timeout, driver_time_limit=driver_time_limit, driver_use_limit=driver_use_limit,
+            execute_path=execute_path, window_size=window_size, min_idle=min_idle, idle_timeout=idle_timeout,
+            pre_warm=pre_warm, pipelines=pipelines, metrics_path=metrics_path, metrics_interval=metrics_interval,
+            metrics_format=metrics_format, max_queue_size=max_queue_size, dedupe=dedupe,
+            bloom_capacity=bloom_capacity, max_per_host=max_per_host, host_delay=host_delay,
+            block_url_patterns=block_url_patterns, health_check_interval=health_check_interval,
+            max_driver_memory=max_driver_memory, page_cache=page_cache, fetch_mode=fetch_mode,
+            affinity_wait=affinity_wait, autoscale=autoscale, min_concurrent=min_concurrent,
+            max_concurrent=max_concurrent, autoscale_interval=autoscale_interval, download_handler=download_handler,
+            download_done_folder=download_done_folder)
+        if redis_cursor is None and redis_kwargs:
+            redis_cursor = self._create_redis_cursor(**redis_kwargs)
+        self._redis_queue = redis_cursor
         if (not self.redis_key and self._redis_queue) or (self.redis_key and not self._redis_queue):
             raise Exception("the redis_key or redis args is None, redis_key:{redis_key}, kwargs:{kwargs}".format(
                 redis_key=self.redis_key, kwargs=redis_kwargs
             ))
-        self.driver_poll = DriverPoll(driver=driver, proxy_url=proxy_url, save_folder=save_folder, only_html=only_html,
-                                      no_js=no_js, headless=headless, driver_log_path=driver_log_path, logger=logger,
-                                      proxy_scheme=proxy_scheme, timeout=timeout, driver_size=concurrent,
-                                      driver_time_limit=driver_time_limit, driver_use_limit=driver_use_limit,
-                                      execute_path=execute_path, window_size=window_size)
-        self.killed = Killer()
-        self.logger = _logger if not logger else logger
-
-    def _task_pop(self):
-        task = self._task_queue.get()
-        if task:
-            return task
-        else:
-            return None
-
-    def _task_push(self, task):
-        if task:
-            self.logger.info("enqueue task kw:{} url:{}".format(task.kw, task.url))
-        self._task_queue.put(task)
+        if not worker_id:
+            worker_id = "{}:{}".format(socket.gethostname(), type(self).__name__)
+        self._redis_intake = RedisTaskIntake(self._redis_queue, self.redis_key, worker_id=worker_id,
+                                             logger=self.logger)
+        self._batch_size = batch_size
+        # the redis tasks pushed into the task queue but not acked, never more than the driver pool size
+        self._redis_task_size = 0
+        self._redis_task_done = threading.Condition()
 
     @staticmethod
     def _create_redis_cursor(**redis_kwargs):
@@ -144,43 +669,59 @@ class CoreRedisSpider(abc.ABC):
         """
 
     def init_task_enqueue(self):
+        self._redis_intake.recover()
         while True:
-            if self._task_queue.qsize() < self._concurrent:
-                kw = self._redis_queue.blpop(self.redis_key)
-                if kw:
-                    kw = str(kw[1])
+            with self._redis_task_done:
+                while self._redis_task_size >= self._concurrent:
+                    if self.killed.kill_now:
+                        return
+                    self._redis_task_done.wait(1)
+                    self._redis_intake.heartbeat()
+                fetch_size = min(self._batch_size, self._concurrent - self._redis_task_size)
+            if self.killed.kill_now:
+                return
+            for raw in self._redis_intake.fetch(fetch_size):
+                kw = raw.decode("utf-8") if isinstance(raw, bytes) else raw
                 task = self.task_create(kw=kw)
-                self._task_push(task)
+                if not task:
+                    self._redis_intake.ack(raw)
+                    continue
+                task.redis_raw = raw
+                with self._redis_task_done:
+                    self._redis_task_size += 1
+                # a task submitted again is crawled again, only the tasks the handlers generate are deduplicated
+                self._task_push(task, dedupe=False)
 
-    def _consumer(self):
-        while True:
-            task = self._task_pop()
-            if task is None:
-                self._task_queue.task_done()
-                break
-            handle_func = task.handle_func
-            driver = self.driver_poll.query_driver()
-            if isinstance(handle_func(task, driver), Iterable):
-                for task_gen in handle_func(task, driver):
-                    self._task_push(task_gen)
-            self._task_queue.task_done()
-            driver.delete_all_cookies()
-            self.driver_poll.out_of_use(driver)
+    def _finish_task(self, task):
+        raw = getattr(task, "redis_raw", None)
+        if raw is None:
+            return
+        self._redis_intake.ack(raw)
+        with self._redis_task_done:
+            self._redis_task_size -= 1
+            self._redis_task_done.notify()
 
     def schedule(self):
-        consumer_thd_list = [threading.Thread(target=self._consumer) for _ in range(self._concurrent)]
+        self._start_metrics_dump()
+        if self._pre_warm:
+            self.driver_poll.warm_up(self._concurrent, wait=False)
+        self._open_pipelines()
         init_task_enqueue_thd = threading.Thread(target=self.init_task_enqueue)
         init_task_enqueue_thd.setDaemon(True)
         init_task_enqueue_thd.start()
-        for thd in consumer_thd_list:
-            thd.start()
+        with self._consumer_lock:
+            self._start_consumers(self._concurrent)
+        if self.autoscaler is not None:
+            self.autoscaler.start()
         self.logger.info("CoreRedisSpider schedule is started successfully, waiting for task to start.")
         while True:
             if self.killed.kill_now:
                 self.logger.info("receive kill signal, the producer is stopping.")
-                for i in range(self._concurrent):
-                    self._task_push(None)
                 break
             time.sleep(1)
-        self._task_queue.join()
-        self.driver_poll.clear_driver_pool()
\ No newline at end of file
+        # the tasks left in the task queue are not acked, they are requeued from redis when the spider is restarted
+        self._stop_consumers()
+        self._redis_intake.close()
+        self.driver_poll.clear_driver_pool()
+        self.driver_poll.join_downloads()
+        self._close_pipelines()
\ No newline at end of file
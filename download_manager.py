@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+import time
+import uuid
+from queue import Queue
+from .common.log import Logger
+
+_logger = Logger(__name__).logger
+
+# chrome downloads to <name>.crdownload, firefox to <name>.part next to an empty <name>
+PARTIAL_SUFFIXES = (".crdownload", ".part", ".download", ".partial", ".tmp")
+
+
+class DownloadTimeout(Exception):
+    pass
+
+
+class DownloadManager(object):
+    def __init__(self, save_folder, handler=None, done_folder=None, poll_interval=0.2, stable_time=0.5,
+                 logger=None):
+        """
+        every driver downloads to its own directory, with a handler or a done_folder the files of a task are handed
+        off when the driver is returned, so that the next task of the driver starts with an empty directory, without
+        them the files are kept in the directory
+        :param save_folder: the folder of the download directories
+        :param handler: called with the path of every completed file handed off, in a background thread, the file is
+                        deleted after it returns unless it is moved away
+        :param done_folder: the completed files handed off are moved into it when there is no handler
+        :param poll_interval: the seconds between two checks of a download directory
+        :param stable_time: a download is completed when no file is partial and no file size changes in it
+        """
+        self.save_folder = save_folder
+        self.handler = handler
+        self.done_folder = done_folder
+        self.poll_interval = poll_interval
+        self.stable_time = stable_time
+        self.logger = _logger if not logger else logger
+        self._handoff_folder = os.path.join(save_folder, ".handoff")
+        self._handoff_queue = Queue()
+        self._handoff_thd = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_partial(file_name):
+        return file_name.endswith(PARTIAL_SUFFIXES)
+
+    @property
+    def hands_off(self):
+        """
+        False if the downloaded files are kept where the browser saved them
+        """
+        return self.handler is not None or bool(self.done_folder)
+
+    def downloading(self, directory):
+        """
+        :return: True if a download is in progress in the directory
+        """
+        return any(self.is_partial(name) for name in self._scan(directory))
+
+    def new_directory(self):
+        """
+        :return: a new empty download directory no other driver uses
+        """
+        directory = os.path.join(self.save_folder, uuid.uuid4().hex)
+        os.makedirs(directory)
+        return directory
+
+    @staticmethod
+    def _scan(directory):
+        """
+        :return: {file name: size} of the files in the directory
+        """
+        try:
+            return dict((entry.name, entry.stat().st_size) for entry in os.scandir(directory) if entry.is_file())
+        except OSError:
+            return {}
+
+    def completed_files(self, directory):
+        """
+        :return: the paths of the completed files, the files of a download in progress are left out
+        """
+        file_sizes = self._scan(directory)
+        # the final file of a firefox download exists before it is completed
+        partial_names = set(name.rsplit(".", 1)[0] for name in file_sizes if self.is_partial(name))
+        return sorted(os.path.join(directory, name) for name in file_sizes
+                      if not self.is_partial(name) and name not in partial_names)
+
+    def wait_for_downloads(self, directory, timeout=60, expected=1):
+        """
+        wait until expected downloads are completed in the directory
+        :param expected: the number of completed files expected
+        :return: the paths of the completed files
+        :raise DownloadTimeout: the downloads are not completed after timeout seconds
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        last_file_sizes = None
+        stable_since = None
+        while True:
+            file_sizes = self._scan(directory)
+            now = time.time()
+            if file_sizes != last_file_sizes:
+                last_file_sizes = file_sizes
+                stable_since = now
+            completed = (len(file_sizes) >= expected and not any(self.is_partial(name) for name in file_sizes)
+                         and now - stable_since >= self.stable_time)
+            if completed:
+                return self.completed_files(directory)
+            if deadline is not None and now >= deadline:
+                raise DownloadTimeout("{} downloads are not completed in {} after {} seconds".format(
+                    expected, directory, timeout))
+            time.sleep(self.poll_interval)
+
+    def handoff(self, directory, remove=False):
+        """
+        move the files out of the directory at once and handle them in the background, nothing is moved while a
+        download is in progress in it, the files are kept in it without a handler and a done_folder
+        :param remove: do not recreate the directory, e.g. the driver is quit, the empty directory of a driver
+                       keeping its files is removed
+        """
+        try:
+            if not os.path.isdir(directory):
+                return
+            if not self.hands_off:
+                if remove and not os.listdir(directory):
+                    os.rmdir(directory)
+                return
+            if not remove and (not os.listdir(directory) or self.downloading(directory)):
+                # the browser is still writing the partial files, they are handed off with the next task
+                return
+            if not os.path.exists(self._handoff_folder):
+                os.makedirs(self._handoff_folder, exist_ok=True)
+            handoff_directory = os.path.join(self._handoff_folder, uuid.uuid4().hex)
+            # a rename in the same file system, the hot path never copies or deletes files
+            os.rename(directory, handoff_directory)
+            if not remove:
+                os.makedirs(directory)
+        except OSError as e:
+            self.logger.warning('Fail to hand off the downloads of {}, error info: {}'.format(directory, e))
+            return
+        self._start_handoff_thread()
+        self._handoff_queue.put(handoff_directory)
+
+    def _start_handoff_thread(self):
+        with self._lock:
+            if self._handoff_thd is None:
+                self._handoff_thd = threading.Thread(target=self._handle_handoffs)
+                self._handoff_thd.setDaemon(True)
+                self._handoff_thd.start()
+
+    def _handle_handoffs(self):
+        while True:
+            handoff_directory = self._handoff_queue.get()
+            try:
+                self._handle_handoff(handoff_directory)
+            except Exception as e:
+                self.logger.exception('Fail to handle the downloads of {}, error info: {}'.format(handoff_directory, e))
+            finally:
+                shutil.rmtree(handoff_directory, ignore_errors=True)
+                self._handoff_queue.task_done()
+
+    def _handle_handoff(self, handoff_directory):
+        for file_path in self.completed_files(handoff_directory):
+            if self.handler is not None:
+                self.handler(file_path)
+            elif self.done_folder:
+                if not os.path.exists(self.done_folder):
+                    os.makedirs(self.done_folder, exist_ok=True)
+                shutil.move(file_path, self._unique_path(os.path.join(self.done_folder,
+                                                                      os.path.basename(file_path))))
+
+    @staticmethod
+    def _unique_path(file_path):
+        root, ext = os.path.splitext(file_path)
+        index = 1
+        while os.path.exists(file_path):
+            file_path = "{}({}){}".format(root, index, ext)
+            index += 1
+        return file_path
+
+    def join(self):
+        """
+        wait until all the downloads handed off are handled
+        """
+        self._handoff_queue.join()
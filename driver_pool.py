@@ -1,29 +1,168 @@
 # -*- coding: utf-8 -*-
-import json
 import os
-import re
+import random
 import threading
 import time
-from random import randint
-import requests
+import weakref
+from collections import OrderedDict, deque
+from requests import RequestException
 from selenium import webdriver
+from selenium.common.exceptions import (InvalidArgumentException, InvalidSessionIdException, NoSuchWindowException,
+                                        SessionNotCreatedException, TimeoutException, WebDriverException)
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 from .common.log import Logger
+from .common.metrics import Metrics
+from .common.process import children_map, kill_process_tree, process_info, tree_rss
+from .proxy_pool import ProxyPool
+from .host_scheduler import HostScheduler, url_origin
+from .render_profile import RenderProfile
+from .download_manager import DownloadManager
+from .http_fetcher import HttpFetcher
 
 from .common.killer import killer
 
 _logger = Logger(__name__).logger
 
+# the driver pools of the process, a driver service process none of them knows is an orphan
+_driver_polls = weakref.WeakSet()
+DRIVER_SERVICE_NAMES = ("chromedriver", "geckodriver")
+
+
+class QueryDriverTimeout(Exception):
+    pass
+
+
+class SpiderKilled(Exception):
+    """
+    raised by a LazyDriver used after the pool is killed, the task is not handled
+    """
+    pass
+
+
+# the errors a retry can not fix, the url is wrong or the browser of the driver is gone
+FATAL_GOTO_ERRORS = (InvalidArgumentException, InvalidSessionIdException, NoSuchWindowException,
+                     SessionNotCreatedException)
+# the messages of the WebDriverException raised by a dead browser
+FATAL_GOTO_MESSAGES = ("chrome not reachable", "disconnected", "session deleted", "browser has closed",
+                       "no such session", "tried to run command without establishing a connection")
+
+
+class DriverSlot(object):
+    """
+    the bookkeeping record of one driver in the pool
+    """
+    __slots__ = ("driver", "use_times", "total_use_times", "birth_time", "reset_time", "checkout_time", "return_time",
+                 "using", "save_path", "proxy", "service_pid", "affinity", "origins")
+
+    def __init__(self, driver):
+        self.driver = driver
+        # the use times and the time since the last soft reset, and in the whole life of the browser
+        self.use_times = 0
+        self.total_use_times = 0
+        self.birth_time = time.time()
+        self.reset_time = self.birth_time
+        self.checkout_time = None
+        self.return_time = self.birth_time
+        self.using = False
+        self.save_path = getattr(driver, "save_path", None)
+        self.proxy = getattr(driver, "proxy", None)
+        self.service_pid = driver_service_pid(driver)
+        # the affinity key of the session in the driver, the driver is pinned to it while the pool maps the key to it
+        self.affinity = None
+        # the origins goto loaded since the last soft reset, their storage is cleared by the reset
+        self.origins = set()
+
+
+class LazyDriver(object):
+    """
+    the stand-in of a driver handed to a task, a driver is queried from the pool the first time it is used, so that
+    a task whose pages are all in the page cache never waits for one
+    """
+
+    def __init__(self, driver_poll, fetch=None, affinity=None):
+        """
+        :param fetch: the fetch mode of goto with the stand-in, default None the one of the pool
+        :param affinity: the affinity key the driver is queried with
+        """
+        object.__setattr__(self, "_driver_poll", driver_poll)
+        object.__setattr__(self, "driver", None)
+        object.__setattr__(self, "fetch", fetch)
+        object.__setattr__(self, "affinity", affinity)
+        # the last url goto served from the page cache or with http, the driver loads it when it is acquired
+        object.__setattr__(self, "last_url", None)
+
+    @property
+    def acquired(self):
+        return self.driver is not None
+
+    def acquire(self, load_last_url=True):
+        """
+        :param load_last_url: load the last page goto served without the driver, so that the driver shows the page
+                              the task read, default True
+        """
+        if self.driver is None:
+            driver = self._driver_poll.query_driver(affinity=self.affinity)
+            if driver is None:
+                raise SpiderKilled("the spider is killed, no driver can be queried.")
+            object.__setattr__(self, "driver", driver)
+            last_url = self.last_url
+            object.__setattr__(self, "last_url", None)
+            if last_url and load_last_url:
+                self._driver_poll.goto(driver, last_url, use_cache=False, fetch="browser")
+        return self.driver
+
+    def forget(self):
+        """
+        drop the driver, e.g. it is dequeued, the next use queries another one
+        """
+        object.__setattr__(self, "driver", None)
+
+    def served(self, url):
+        """
+        called by goto with the url of a page read without the driver
+        """
+        if self.driver is None:
+            object.__setattr__(self, "last_url", url)
+
+    def __getattr__(self, name):
+        return getattr(self.acquire(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.acquire(), name, value)
 
-class DriverPoll(object):
-    _lock = threading.RLock()
 
+def unwrap_driver(driver):
+    """
+    :return: the driver of a LazyDriver, None if it is not acquired, the driver itself otherwise
+    """
+    return driver.driver if isinstance(driver, LazyDriver) else driver
+
+
+def driver_service_pid(driver):
+    """
+    :return: the pid of the chromedriver or geckodriver process of the driver, None if it is unknown
+    """
+    return getattr(getattr(getattr(driver, "service", None), "process", None), "pid", None)
+
+
+class DriverPoll(object):
     def __init__(self, driver="chrome", proxy_url="", save_folder="./", only_html=False,
                  no_js=False, headless=False, driver_log_path="driver.log", logger=None,
                  proxy_scheme="http", timeout=60, driver_size=4, driver_time_limit=60*5,
-                 driver_use_limit=8, execute_path="", window_size=None):
+                 driver_use_limit=8, execute_path="", window_size=None, replenish_workers=1, min_idle=0,
+                 max_size=None, idle_timeout=None, proxy_cache_ttl=60, proxy_strategy="round_robin",
+                 proxy_quarantine_time=60*5, metrics=None, max_per_host=None, host_delay=0, host_max_delay=60,
+                 host_slow_threshold=None, block_url_patterns=None, lean_render=None, render_profile=None,
+                 page_load_strategy="normal", retry_delay=1, retry_max_delay=30, soft_reset=True,
+                 driver_restart_use_limit=None, driver_restart_time_limit=None, health_check_interval=None,
+                 max_driver_memory=None, ping_timeout=5, hang_timeout=None, kill_orphans=True, orphan_grace=120,
+                 download_handler=None, download_done_folder=None, download_stable_time=0.5, page_cache=None,
+                 fetch_mode="browser", affinity_wait=5):
         """
         :param driver:  only can be set to chrome or firefox
-        :param proxy_url: the url can get proxy list, choose the first one proxy use for driver
+        :param proxy_url: the url can get proxy list, the proxies are cached and handed out in turn
         :param save_folder: the folder save files that download
         :param only_html: only parse html
         :param no_js: do not parse javascript code
@@ -35,48 +174,147 @@ class DriverPoll(object):
         :param driver_size: the driver pool size , default 4
         :param driver_time_limit: per driver spend time limit
         :param driver_use_limit: per driver use time limit
+        :param replenish_workers: the number of background threads launching and quitting drivers, default 1
+        :param min_idle: the number of idle drivers kept ready in advance, default 0
+        :param max_size: the max driver pool size, overrides driver_size when set
+        :param idle_timeout: seconds a driver can stay idle before it is quit, the pool never shrinks below
+                             min_idle idle drivers, default None never quit idle drivers
+        :param proxy_cache_ttl: seconds the proxy list from proxy_url is cached, default 60 seconds
+        :param proxy_strategy: round_robin or least_used, default round_robin
+        :param proxy_quarantine_time: seconds the proxy of a failed driver is not used, default 5 minutes
+        :param metrics: the Metrics the pool records to, default a new one
+        :param max_per_host: the max number of goto in flight per host, default None unlimited
+        :param host_delay: the min seconds between two goto to the same host, default 0
+        :param host_max_delay: the delay of a host backing off after the slow or failed goto never grows over it
+        :param host_slow_threshold: a goto taking longer than it makes its host back off, default None only the
+                                    failed goto do
+        :param block_url_patterns: the url patterns the drivers never load, e.g. the ads and the trackers, * matches
+                                   any characters, chrome only
+        :param lean_render: turn off the gpu, the extensions and the background networking of the browsers,
+                            default None on with only_html
+        :param render_profile: the RenderProfile of the drivers, overrides only_html, no_js, block_url_patterns and
+                               lean_render when set
+        :param page_load_strategy: normal waits for the whole page, eager only for the DOM, none returns as soon as
+                                   the html starts loading, use goto with wait_for for the content needed
+        :param retry_delay: the seconds before the first retry of goto, doubled after each failed retry with a random
+                            jitter, default 1 second
+        :param retry_max_delay: the max seconds between two retries of goto, default 30 seconds
+        :param soft_reset: a driver reaching driver_use_limit or driver_time_limit is reset instead of restarted, its
+                           extra windows, storage, cache and cookies are cleared and it goes to about:blank, a driver
+                           failing the reset is restarted, default True
+        :param driver_restart_use_limit: the use times after which a soft reset driver is restarted,
+                                         default 10 times driver_use_limit
+        :param driver_restart_time_limit: the seconds after which a soft reset driver is restarted,
+                                          default 6 times driver_time_limit
+        :param health_check_interval: check the health of the drivers every health_check_interval seconds in a
+                                      background thread, default None no health check
+        :param max_driver_memory: the idle driver whose browser processes use more resident memory than it in MB is
+                                  restarted, default None no limit
+        :param ping_timeout: the idle driver not answering a script in ping_timeout seconds is restarted
+        :param hang_timeout: the browser processes of a driver used longer than hang_timeout seconds are killed, so
+                             that the hung call fails at once, default None never
+        :param kill_orphans: kill the driver service processes of this process no pool knows, e.g. the ones a
+                             failed quit left behind, default True
+        :param orphan_grace: the seconds a driver service process may be unknown to the pools, the service of a
+                             driver being launched is not known yet, default 120 seconds
+        :param download_handler: called in a background thread with the path of every file a task downloaded, after
+                                 the driver of the task is returned, the file is deleted after it returns unless it
+                                 is moved away, default None
+        :param download_done_folder: the files the tasks downloaded are moved into it when there is no
+                                     download_handler, default None the files are kept in the download directory of
+                                     the driver under save_folder when neither is set
+        :param download_stable_time: a download is completed when no file is partial and no file size changes in
+                                     the download directory for download_stable_time seconds
+        :param page_cache: the PageCache goto reads the fresh pages from and writes the loaded pages to, default None
+        :param fetch_mode: browser loads every page in the browser, http fetches the page with a plain http request
+                           first and only uses the browser when the page needs javascript, auto does the same but
+                           goes to the browser at once for the hosts learned to need it, default browser
+        :param affinity_wait: the seconds query_driver waits for the driver pinned to an affinity key while it is
+                              used, before another idle driver is taken and pinned instead, default 5 seconds
         """
         self._kill = killer
-        self.driver_pool = []
-        self._driver_use_times_list = []
-        self._driver_query_time_list = []
-        self._driver_using_flag = []
-        self._driver_save_path_list = []
+        self._lock = threading.RLock()
+        self._driver_available = threading.Condition(self._lock)
+        self._replenish_needed = threading.Condition(self._lock)
+        # id(driver) -> DriverSlot, the idle ones are also kept in the free list in return order
+        self._driver_slots = {}
+        self._idle_slots = OrderedDict()
+        self._retired_drivers = deque()
+        self._pending_size = 0
+        self._waiting_size = 0
+        self._replenish_generation = 0
+        self._replenisher_thd_list = []
+        self._available_callbacks = []
+        self._orphan_pids = deque()
+        # affinity key -> the DriverSlot pinned to it, a driver is pinned to one key at most
+        self._affinity_slots = {}
+        self.affinity_wait = affinity_wait
+        self.replenish_workers = replenish_workers
         self.proxy_url = proxy_url
+        self.proxy_pool = ProxyPool(proxy_url, logger=logger, cache_ttl=proxy_cache_ttl, strategy=proxy_strategy,
+                                    quarantine_time=proxy_quarantine_time) if proxy_url else None
         self.save_folder = save_folder
         self.driver_engine = driver
         self.only_html = only_html
         self.no_js = no_js
+        self.render_profile = render_profile if render_profile else RenderProfile.from_flags(
+            only_html=only_html, no_js=no_js, block_url_patterns=block_url_patterns, lean=lean_render, logger=logger)
         self.headless = headless
+        self.page_load_strategy = page_load_strategy
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
         self.driver_log_path = driver_log_path
         self.logger = _logger if not logger else logger
         self.proxy_scheme = proxy_scheme
         self.timeout = timeout
-        self.driver_size = driver_size
+        self.driver_size = max_size if max_size else driver_size
+        self.min_idle = min(min_idle, self.driver_size)
+        self._configured_min_idle = min_idle
+        self.idle_timeout = idle_timeout
         self.driver_time_limit = driver_time_limit
         self.driver_use_limit = driver_use_limit
-        self._save_path_list = [os.path.join(save_folder, str(dir_name)) for dir_name in range(1, self.driver_size+1)]
+        self.soft_reset = soft_reset
+        self.driver_restart_use_limit = driver_restart_use_limit if driver_restart_use_limit else driver_use_limit * 10
+        self.driver_restart_time_limit = (driver_restart_time_limit if driver_restart_time_limit
+                                          else driver_time_limit * 6)
+        self.health_check_interval = health_check_interval
+        self.max_driver_memory = max_driver_memory
+        self.ping_timeout = ping_timeout
+        self.hang_timeout = hang_timeout
+        self.kill_orphans = kill_orphans
+        self.orphan_grace = orphan_grace
+        # every driver gets its own download directory, the files of a task are handed off when the driver is returned
+        self.download_manager = DownloadManager(save_folder, handler=download_handler, done_folder=download_done_folder,
+                                                stable_time=download_stable_time,
+                                                logger=logger) if save_folder else None
         self.execute_path = execute_path
         self.window_size = window_size if window_size else None
+        self.metrics = metrics if metrics else Metrics()
+        self.metrics.add_gauge_callback("pool_size", lambda: len(self._driver_slots))
+        self.metrics.add_gauge_callback("pool_idle", lambda: len(self._idle_slots))
+        self.metrics.add_gauge_callback("pool_busy", lambda: len(self._driver_slots) - len(self._idle_slots))
+        self.metrics.add_gauge_callback("pool_pending", lambda: self._pending_size)
+        self.metrics.add_gauge_callback("pool_waiting", lambda: self._waiting_size)
+        self.fetch_mode = fetch_mode
+        self._http_fetcher = None
+        self.page_cache = page_cache
+        if self.page_cache is not None and self.page_cache.metrics is None:
+            self.page_cache.metrics = self.metrics
+        _driver_polls.add(self)
+        self.host_scheduler = HostScheduler(max_per_host=max_per_host, min_delay=host_delay, max_delay=host_max_delay,
+                                            slow_threshold=host_slow_threshold,
+                                            metrics=self.metrics) if max_per_host or host_delay else None
 
     def _get_save_path(self):
-        self._lock.acquire()
-        if not self._save_path_list:
-            self._save_path_list = [os.path.join(self.save_folder, str(dir_name)) for dir_name in
-                                   range(1, self.driver_size + 1)]
-        save_path = self._save_path_list.pop(0)
-        self._lock.release()
-        return save_path
+        if not self.download_manager:
+            return self.save_folder
+        return self.download_manager.new_directory()
 
     def _get_proxy(self):
-        response = requests.get(self.proxy_url)
-        if re.search(r'20000', response.content.decode(), re.S):
-            ip_list = json.loads(response.content.decode(u'utf-8'))[u'data'][u'ips']
-            if not ip_list:
-                raise Exception("get none ip")
-            return ip_list[0][u'ip'], str(ip_list[0][u'port'])
+        return self.proxy_pool.get_proxy()
 
     def get_proxy(self):
+        retry_interval = 1
         while True:
             if self._kill.kill_now:
                 break
@@ -86,7 +324,8 @@ class DriverPoll(object):
             except Exception as e:
                 self.logger.warning('Failed to get proxy_ip from proxy_url:{proxy_url}, error:{err}'.format(
                     proxy_url=self.proxy_url, err=e))
-                time.sleep(1.11111)
+                time.sleep(retry_interval)
+                retry_interval = min(retry_interval * 2, 30)
                 continue
 
     def _get_one_driver(self, save_path="./"):
@@ -96,17 +335,13 @@ class DriverPoll(object):
             kwargs.update({"executable_path": self.execute_path})
         if self.driver_engine == "firefox":
             firefox_options = webdriver.FirefoxOptions()
-            if self.only_html:
-                firefox_options.set_preference(u'permissions.default.stylesheet', 2)
-                firefox_options.set_preference(u'permissions.default.image', 2)
-            if self.no_js:
-                firefox_options.set_preference(u'dom.ipc.plugins.enabled.libflashplayer.so', u'false')
+            firefox_options.set_capability("pageLoadStrategy", self.page_load_strategy)
+            self.render_profile.apply_firefox_options(firefox_options)
             if self.headless:
                 firefox_options.add_argument("--headless")
             if self.save_folder:
                 if not os.path.exists(save_path):
                     os.makedirs(save_path)
-                self.clear_download_path(save_path)
                 firefox_options.set_preference("browser.download.folderList", 2)
                 firefox_options.set_preference("browser.download.dir", save_path)
                 firefox_options.set_preference('browser.download.manager.showWhenStarting', False)
@@ -129,40 +364,29 @@ class DriverPoll(object):
                                        service_log_path=self.driver_log_path, **kwargs)
             driver.set_page_load_timeout(self.timeout)
             driver.save_path = save_path
+            driver.proxy = (_ip, _port) if self.proxy_url else None
             driver.pid = time.time()
         elif self.driver_engine == "chrome":
             chrome_options = webdriver.ChromeOptions()
-            if self.only_html:
-                prefs = {
-                    'profile.default_content_setting_value.images': 2,
-                    'profile.content_settings.plugin_whitelist.adobe-flash-player': 2,
-                    'profile.content_settings.exceptions.plugins.*,*.per_resource.adobe-flash-player': 2
-                }
-                chrome_options.add_experimental_option('prefs', prefs)
-            if self.no_js:
-                prefs = {
-                    'profile.default_content_setting_value.javascript': 2,
-                }
-                chrome_options.add_experimental_option('prefs', prefs)
+            chrome_options.set_capability("pageLoadStrategy", self.page_load_strategy)
             if self.headless:
                 chrome_options.add_argument("--headless")
             if self.save_folder:
                 if not os.path.exists(save_path):
                     os.makedirs(save_path)
-                self.clear_download_path(save_path)
-                prefs = {
-                    'profile.default_content_settings.popups': 0,
-                    "download.default_directory": save_path
-                }
-                chrome_options.add_experimental_option("prefs", prefs)
+            # the prefs are set once, chrome keeps only the last prefs option
+            self.render_profile.apply_chrome_options(chrome_options,
+                                                     save_path=save_path if self.save_folder else None)
             if self.proxy_url:
                 _ip, _port = self.get_proxy()
                 proxy = "{}://{}:{}".format(self.proxy_scheme, _ip, _port)
                 chrome_options.add_argument("--proxy-server={chrome_proxy}".format(chrome_proxy=proxy))
             driver = webdriver.Chrome(chrome_options=chrome_options,
                                       service_log_path=self.driver_log_path,  **kwargs)
+            self.render_profile.apply_driver(driver)
             driver.set_page_load_timeout(self.timeout)
             driver.save_path = save_path
+            driver.proxy = (_ip, _port) if self.proxy_url else None
             driver.pid = time.time()
         if self.window_size and driver:
             driver.set_window_size(self.window_size[0], self.window_size[1])
@@ -173,43 +397,194 @@ class DriverPoll(object):
             if self._kill.kill_now:
                 break
             try:
+                start_time = time.time()
                 driver = self._get_one_driver(save_path)
+                self.metrics.observe("driver_launch_seconds", time.time() - start_time)
                 return driver
             except Exception as e:
+                self.metrics.inc("driver_launch_failures_total")
                 self.logger.warning('Fail to get {driver_name} driver, the error info is {err}, try again.'.format(
                     driver_name=self.driver_engine, err=e
                 ))
                 time.sleep(1.11111)
                 continue
 
-    def goto(self, driver, url, retry_times=0):
+    @staticmethod
+    def is_retryable_error(error):
+        """
+        :return: False if retrying goto can not fix the error, e.g. an invalid url or a dead browser
+        """
+        if isinstance(error, FATAL_GOTO_ERRORS):
+            return False
+        if isinstance(error, WebDriverException) and not isinstance(error, TimeoutException):
+            message = (error.msg or "").lower()
+            if any(fatal_message in message for fatal_message in FATAL_GOTO_MESSAGES):
+                return False
+        return True
+
+    def _retry_backoff(self, err_times):
+        """
+        the exponential backoff with a random jitter, so that the drivers failing together do not retry together
+        """
+        delay = min(self.retry_delay * 2 ** (err_times - 1), self.retry_max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _wait_for(driver, wait_for, wait_timeout):
+        if callable(wait_for):
+            condition = wait_for
+        else:
+            condition = expected_conditions.presence_of_element_located((By.CSS_SELECTOR, wait_for))
+        WebDriverWait(driver, wait_timeout).until(condition)
+
+    def goto(self, driver, url, retry_times=0, wait_for=None, wait_timeout=None, use_cache=True, fetch=None,
+             needs_browser=None):
+        """
+        :param retry_times: the number of retries after the retryable errors
+        :param wait_for: a css selector or a callable taking the driver, the page source is read once the selector
+                         is present or the callable returns a true value, default None read it after driver.get
+        :param wait_timeout: the seconds to wait for wait_for, the timeout is retried like a failed load,
+                             default the driver request timeout
+        :param use_cache: read the page from the page cache when it is fresh there, the driver is not used then,
+                          default True
+        :param fetch: browser, http or auto, see fetch_mode, the page is always loaded in the browser with wait_for,
+                      default None the fetch of the LazyDriver or fetch_mode
+        :param needs_browser: called with the http response, returns True if the page needs the browser, default
+                              the page without enough text or asking for javascript does
+        """
+        if self.page_cache is not None and use_cache:
+            cached_page = self.page_cache.get(url)
+            if cached_page is not None:
+                if isinstance(driver, LazyDriver):
+                    driver.served(url)
+                return cached_page.page_source
+        if fetch is None:
+            fetch = (driver.fetch if isinstance(driver, LazyDriver) else None) or self.fetch_mode
+        if fetch != "browser" and wait_for is None:
+            page_source = self._fetch_with_http(url, fetch, needs_browser)
+            if page_source is not None:
+                if isinstance(driver, LazyDriver):
+                    driver.served(url)
+                if self.page_cache is not None:
+                    self._cache_page(url, page_source)
+                return page_source
+        if isinstance(driver, LazyDriver):
+            # query the driver before waiting for the host, the page is loaded below
+            driver = driver.acquire(load_last_url=False)
+        self._record_origin(driver, url)
         err_times = 0
         while True:
             if self._kill.kill_now:
                 break
+            if self.host_scheduler and not self.host_scheduler.acquire(url):
+                break
+            start_time = time.time()
             try:
                 driver.get(url)
-                return driver.page_source
+                if wait_for is not None:
+                    self._wait_for(driver, wait_for, wait_timeout if wait_timeout is not None else self.timeout)
+                page_source = driver.page_source
             except Exception as e:
-                time.sleep(1.11111)
+                if self.host_scheduler:
+                    self.host_scheduler.release(url, elapsed=time.time() - start_time, ok=False)
                 err_times += 1
-                if err_times > retry_times:
+                retryable = self.is_retryable_error(e)
+                if not retryable or err_times > retry_times:
+                    self.metrics.inc("goto_failures_total", error="retryable" if retryable else "fatal")
+                    if self.proxy_pool and retryable:
+                        self.proxy_pool.report_failure(getattr(driver, "proxy", None))
                     raise
+                self.metrics.inc("goto_retries_total")
+                self.logger.warning("Fail to goto {}, retry {} times, error info: {}".format(url, err_times, e),
+                                    extra={"event": "goto_retry"})
+                time.sleep(self._retry_backoff(err_times))
                 continue
+            # the host is released once, a failure of the cache write does not retry the page loaded
+            self.metrics.observe("goto_seconds", time.time() - start_time)
+            if self.host_scheduler:
+                self.host_scheduler.release(url, elapsed=time.time() - start_time)
+            if self.page_cache is not None:
+                self._cache_page(url, page_source, driver=driver)
+            return page_source
+
+    def _cache_page(self, url, page_source, driver=None):
+        """
+        the cache is optional, the page is returned even if it fails to be cached
+        :param driver: the driver the page is loaded in, its current url is the url the page was redirected to
+        """
+        try:
+            current_url = driver.current_url if driver is not None else url
+            self.page_cache.put(url, page_source, current_url=current_url)
+        except Exception as e:
+            self.logger.warning("Fail to cache the page of {}, error info: {}".format(url, e))
+
+    def _record_origin(self, driver, url):
+        origin = url_origin(url)
+        if origin is None:
+            return
+        with self._lock:
+            slot = self._get_slot(driver)
+            if slot is not None:
+                slot.origins.add(origin)
+
+    @property
+    def http_fetcher(self):
+        """
+        :rtype: HttpFetcher
+        """
+        if self._http_fetcher is None:
+            with self._lock:
+                if self._http_fetcher is None:
+                    self._http_fetcher = HttpFetcher(self, timeout=self.timeout, logger=self.logger)
+        return self._http_fetcher
+
+    def _fetch_with_http(self, url, fetch, needs_browser):
+        """
+        :return: the html of the page, None if the browser should load it
+        """
+        if not self.http_fetcher.use_http(url, fetch):
+            return None
+        if self.host_scheduler and not self.host_scheduler.acquire(url):
+            return None
+        start_time = time.time()
+        # only a failed request backs the host off, a page needing the browser is a normal answer
+        ok = False
+        try:
+            page_source = self.http_fetcher.fetch(url, needs_browser=needs_browser)
+            ok = True
+        except RequestException as e:
+            self.logger.warning("Fail to fetch {} with http, the browser will be used, error info: {}".format(url, e))
+            return None
+        finally:
+            if self.host_scheduler:
+                self.host_scheduler.release(url, elapsed=time.time() - start_time, ok=ok)
+        return page_source
+
+    @property
+    def driver_pool(self):
+        """
+        :rtype: list
+        """
+        with self._lock:
+            return [slot.driver for slot in self._driver_slots.values()]
+
+    def _get_slot(self, driver):
+        return self._driver_slots.get(id(driver))
 
     def _enqueue_driver(self, driver):
-        self._lock.acquire()
-        if len(self.driver_pool) >= self.driver_size:
-            self.logger.warning('driver pool is full, can not enqueue driver now.')
-        else:
-            self.driver_pool.append(driver)
-            self._driver_query_time_list.append(time.time())
-            self._driver_use_times_list.append(0)
-            self._driver_using_flag.append(False)
-            self.logger.debug('Successfully enqueue new driver into the driver pool, driver pool size now: {size}'.format(
-                size=len(self.driver_pool)
-            ))
-        self._lock.release()
+        """
+        the caller must hold the lock, and log out of it
+        :return: False if the pool is full and the driver is retired
+        """
+        if len(self._driver_slots) >= self.driver_size:
+            self._retired_drivers.append(driver)
+            self._replenish_needed.notify_all()
+            return False
+        slot = DriverSlot(driver)
+        self._driver_slots[id(driver)] = slot
+        self._idle_slots[id(driver)] = slot
+        self._notify_available()
+        return True
 
     def quit_driver(self, driver, dont_output=False):
         for times in range(3):
@@ -219,47 +594,401 @@ class DriverPoll(object):
             except Exception as e:
                 if not dont_output:
                     self.logger.warning('Fail to close this driver, error info: {}'.format(e))
+        else:
+            # the health check kills the processes left behind
+            service_pid = driver_service_pid(driver)
+            if service_pid:
+                self._orphan_pids.append(service_pid)
+        save_path = getattr(driver, "save_path", None)
+        if self.download_manager and save_path:
+            self.download_manager.handoff(save_path, remove=True)
+
+    def _retire_driver(self, slot, reason):
+        """
+        remove the driver from the pool and let the replenisher quit it, the caller must hold the lock
+        :param reason: use_limit, time_limit, idle_timeout, reset_error, memory, unhealthy, hung, shrink or error
+        """
+        self.metrics.inc("driver_recycle_total", reason=reason)
+        self._unpin(slot)
+        del self._driver_slots[id(slot.driver)]
+        self._idle_slots.pop(id(slot.driver), None)
+        self._retired_drivers.append(slot.driver)
+        self._replenish_needed.notify_all()
 
     def dequeue_driver(self, driver):
-        self._lock.acquire()
-        if driver not in self.driver_pool:
+        driver = unwrap_driver(driver)
+        # nothing is logged with the lock held, the other threads would wait for the log io
+        with self._lock:
+            slot = self._get_slot(driver)
+            if slot is not None:
+                self._retire_driver(slot, "error")
+            pool_size = len(self._driver_slots)
+        if slot is None:
             self.logger.warning('the driver you want to dequeue is not in the driver pool, can not be dequeue.')
             return False
-        else:
-            driver_index = self.driver_pool.index(driver)
-            self.driver_pool.pop(driver_index)
-            self._driver_use_times_list.pop(driver_index)
-            self._driver_query_time_list.pop(driver_index)
-            self._driver_using_flag.pop(driver_index)
-            self.quit_driver(driver)
-            self.logger.debug('Successfully dequeue this driver from driver pool, driver pool size now: {size}'.format(
-                size=len(self.driver_pool)
-            ))
-        self._lock.release()
+        self.logger.debug('Successfully dequeue this driver from driver pool, driver pool size now: {size}'.format(
+            size=pool_size
+        ))
         return True
 
-    def _get_driver_from_driver_pool(self):
-        while True:
-            if self._kill.kill_now:
+    def _driver_expired(self, slot):
+        """
+        :return: the reason the driver should be restarted for, None if it can still be used
+        """
+        if not self.soft_reset:
+            return self._driver_stale(slot)
+        if slot.total_use_times >= self.driver_restart_use_limit:
+            return "use_limit"
+        if time.time() - slot.birth_time > self.driver_restart_time_limit:
+            return "time_limit"
+        return None
+
+    def _driver_stale(self, slot):
+        """
+        :return: the reason the driver should be reset for, None if it can still be used
+        """
+        if slot.use_times >= self.driver_use_limit:
+            return "use_limit"
+        if time.time() - slot.reset_time > self.driver_time_limit:
+            return "time_limit"
+        return None
+
+    def reset_driver(self, driver, origins=None):
+        """
+        the soft reset of a driver, much cheaper than restarting the browser
+        :param origins: the origins the driver visited, their storage is cleared in chrome, the origin of the
+                        current page is always cleared
+        :return: False if the driver fails to be reset and should be restarted
+        """
+        start_time = time.time()
+        try:
+            window_handles = driver.window_handles
+            for window_handle in window_handles[1:]:
+                driver.switch_to.window(window_handle)
+                driver.close()
+            driver.switch_to.window(window_handles[0])
+            try:
+                driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            except Exception:
+                # the page may not allow the storage access, e.g. about:blank or a data url
+                pass
+            if hasattr(driver, "execute_cdp_cmd"):
+                origins = set(origins) if origins else set()
+                try:
+                    origins.add(url_origin(driver.current_url))
+                except Exception:
+                    pass
+                origins.discard(None)
+                self._execute_cdp_cmd(driver, "Network.clearBrowserCache", {})
+                self._execute_cdp_cmd(driver, "Network.clearBrowserCookies", {})
+                # the devtools protocol takes one concrete origin, there is no wildcard
+                for origin in sorted(origins):
+                    self._execute_cdp_cmd(driver, "Storage.clearDataForOrigin", {"origin": origin,
+                                                                                 "storageTypes": "all"})
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+        except Exception as e:
+            self.logger.warning('Fail to reset the driver, it will be restarted, error info: {}'.format(e))
+            return False
+        self.metrics.observe("driver_reset_seconds", time.time() - start_time)
+        return True
+
+    def _execute_cdp_cmd(self, driver, cmd, cmd_args):
+        """
+        the cdp commands of the reset are optional, the browser may not support one of them
+        """
+        try:
+            driver.execute_cdp_cmd(cmd, cmd_args)
+        except Exception as e:
+            self.logger.debug("Fail to execute the cdp command {} in the reset, error info: {}".format(cmd, e))
+
+    def resize(self, size):
+        """
+        change the max number of drivers, the idle drivers over it are quit at once and the used ones when they are
+        returned, more drivers are launched when the callers wait for them
+        :return: the number of the idle drivers retired
+        """
+        size = max(1, int(size))
+        with self._lock:
+            self.driver_size = size
+            self.min_idle = min(self._configured_min_idle, size)
+            retired_size = 0
+            while len(self._driver_slots) > size and self._idle_slots:
+                # the drivers idle the longest are retired first
+                self._retire_driver(next(iter(self._idle_slots.values())), "shrink")
+                retired_size += 1
+            self._replenish_needed.notify_all()
+            self._driver_available.notify_all()
+        return retired_size
+
+    def pool_stats(self):
+        """
+        :return: {"size", "idle", "busy", "pending", "waiting", "driver_size"} of the pool now
+        """
+        with self._lock:
+            return {
+                "size": len(self._driver_slots),
+                "idle": len(self._idle_slots),
+                "busy": len(self._driver_slots) - len(self._idle_slots),
+                "pending": self._pending_size,
+                "waiting": self._waiting_size,
+                "driver_size": self.driver_size,
+            }
+
+    def _need_replenish(self):
+        if len(self._driver_slots) + self._pending_size >= self.driver_size:
+            return False
+        # the idle drivers pinned to a key are kept for the tasks of the key, they do not serve the other waiters
+        idle_size = len(self._idle_slots) - self._pinned_idle_size()
+        return self._waiting_size + self.min_idle > idle_size + self._pending_size
+
+    def _pinned_idle_size(self):
+        """
+        the caller must hold the lock
+        """
+        if not self._affinity_slots:
+            return 0
+        return sum(1 for slot in self._affinity_slots.values() if id(slot.driver) in self._idle_slots)
+
+    def _launch_coming(self):
+        """
+        True if a driver is launched or will be launched for the waiters, the caller must hold the lock
+        """
+        return self._waiting_size > 0 and (self._pending_size > 0 or len(self._driver_slots) < self.driver_size)
+
+    def _shrink_idle_drivers(self):
+        """
+        retire the drivers idle longer than idle_timeout, the caller must hold the lock
+        """
+        if self.idle_timeout is None:
+            return
+        # the free list is used as a stack, so the first driver has been idle the longest
+        while len(self._idle_slots) > self.min_idle:
+            slot = next(iter(self._idle_slots.values()))
+            if time.time() - slot.return_time < self.idle_timeout:
                 break
-            _rand_int = randint(0, self.driver_size)
-            _using_flag = self._driver_using_flag[_rand_int]
-            if _using_flag:
-                time.sleep(1.11111)
+            self._retire_driver(slot, "idle_timeout")
+
+    def _start_replenisher(self):
+        """
+        start the background threads which launch new drivers and quit the retired ones, the caller must hold the lock
+        """
+        if self._replenisher_thd_list:
+            return
+        self._replenisher_thd_list = [threading.Thread(target=self._replenish, args=(self._replenish_generation, ))
+                                      for _ in range(self.replenish_workers)]
+        if self.health_check_interval:
+            self._replenisher_thd_list.append(threading.Thread(target=self._health_check,
+                                                               args=(self._replenish_generation, )))
+        for thd in self._replenisher_thd_list:
+            thd.setDaemon(True)
+            thd.start()
+
+    def _replenish(self, generation):
+        while True:
+            with self._replenish_needed:
+                while not self._retired_drivers and not self._need_replenish():
+                    if self._kill.kill_now or generation != self._replenish_generation:
+                        return
+                    self._shrink_idle_drivers()
+                    if self._retired_drivers:
+                        break
+                    self._replenish_needed.wait(1)
+                if self._retired_drivers:
+                    retired_driver = self._retired_drivers.popleft()
+                else:
+                    retired_driver = None
+                    self._pending_size += 1
+            if retired_driver is not None:
+                self.quit_driver(retired_driver)
                 continue
-            else:
-                _driver_use_times = self._driver_use_times_list[_rand_int]
-                _driver_spend_time = time.time() - self._driver_query_time_list[_rand_int]
-                driver = self.driver_pool[_rand_int]
-                if _driver_use_times > self.driver_use_limit or _driver_spend_time > self.driver_time_limit:
-                    self.dequeue_driver(driver)
-                    save_path = self._get_save_path()
-                    driver = self.gen_one_driver(save_path)
-                    self._enqueue_driver(driver)
-                    self.clear_download_path(save_path)
-                    return driver, -1
+            self._launch_driver(generation)
+
+    def _launch_driver(self, generation):
+        """
+        launch one driver which is already counted in _pending_size and put it into the pool
+        """
+        driver = None
+        enqueued = None
+        try:
+            driver = self.gen_one_driver(save_path=self._get_save_path())
+        finally:
+            with self._lock:
+                if generation == self._replenish_generation:
+                    self._pending_size -= 1
+                if driver is not None and generation == self._replenish_generation:
+                    enqueued = self._enqueue_driver(driver)
+                    driver = None
+                else:
+                    # wake the waiters up so that they can request another driver
+                    self._driver_available.notify_all()
+                pool_size = len(self._driver_slots)
+            if driver is not None:
+                self.quit_driver(driver, dont_output=True)
+        if enqueued is False:
+            self.logger.warning('driver pool is full, can not enqueue driver now.')
+        elif enqueued:
+            self.logger.debug('Successfully enqueue new driver into the driver pool, driver pool size now: {size}'.format(
+                size=pool_size
+            ))
+
+    def _launch_drivers(self, generation, size):
+        for _ in range(size):
+            self._launch_driver(generation)
+
+    def warm_up(self, size, parallel=True, wait=True):
+        """
+        launch drivers in advance so that the first tasks do not wait for the browser startup
+        :param size: the number of drivers expected in the pool
+        :param parallel: launch the drivers concurrently, default True
+        :param wait: block until all the drivers are launched, default True
+        :return: the number of drivers launched
+        """
+        with self._lock:
+            self._start_replenisher()
+            generation = self._replenish_generation
+            launch_size = min(size, self.driver_size) - len(self._driver_slots) - self._pending_size
+            if launch_size <= 0:
+                return 0
+            self._pending_size += launch_size
+        if parallel:
+            launch_thd_list = [threading.Thread(target=self._launch_driver, args=(generation, ))
+                               for _ in range(launch_size)]
+        else:
+            launch_thd_list = [threading.Thread(target=self._launch_drivers, args=(generation, launch_size))]
+        for thd in launch_thd_list:
+            thd.setDaemon(True)
+            thd.start()
+        if wait:
+            for thd in launch_thd_list:
+                thd.join()
+        return launch_size
+
+    def _health_check(self, generation):
+        next_check_time = time.time() + self.health_check_interval
+        while not self._kill.kill_now and generation == self._replenish_generation:
+            if time.time() < next_check_time:
+                time.sleep(min(1, next_check_time - time.time()))
+                continue
+            try:
+                self.check_health()
+            except Exception as e:
+                self.logger.warning('Fail to check the health of the drivers, error info: {}'.format(e))
+            next_check_time = time.time() + self.health_check_interval
+
+    def _ping_driver(self, driver):
+        """
+        :return: False if the driver does not answer a script in ping_timeout seconds
+        """
+        result = []
+
+        def _ping():
+            try:
+                result.append(driver.execute_script("return 1") == 1)
+            except Exception:
+                result.append(False)
+
+        # a hung browser never returns, the thread is left behind in that case
+        ping_thd = threading.Thread(target=_ping)
+        ping_thd.setDaemon(True)
+        ping_thd.start()
+        ping_thd.join(self.ping_timeout)
+        return bool(result and result[0])
+
+    def _check_idle_driver(self, slot, children):
+        """
+        :return: the reason the driver should be restarted for, None if it is healthy
+        """
+        if self.max_driver_memory and slot.service_pid:
+            rss = tree_rss(slot.service_pid, children)
+            if rss > self.max_driver_memory * 1024 * 1024:
+                self.logger.warning('the driver uses {} MB memory, it will be restarted.'.format(rss // 1024 // 1024))
+                return "memory"
+        if not self._ping_driver(slot.driver):
+            self.logger.warning('the driver does not answer in {} seconds, it will be restarted.'.format(
+                self.ping_timeout))
+            return "unhealthy"
+        return None
+
+    def _kill_driver_processes(self, slot, children):
+        if slot.service_pid:
+            kill_process_tree(slot.service_pid, children)
+
+    @staticmethod
+    def _is_driver_service(pid):
+        """
+        :return: the process info if the pid is a driver service launched by this process, the pid of a killed
+                 service may have been reused by another process
+        """
+        info = process_info(pid)
+        if info and info[0] in DRIVER_SERVICE_NAMES and info[1] == os.getpid():
+            return info
+        return None
+
+    def _kill_orphans(self, children):
+        orphan_pids = set()
+        while self._orphan_pids:
+            pid = self._orphan_pids.popleft()
+            if self._is_driver_service(pid):
+                orphan_pids.add(pid)
+        known_pids = set()
+        for driver_poll in list(_driver_polls):
+            with driver_poll._lock:
+                known_pids.update(slot.service_pid for slot in driver_poll._driver_slots.values())
+                known_pids.update(driver_service_pid(driver) for driver in driver_poll._retired_drivers)
+        for pid in children.get(os.getpid(), []):
+            info = self._is_driver_service(pid)
+            if info and info[2] > self.orphan_grace and pid not in known_pids:
+                orphan_pids.add(pid)
+        for pid in orphan_pids - known_pids:
+            killed_size = kill_process_tree(pid, children)
+            if killed_size:
+                self.metrics.inc("orphan_processes_killed_total", killed_size)
+                self.logger.warning('kill {} processes of the orphan driver service {}.'.format(killed_size, pid))
+
+    def check_health(self):
+        """
+        restart the idle drivers failing the health check, kill the hung drivers and the orphan driver services
+        """
+        children = children_map()
+        with self._lock:
+            slot_list = list(self._driver_slots.values())
+            hung_slot_list = [slot for slot in slot_list if self.hang_timeout and slot.using and
+                              time.time() - slot.checkout_time > self.hang_timeout]
+            for slot in hung_slot_list:
+                self._retire_driver(slot, "hung")
+            idle_key_list = list(self._idle_slots)
+        for slot in hung_slot_list:
+            self.logger.warning('the driver is used over {} seconds, its processes are killed.'.format(
+                self.hang_timeout))
+            self._kill_driver_processes(slot, children)
+        self.metrics.set_gauge("drivers_rss_bytes", sum(tree_rss(slot.service_pid, children) for slot in slot_list
+                                                        if slot.service_pid))
+        # a healthy driver is put back in front of the free list, checking from the last one keeps the order
+        for key in reversed(idle_key_list):
+            with self._lock:
+                slot = self._idle_slots.pop(key, None)
+                if slot is None:
+                    continue
+                # checked out without being counted as a use
+                slot.using = True
+            unhealthy_reason = self._check_idle_driver(slot, children)
+            with self._lock:
+                if self._driver_slots.get(key) is not slot:
+                    continue
+                if unhealthy_reason:
+                    self._retire_driver(slot, unhealthy_reason)
                 else:
-                    return driver, _rand_int
+                    slot.using = False
+                    # the idle time is not reset by the check
+                    self._idle_slots[key] = slot
+                    self._idle_slots.move_to_end(key, last=False)
+                    self._notify_available()
+            if unhealthy_reason == "unhealthy":
+                # quitting a hung browser hangs too
+                self._kill_driver_processes(slot, children)
+        if self.kill_orphans:
+            self._kill_orphans(children_map())
 
     @staticmethod
     def clear_download_path(save_path):
@@ -267,52 +996,305 @@ class DriverPoll(object):
             for file_path in [os.path.join(save_path, file_name) for file_name in os.listdir(save_path)]:
                 os.remove(file_path)
 
-    def query_driver(self):
-        self._lock.acquire()
-        if len(self.driver_pool) < self.driver_size:
-            save_path = self._get_save_path()
-            driver = self.gen_one_driver(save_path=save_path)
-            self._enqueue_driver(driver)
-            self._driver_use_times_list[-1] += 1
-            self._driver_using_flag[-1] = True
+    def _pinned(self, slot):
+        return slot.affinity is not None and self._affinity_slots.get(slot.affinity) is slot
+
+    def _unpin(self, slot):
+        """
+        the caller must hold the lock
+        """
+        if self._pinned(slot):
+            del self._affinity_slots[slot.affinity]
+
+    def _pin(self, slot, affinity):
+        """
+        pin the slot checked out to the affinity key, the caller must hold the lock
+        :return: True if the driver holds the session of another key, it must be cleared before the driver is used
+        """
+        clear_session = slot.affinity is not None and slot.affinity != affinity
+        self._unpin(slot)
+        slot.affinity = affinity
+        if affinity is not None:
+            self._affinity_slots[affinity] = slot
+        return clear_session
+
+    def _next_idle_key(self, steal=True):
+        """
+        the most recently returned idle driver not pinned, or the pinned one idle the longest, the caller must hold
+        the lock
+        :param steal: take a pinned driver when there is no other idle driver
+        """
+        if self._affinity_slots:
+            for key in reversed(self._idle_slots):
+                if not self._pinned(self._idle_slots[key]):
+                    return key
+            return next(iter(self._idle_slots)) if steal else None
+        return next(reversed(self._idle_slots))
+
+    def _pop_idle_driver(self, affinity=None, fallback=True, steal=None):
+        """
+        take an idle driver from the free list, None if there is no one, the caller must hold the lock
+        :param affinity: take the driver pinned to the affinity key when it is idle, and pin the driver taken to it
+        :param fallback: take another idle driver when the driver pinned to the key is used
+        :param steal: take a driver pinned to another key when no idle driver is not pinned, default fallback unless
+                      a driver is launched for the waiters
+        :return: the driver, and True if the session of another key must be cleared from it
+        """
+        if steal is None:
+            steal = fallback and not self._launch_coming()
+        pinned_slot = self._affinity_slots.get(affinity) if affinity is not None else None
+        if pinned_slot is not None and id(pinned_slot.driver) not in self._idle_slots and not fallback:
+            return None, False
+        while self._idle_slots:
+            if pinned_slot is not None and id(pinned_slot.driver) in self._idle_slots:
+                slot = self._idle_slots.pop(id(pinned_slot.driver))
+                pinned_slot = None
+            else:
+                key = self._next_idle_key(steal)
+                if key is None:
+                    # the pinned drivers are kept for the next tasks of their keys a while
+                    return None, False
+                slot = self._idle_slots.pop(key)
+            expired_reason = self._driver_expired(slot)
+            if expired_reason:
+                self._retire_driver(slot, expired_reason)
+                continue
+            if affinity is not None:
+                hit = self._affinity_slots.get(affinity) is slot
+                self.metrics.inc("affinity_checkout_total", result="hit" if hit else (
+                    "fallback" if affinity in self._affinity_slots else "miss"))
+            clear_session = self._pin(slot, affinity)
+            slot.use_times += 1
+            slot.total_use_times += 1
+            slot.using = True
+            slot.checkout_time = time.time()
+            return slot.driver, clear_session
+        return None, False
+
+    def release_affinity(self, affinity):
+        """
+        unpin the driver of the affinity key, e.g. the chain of tasks logged in with it is done, its session is
+        cleared when it is taken by another task
+        """
+        with self._lock:
+            slot = self._affinity_slots.get(affinity)
+            if slot is not None:
+                self._unpin(slot)
+
+    def clear_session(self, driver):
+        """
+        delete the cookies of the key the driver was pinned to before
+        """
+        try:
+            driver.delete_all_cookies()
+        except Exception as e:
+            self.logger.warning('Fail to delete the cookies of the driver pinned before, error info: {}'.format(e))
+
+    def add_waiter(self):
+        """
+        register a caller waiting for a driver out of query_driver, so that the replenisher launches one for it,
+        the caller must call remove_waiter when it stops waiting
+        """
+        with self._lock:
+            self._start_replenisher()
+            self._waiting_size += 1
+            if self._need_replenish():
+                self._replenish_needed.notify_all()
+
+    def remove_waiter(self):
+        with self._lock:
+            self._waiting_size -= 1
+
+    def add_available_callback(self, callback):
+        """
+        :param callback: called without arguments every time a driver becomes idle, it is called with the pool lock
+                         held, so it must not block
+        """
+        with self._lock:
+            self._available_callbacks.append(callback)
+
+    def remove_available_callback(self, callback):
+        with self._lock:
+            if callback in self._available_callbacks:
+                self._available_callbacks.remove(callback)
+
+    def _notify_available(self):
+        # a waiter may not take a pinned driver or may wait for a pinned one, so that every waiter checks it
+        if self._affinity_slots:
+            self._driver_available.notify_all()
         else:
-            driver, index = self._get_driver_from_driver_pool()
-            self._driver_use_times_list[index] += 1
-            self._driver_using_flag[index] = True
-        self._lock.release()
+            self._driver_available.notify()
+        for callback in self._available_callbacks:
+            callback()
+
+    def query_driver(self, timeout=None, block=True, affinity=None, affinity_wait=None):
+        """
+        the drivers are launched and recycled by background threads, only a ready driver is returned
+        :param timeout: seconds to wait for an idle driver, default None wait until one is returned
+        :param block: wait for an idle driver, default True, return None at once if there is no idle driver when
+                      it is set to False
+        :param affinity: the affinity key of the task, e.g. the account it is logged in with, the driver pinned to the
+                         key is returned with its session, the driver returned is pinned to the key, and the session
+                         of another key is cleared from it
+        :param affinity_wait: the seconds to wait for the driver pinned to the key while it is used, before another
+                              idle driver is taken, also the seconds to wait before a driver pinned to another key is
+                              taken when all the idle drivers are pinned and no driver can be launched, default the
+                              affinity_wait of the pool, with block set to False the other drivers are only taken when
+                              it is 0
+        :raise QueryDriverTimeout: no driver can be used before the timeout expired
+        """
+        affinity_wait = affinity_wait if affinity_wait is not None else self.affinity_wait
+        if not block:
+            driver, clear_session = self.query_driver_nowait(affinity=affinity, affinity_wait=affinity_wait)
+            if clear_session:
+                self.clear_session(driver)
+            return driver
+        start_time = time.time()
+        deadline = start_time + timeout if timeout is not None else None
+        affinity_deadline = start_time + affinity_wait
+        driver, clear_session = None, False
+        with self._driver_available:
+            self._start_replenisher()
+            self._waiting_size += 1
+            try:
+                while True:
+                    if self._kill.kill_now:
+                        return None
+                    driver, clear_session = self._pop_idle_driver(affinity, fallback=time.time() >= affinity_deadline)
+                    if driver is not None:
+                        self.metrics.observe("checkout_wait_seconds", time.time() - start_time)
+                        break
+                    if self._need_replenish():
+                        self._replenish_needed.notify_all()
+                    remaining = deadline - time.time() if deadline is not None else 1
+                    if remaining <= 0:
+                        self.metrics.inc("checkout_timeouts_total")
+                        raise QueryDriverTimeout('no idle driver in the driver pool after waiting {} seconds'.format(
+                            timeout))
+                    if time.time() < affinity_deadline:
+                        remaining = min(remaining, affinity_deadline - time.time())
+                    self._driver_available.wait(min(remaining, 1))
+            finally:
+                self._waiting_size -= 1
+        # out of the lock, the other callers are not blocked by the browser
+        if clear_session:
+            self.clear_session(driver)
         return driver
 
+    def query_driver_nowait(self, affinity=None, affinity_wait=None):
+        """
+        query_driver with block set to False, the session is not cleared, so that a caller on an event loop can
+        clear it in an executor
+        :return: the idle driver or None, and True if clear_session must be called with the driver before it is used
+        """
+        affinity_wait = affinity_wait if affinity_wait is not None else self.affinity_wait
+        with self._lock:
+            return self._pop_idle_driver(affinity, fallback=affinity_wait <= 0)
+
+    def _release_slot(self, slot):
+        """
+        put the driver back to the free list, the caller must hold the lock
+        """
+        slot.using = False
+        slot.return_time = time.time()
+        self._idle_slots[id(slot.driver)] = slot
+        self._notify_available()
+
     def out_of_use(self, driver):
-        self._lock.acquire()
-        if driver not in self.driver_pool:
+        driver = unwrap_driver(driver)
+        if driver is None:
+            # the LazyDriver never queried a driver
+            return
+        save_path = getattr(driver, "save_path", None)
+        if self.download_manager and save_path:
+            # with a handler or a done folder, the next task of the driver starts with an empty download directory
+            self.download_manager.handoff(save_path)
+        with self._lock:
+            slot = self._get_slot(driver)
+            if slot is not None:
+                if not slot.using:
+                    return
+                expired_reason = self._driver_expired(slot)
+                if not expired_reason and len(self._driver_slots) > self.driver_size:
+                    # the pool was resized down while the driver was used
+                    expired_reason = "shrink"
+                if expired_reason:
+                    # recycle it in the background, the waiters will get the replacement
+                    self._retire_driver(slot, expired_reason)
+                    return
+                # a pinned driver keeps its session, it is not reset until it is restarted
+                stale_reason = self._driver_stale(slot) if self.soft_reset and not self._pinned(slot) else None
+                if not stale_reason:
+                    self._release_slot(slot)
+                    return
+                origins = set(slot.origins)
+        if slot is None:
+            # logged out of the lock
             self.logger.warning('the driver you run out is not in the driver pool, can not be set to not using.')
-        else:
-            driver_index = self.driver_pool.index(driver)
-            self._driver_using_flag[driver_index] = False
-            self.logger.debug('Successfully transfer thr flag for the driver to no using, driver pool size now: {size}'.format(
-                size=len(self.driver_pool)
-            ))
-        self._lock.release()
+            return
+        # the driver is still marked as using while it is reset out of the lock
+        reset_ok = self.reset_driver(driver, origins=origins)
+        with self._lock:
+            slot = self._get_slot(driver)
+            if slot is None or not slot.using:
+                # the pool was cleared in the meantime
+                return
+            if not reset_ok:
+                self._retire_driver(slot, "reset_error")
+                return
+            self.metrics.inc("driver_reset_total", reason=stale_reason)
+            slot.affinity = None
+            slot.origins.clear()
+            slot.use_times = 0
+            slot.reset_time = time.time()
+            self._release_slot(slot)
 
-    @staticmethod
-    def get_download_filepath_list(driver):
+    def get_download_filepath_list(self, driver):
         """
+        the files the current task of the driver downloaded, the downloads in progress are left out
         :rtype: list
         """
         save_path = driver.save_path
+        if self.download_manager:
+            return self.download_manager.completed_files(save_path)
         file_path_list = [os.path.join(save_path, file_name) for file_name in os.listdir(save_path)]
         return file_path_list
 
+    def wait_for_downloads(self, driver, timeout=60, expected=1):
+        """
+        wait until the current task of the driver has expected completed downloads
+        :return: the paths of the completed files
+        :raise DownloadTimeout: the downloads are not completed after timeout seconds
+        """
+        if not self.download_manager:
+            raise Exception("the downloads can not be waited for without save_folder")
+        return self.download_manager.wait_for_downloads(driver.save_path, timeout=timeout, expected=expected)
+
+    def join_downloads(self):
+        """
+        wait until the files handed off are handled by download_handler
+        """
+        if self.download_manager:
+            self.download_manager.join()
+
     def clear_driver_pool(self, dont_output=False):
         self._lock.acquire()
-        if self.driver_pool:
-            for driver in self.driver_pool:
-                self.quit_driver(driver, dont_output)
-            self.driver_pool = []
+        self._replenish_generation += 1
+        self._replenisher_thd_list = []
+        self._pending_size = 0
+        retired_drivers = [slot.driver for slot in self._driver_slots.values()] + list(self._retired_drivers)
+        self._driver_slots.clear()
+        self._idle_slots.clear()
+        self._affinity_slots.clear()
+        self._retired_drivers.clear()
+        self._replenish_needed.notify_all()
+        self._driver_available.notify_all()
         self._lock.release()
+        for driver in retired_drivers:
+            self.quit_driver(driver, dont_output)
 
     def __del__(self):
-        if self.driver_pool:
+        if self._driver_slots or self._retired_drivers:
             self.clear_driver_pool(dont_output=True)
 
 
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import threading
+import time
+from collections import deque
+from queue import Empty, Full
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize_url(url):
+    """
+    lower case the scheme and the host, drop the default port and the fragment, sort the query
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        netloc = "{}:{}".format(netloc, parts.port)
+    if parts.username:
+        netloc = "{}@{}".format(parts.username + (":" + parts.password if parts.password else ""), netloc)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def task_fingerprint(task):
+    """
+    :return: the hex digest of the canonical url and the kw of the task
+    """
+    url = canonicalize_url(task.url) if task.url else ""
+    kw = json.dumps(task.kw, sort_keys=True, default=str)
+    return hashlib.sha1("{}\n{}".format(url, kw).encode("utf-8")).hexdigest()
+
+
+class BloomFilter(object):
+    def __init__(self, capacity=1000000, error_rate=0.0001):
+        """
+        a fixed memory set of strings, may report a key never added as added with the probability error_rate
+        :param capacity: the number of keys expected
+        :param error_rate: the false positive probability when capacity keys are added
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_size = max(1, int(round(self.bit_size / float(capacity) * math.log(2))))
+        self._bits = bytearray((self.bit_size + 7) // 8)
+        self.size = 0
+
+    def _positions(self, key):
+        digest = hashlib.md5(key.encode("utf-8")).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.bit_size for index in range(self.hash_size)]
+
+    def add(self, key):
+        """
+        :return: True if the key is new
+        """
+        added = False
+        for position in self._positions(key):
+            byte_index, mask = position >> 3, 1 << (position & 7)
+            if not self._bits[byte_index] & mask:
+                self._bits[byte_index] |= mask
+                added = True
+        if added:
+            self.size += 1
+        return added
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_bytes(self):
+        return bytes(self._bits)
+
+    def merge_bytes(self, data):
+        """
+        add the keys of another filter of the same capacity and error rate
+        :return: False if the filters do not match
+        """
+        if len(data) != len(self._bits):
+            return False
+        self._bits = bytearray(bit_byte | data_byte for bit_byte, data_byte in zip(self._bits, data))
+        return True
+
+
+class TaskFrontier(object):
+    def __init__(self, max_size=0, dedupe=True, bloom_capacity=1000000, bloom_error_rate=0.0001,
+                 max_waiting_putters=None, metrics=None, host_ready=None, lookahead=64):
+        """
+        a priority task queue with the interface of queue.Queue used by the spiders, the task with the higher
+        priority and then the lower depth is got first, None (the stop signal of the consumers) is got before any task
+        :param max_size: the max number of tasks in the frontier, put blocks when it is full, default 0 unbounded
+        :param dedupe: drop the task whose url and kw were put before, the task without url or with dont_filter
+                       is never dropped, default True
+        :param bloom_capacity: the number of fingerprints the dedupe bloom filter is sized for
+        :param bloom_error_rate: the probability a new task is dropped as a duplicate at bloom_capacity
+        :param max_waiting_putters: when this number of threads are blocked in put, the next put does not block,
+                                    so that the consumers putting the tasks they generate never all wait for each
+                                    other, default None always block
+        :param metrics: the Metrics to record the dropped duplicates to
+        :param host_ready: called with the url of a task, returns False if its host can not be requested now, the
+                           task is then passed over for the next one of another host, default None never pass over
+        :param lookahead: the max number of tasks passed over in one get, the first one is got if none of them is
+                          ready
+        """
+        self.max_size = max_size
+        self.max_waiting_putters = max_waiting_putters
+        self.metrics = metrics
+        self.host_ready = host_ready
+        self.lookahead = lookahead
+        self._seen = BloomFilter(bloom_capacity, bloom_error_rate) if dedupe else None
+        self._heap = []
+        self._stop_signals = deque()
+        self._counter = itertools.count()
+        self._waiting_putters = 0
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+        self.unfinished_tasks = 0
+
+    def _drop_duplicate(self):
+        if self.metrics is not None:
+            self.metrics.inc("tasks_deduplicated_total")
+        return False
+
+    def put(self, task, block=True, timeout=None, dedupe=True):
+        """
+        :param dedupe: drop the task if it is a duplicate, default True
+        :return: False if the task is dropped as a duplicate
+        :raise queue.Full: the frontier is still full after timeout seconds
+        """
+        # the fingerprint is computed out of the lock
+        fingerprint = self.fingerprint(task) if dedupe and task is not None else None
+        with self.not_full:
+            if task is None:
+                self._stop_signals.append(task)
+            else:
+                # a duplicate is dropped before it waits for a full frontier
+                if fingerprint is not None and fingerprint in self._seen:
+                    return self._drop_duplicate()
+                self._wait_not_full(block, timeout)
+                # another putter may have added it while this one waited
+                if fingerprint is not None and not self._seen.add(fingerprint):
+                    return self._drop_duplicate()
+                heapq.heappush(self._heap, (-getattr(task, "priority", 0), getattr(task, "depth", 0) or 0,
+                                            next(self._counter), task))
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        return True
+
+    def _wait_not_full(self, block, timeout):
+        if not self.max_size or len(self._heap) < self.max_size:
+            return
+        if self.max_waiting_putters is not None and self._waiting_putters >= self.max_waiting_putters:
+            return
+        if not block:
+            raise Full
+        deadline = time.time() + timeout if timeout is not None else None
+        self._waiting_putters += 1
+        try:
+            while len(self._heap) >= self.max_size:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise Full
+                self.not_full.wait(remaining)
+        finally:
+            self._waiting_putters -= 1
+
+    def get(self, block=True, timeout=None):
+        """
+        :raise queue.Empty: the frontier is still empty after timeout seconds
+        """
+        with self.not_empty:
+            deadline = time.time() + timeout if timeout is not None else None
+            while not self._heap and not self._stop_signals:
+                remaining = deadline - time.time() if deadline is not None else None
+                if not block or (remaining is not None and remaining <= 0):
+                    raise Empty
+                self.not_empty.wait(remaining)
+            if self._stop_signals:
+                return self._stop_signals.popleft()
+            task = self._pop_task()
+            self.not_full.notify()
+            return task
+
+    def _pop_task(self):
+        if self.host_ready is None:
+            return heapq.heappop(self._heap)[-1]
+        passed_entries = []
+        try:
+            while self._heap and len(passed_entries) < self.lookahead:
+                entry = heapq.heappop(self._heap)
+                task = entry[-1]
+                if not task.url or self.host_ready(task.url):
+                    return task
+                passed_entries.append(entry)
+            # no host near the head of the frontier is ready, the first task waits for its host in goto
+            return passed_entries.pop(0)[-1]
+        finally:
+            for entry in passed_entries:
+                heapq.heappush(self._heap, entry)
+
+    def task_done(self):
+        with self.all_tasks_done:
+            if self.unfinished_tasks <= 0:
+                raise ValueError('task_done() called too many times')
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks == 0:
+                self.all_tasks_done.notify_all()
+
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                self.all_tasks_done.wait()
+
+    def qsize(self):
+        with self.mutex:
+            return len(self._heap) + len(self._stop_signals)
+
+    def empty(self):
+        return not self.qsize()
+
+    def seen_size(self):
+        return self._seen.size if self._seen is not None else 0
+
+    def fingerprint(self, task):
+        """
+        :return: the fingerprint the task is deduplicated by, None if it is never dropped
+        """
+        if self._seen is None or not task.url or getattr(task, "dont_filter", False):
+            return None
+        return task_fingerprint(task)
+
+    def seen_state(self):
+        """
+        :return: the bytes of the dedupe filter, None without dedupe
+        """
+        with self.mutex:
+            return self._seen.to_bytes() if self._seen is not None else None
+
+    def restore_seen(self, seen_state=None, fingerprints=()):
+        """
+        mark the tasks enqueued by the last run as seen
+        """
+        if self._seen is None:
+            return
+        with self.mutex:
+            if seen_state and not self._seen.merge_bytes(seen_state):
+                raise Exception("the saved dedupe filter does not match the bloom_capacity of the frontier")
+            for fingerprint in fingerprints:
+                self._seen.add(fingerprint)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from urllib.parse import urlsplit
+from .common.killer import killer
+
+
+def url_host(url):
+    return (urlsplit(url).hostname or "").lower()
+
+
+def url_origin(url):
+    """
+    :return: the scheme://host:port origin of an http or https url, None for the other urls, e.g. about:blank
+    """
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return None
+    return "{}://{}".format(parts.scheme, parts.netloc.rsplit("@", 1)[-1].lower())
+
+
+class _HostState(object):
+    __slots__ = ("in_flight", "delay", "next_time")
+
+    def __init__(self, delay):
+        self.in_flight = 0
+        self.delay = delay
+        self.next_time = 0
+
+
+class HostScheduler(object):
+    def __init__(self, max_per_host=None, min_delay=0, max_delay=60, backoff_factor=2, slow_threshold=None,
+                 metrics=None):
+        """
+        limit the requests sent to each host, a request waits until its host has a free slot and the delay since the
+        last request to the host is passed
+        :param max_per_host: the max number of requests in flight per host, default None unlimited
+        :param min_delay: the min seconds between two requests to the same host, default 0
+        :param max_delay: the delay of a host never grows over it by the backoff, default 60 seconds
+        :param backoff_factor: the delay of a host is multiplied by it after a slow or failed request, and divided by
+                               it after a normal one, never below min_delay
+        :param slow_threshold: a request taking longer than it is regarded as slow, default None only the errors
+                               back off
+        :param metrics: the Metrics to record the waits and the backoffs to
+        """
+        self.max_per_host = max_per_host
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.slow_threshold = slow_threshold
+        self.metrics = metrics
+        self._kill = killer
+        self._lock = threading.Lock()
+        self._host_released = threading.Condition(self._lock)
+        self._host_states = {}
+
+    def _get_state(self, host):
+        state = self._host_states.get(host)
+        if state is None:
+            state = self._host_states[host] = _HostState(self.min_delay)
+        return state
+
+    def _wait_time(self, state, now):
+        """
+        :return: the seconds to wait for the host, 0 if a request can be sent now, None if all the slots are in use
+        """
+        if self.max_per_host and state.in_flight >= self.max_per_host:
+            return None
+        return max(state.next_time - now, 0)
+
+    def ready(self, url):
+        """
+        :return: True if a request to the host of the url can be sent now
+        """
+        with self._lock:
+            state = self._host_states.get(url_host(url))
+            return state is None or self._wait_time(state, time.time()) == 0
+
+    def acquire(self, url, timeout=None):
+        """
+        wait for the host of the url, release must be called after the request
+        :return: False if the spider is killed or the timeout expired before the host is ready
+        """
+        start_time = time.time()
+        deadline = start_time + timeout if timeout is not None else None
+        host = url_host(url)
+        with self._host_released:
+            while True:
+                if self._kill.kill_now:
+                    return False
+                # fetched again after each wait, the state of an idle host may be dropped in between
+                state = self._get_state(host)
+                now = time.time()
+                wait_time = self._wait_time(state, now)
+                if wait_time == 0:
+                    break
+                remaining = deadline - now if deadline is not None else 1
+                if remaining <= 0:
+                    return False
+                self._host_released.wait(min(wait_time if wait_time is not None else 1, remaining, 1))
+            state.in_flight += 1
+            state.next_time = now + state.delay
+        if self.metrics is not None:
+            self.metrics.observe("host_wait_seconds", time.time() - start_time)
+        return True
+
+    def release(self, url, elapsed=None, ok=True):
+        """
+        :param elapsed: the seconds the request took
+        :param ok: False if the request failed
+        """
+        host = url_host(url)
+        backoff = not ok or (self.slow_threshold is not None and elapsed is not None and
+                             elapsed > self.slow_threshold)
+        with self._host_released:
+            state = self._host_states.get(host)
+            if state is None:
+                return
+            state.in_flight -= 1
+            if backoff:
+                state.delay = min(max(state.delay * self.backoff_factor, self.min_delay, 1), self.max_delay)
+                state.next_time = max(state.next_time, time.time() + state.delay)
+            else:
+                state.delay = max(state.delay / self.backoff_factor, self.min_delay)
+                if state.delay < 0.01:
+                    state.delay = self.min_delay
+            if not state.in_flight and state.delay == self.min_delay and state.next_time <= time.time():
+                # forget the idle hosts, so that a long crawl over many hosts keeps a small table
+                del self._host_states[host]
+            self._host_released.notify_all()
+        if backoff and self.metrics is not None:
+            self.metrics.inc("host_backoff_total")
+
+    def host_delay(self, url):
+        with self._lock:
+            state = self._host_states.get(url_host(url))
+            return state.delay if state is not None else self.min_delay
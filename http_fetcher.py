@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from .host_scheduler import url_host
+from .common.log import Logger
+
+_logger = Logger(__name__).logger
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8",
+}
+JS_REQUIRED_PATTERN = re.compile(r"enable javascript|javascript is (?:disabled|required)|requires javascript|"
+                                 r"turn on javascript|启用\s*javascript", re.I)
+_SCRIPT_PATTERN = re.compile(r"<(script|style|noscript)\b.*?</\1\s*>", re.I | re.S)
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+class HttpFetcher(object):
+    def __init__(self, driver_poll, timeout=30, min_text_length=200, learn_threshold=3, probe_interval=50,
+                 headers=None, logger=None):
+        """
+        fetch the static pages with plain http requests, the pages needing javascript are left to the browsers
+        :param driver_poll: the DriverPoll whose proxies the requests go through
+        :param timeout: the timeout of a request, default 30 seconds
+        :param min_text_length: an html page with less visible text is regarded as rendered by javascript
+        :param learn_threshold: after this number of pages of a host in a row need the browser, the auto mode uses
+                                the browser for the host at once
+        :param probe_interval: a host learned to need the browser is tried with http again after this number of
+                               pages
+        :param headers: the headers of the requests, default browser like headers
+        """
+        self.driver_poll = driver_poll
+        self.timeout = timeout
+        self.min_text_length = min_text_length
+        self.learn_threshold = learn_threshold
+        self.probe_interval = probe_interval
+        self.logger = _logger if not logger else logger
+        self._session = requests.Session()
+        pool_maxsize = max(driver_poll.driver_size, 4)
+        self._session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=pool_maxsize))
+        self._session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=pool_maxsize))
+        self._session.headers.update(headers if headers else DEFAULT_HEADERS)
+        self._lock = threading.Lock()
+        # host -> [the pages in a row needing the browser, the browser pages left before the next http probe]
+        self._host_rules = {}
+
+    def needs_browser(self, response):
+        """
+        :return: True if the response can not be used without running its javascript
+        """
+        if not 200 <= response.status_code < 300:
+            return True
+        if "html" not in response.headers.get("Content-Type", "html"):
+            return False
+        text = _TAG_PATTERN.sub(" ", _SCRIPT_PATTERN.sub(" ", response.text))
+        if len(" ".join(text.split())) < self.min_text_length:
+            return True
+        return bool(JS_REQUIRED_PATTERN.search(response.text))
+
+    def use_http(self, url, mode):
+        """
+        :param mode: http tries http first, auto follows what the host of the url is learned to need
+        """
+        if mode == "http":
+            return True
+        if mode != "auto":
+            return False
+        host = url_host(url)
+        with self._lock:
+            rule = self._host_rules.get(host)
+            if rule is None or rule[0] < self.learn_threshold:
+                return True
+            rule[1] -= 1
+            if rule[1] > 0:
+                return False
+            # probe the host with http again, the site may have changed
+            rule[1] = self.probe_interval
+            return True
+
+    def _learn(self, url, browser_needed):
+        host = url_host(url)
+        with self._lock:
+            if not browser_needed:
+                self._host_rules.pop(host, None)
+                return
+            rule = self._host_rules.setdefault(host, [0, self.probe_interval])
+            rule[0] += 1
+
+    def _proxies(self):
+        if not self.driver_poll.proxy_pool:
+            return None, None
+        proxy = self.driver_poll.get_proxy()
+        if proxy is None:
+            return None, None
+        proxy_url = "{}://{}:{}".format(self.driver_poll.proxy_scheme, proxy[0], proxy[1])
+        return proxy, {"http": proxy_url, "https": proxy_url}
+
+    def fetch(self, url, needs_browser=None):
+        """
+        :param needs_browser: called with the response, returns True if the page needs the browser, default
+                              the needs_browser method
+        :return: the html of the page, None if the page needs the browser
+        :raise requests.RequestException: the request failed
+        """
+        proxy, proxies = self._proxies()
+        start_time = time.time()
+        try:
+            response = self._session.get(url, timeout=self.timeout, proxies=proxies)
+        except requests.RequestException:
+            if proxy is not None:
+                self.driver_poll.proxy_pool.report_failure(proxy)
+            self.driver_poll.metrics.inc("http_fetch_total", result="error")
+            raise
+        self.driver_poll.metrics.observe("http_fetch_seconds", time.time() - start_time)
+        browser_needed = (needs_browser if needs_browser else self.needs_browser)(response)
+        self._learn(url, browser_needed)
+        self.driver_poll.metrics.inc("http_fetch_total", result="escalated" if browser_needed else "ok")
+        return None if browser_needed else response.text
+
+    def close(self):
+        self._session.close()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from .frontier import canonicalize_url
+from .common.log import Logger
+
+_logger = Logger(__name__).logger
+
+
+class CachedPage(object):
+    __slots__ = ("url", "page_source", "created_time", "meta")
+
+    def __init__(self, url, page_source, created_time, meta):
+        self.url = url
+        self.page_source = page_source
+        self.created_time = created_time
+        self.meta = meta
+
+
+class PageCache(object):
+    def __init__(self, path, ttl=60 * 60 * 24, max_size=1024 ** 3, compress_level=6, metrics=None, logger=None):
+        """
+        the rendered pages on disk in a sqlite file, keyed by the canonical url, the least recently used pages are
+        evicted when the compressed pages are over max_size
+        :param path: the sqlite file, shared by the worker processes
+        :param ttl: the seconds a page is fresh, default one day
+        :param max_size: the max bytes of the compressed pages, default 1 GB
+        :param compress_level: the zlib level of the pages
+        :param metrics: the Metrics to record the hits and the misses to
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.compress_level = compress_level
+        self.metrics = metrics
+        self.logger = _logger if not logger else logger
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._size = 0
+
+    def _connect(self):
+        """
+        the caller must hold the lock, a sqlite connection can not be used after a fork, so every process opens its own
+        """
+        if self._connection is not None and self._pid == os.getpid():
+            return self._connection
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS page (key TEXT PRIMARY KEY, url TEXT, body BLOB, size INTEGER, "
+                           "created_time REAL, accessed_time REAL, meta TEXT)")
+        connection.execute("CREATE INDEX IF NOT EXISTS page_accessed_time ON page (accessed_time)")
+        self._size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM page").fetchone()[0]
+        self._connection = connection
+        self._pid = os.getpid()
+        return connection
+
+    def _record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.metrics is not None:
+            self.metrics.inc("page_cache_total", result="hit" if hit else "miss")
+
+    def get(self, url):
+        """
+        :rtype: CachedPage
+        :return: None if the page is not cached or expired
+        """
+        key = canonicalize_url(url)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT url, body, created_time, meta FROM page WHERE key = ?",
+                                     (key, )).fetchone()
+            if row is None or (self.ttl is not None and now - row[2] > self.ttl):
+                self._record(False)
+                return None
+            connection.execute("UPDATE page SET accessed_time = ? WHERE key = ?", (now, key))
+            self._record(True)
+        return CachedPage(row[0], zlib.decompress(row[1]).decode("utf-8"), row[2], json.loads(row[3]))
+
+    def put(self, url, page_source, **meta):
+        """
+        :param meta: the json serializable metadata of the page, e.g. the url after the redirects
+        """
+        key = canonicalize_url(url)
+        body = zlib.compress(page_source.encode("utf-8"), self.compress_level)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT size FROM page WHERE key = ?", (key, )).fetchone()
+            connection.execute("INSERT OR REPLACE INTO page (key, url, body, size, created_time, accessed_time, meta) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (key, url, body, len(body), now, now, json.dumps(meta, default=str)))
+            self._size += len(body) - (row[0] if row else 0)
+            if self._size > self.max_size:
+                self._evict(connection)
+
+    def _evict(self, connection):
+        """
+        delete the expired pages and then the least recently used ones, until 90% of max_size is used
+        """
+        if self.ttl is not None:
+            connection.execute("DELETE FROM page WHERE created_time < ?", (time.time() - self.ttl, ))
+        # another process may have written the file
+        self._size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM page").fetchone()[0]
+        target_size = self.max_size * 0.9
+        while self._size > target_size:
+            rows = connection.execute("SELECT key, size FROM page ORDER BY accessed_time LIMIT 256").fetchall()
+            if not rows:
+                break
+            evicted_keys = []
+            for key, size in rows:
+                if self._size <= target_size:
+                    break
+                evicted_keys.append((key, ))
+                self._size -= size
+            connection.executemany("DELETE FROM page WHERE key = ?", evicted_keys)
+        if self.metrics is not None:
+            self.metrics.inc("page_cache_evictions_total")
+
+    def delete(self, url):
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT size FROM page WHERE key = ?", (canonicalize_url(url), )).fetchone()
+            if row:
+                connection.execute("DELETE FROM page WHERE key = ?", (canonicalize_url(url), ))
+                self._size -= row[0]
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            connection = self._connect()
+            count = connection.execute("SELECT COUNT(*) FROM page").fetchone()[0]
+            size = self._size
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / float(lookups) if lookups else None,
+            "pages": count,
+            "size": size,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+
+class ItemPipeline(object):
+    """
+    the items (everything a handle_func yields or returns except Task) are passed through the pipelines of the spider
+    in order, process_item is called by the consumer threads concurrently
+    """
+
+    def open_spider(self, spider):
+        pass
+
+    def process_item(self, item, spider):
+        """
+        :return: the item passed to the next pipeline, return None to drop the item
+        """
+        return item
+
+    def close_spider(self, spider):
+        pass
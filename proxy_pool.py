@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from .common.log import Logger
+
+_logger = Logger(__name__).logger
+
+
+class ProxyPool(object):
+    def __init__(self, proxy_url, logger=None, cache_ttl=60, strategy="round_robin", quarantine_time=60*5,
+                 prefetch_ratio=0.2, request_timeout=10):
+        """
+        :param proxy_url: the url can get proxy list
+        :param logger: the log logger, default
+        :param cache_ttl: seconds the fetched proxy list can be used, default 60 seconds
+        :param strategy: round_robin or least_used, default round_robin
+        :param quarantine_time: seconds a failed proxy is not handed out, default 5 minutes
+        :param prefetch_ratio: refresh the proxy list in background when the remaining ttl is lower than
+                               cache_ttl * prefetch_ratio, default 0.2
+        :param request_timeout: the timeout of the request to proxy_url, default 10 seconds
+        """
+        if strategy not in ("round_robin", "least_used"):
+            raise Exception("the strategy can only be set to round_robin or least_used, strategy:{}".format(strategy))
+        self.proxy_url = proxy_url
+        self.logger = _logger if not logger else logger
+        self.cache_ttl = cache_ttl
+        self.strategy = strategy
+        self.quarantine_time = quarantine_time
+        self.prefetch_ratio = prefetch_ratio
+        self.request_timeout = request_timeout
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._prefetching = False
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self._proxy_list = []
+        self._use_times = {}
+        self._quarantine = {}
+        self._next_index = 0
+        self._expire_time = 0
+        # the number of the refreshes, a caller waiting for a refresh in progress does not fetch the list again
+        self._refresh_times = 0
+
+    def _fetch_proxy_list(self):
+        response = self._session.get(self.proxy_url, timeout=self.request_timeout)
+        content = response.content.decode(u'utf-8')
+        if not re.search(r'20000', content, re.S):
+            raise Exception("unexpected response: {}".format(content[:200]))
+        ip_list = json.loads(content)[u'data'][u'ips']
+        if not ip_list:
+            raise Exception("get none ip")
+        return [(ip[u'ip'], str(ip[u'port'])) for ip in ip_list]
+
+    def refresh(self, force=True):
+        """
+        fetch the whole proxy list and replace the cached one, only one request is sent at a time
+        :param force: fetch it even if another caller refreshed the list while this one waited for the request,
+                      default True
+        """
+        refresh_times = self._refresh_times
+        with self._refresh_lock:
+            if not force and refresh_times != self._refresh_times:
+                with self._lock:
+                    if time.time() < self._expire_time and self._healthy_proxy_list():
+                        return
+            try:
+                proxy_list = self._fetch_proxy_list()
+            finally:
+                self._prefetching = False
+            with self._lock:
+                self._proxy_list = proxy_list
+                self._use_times = dict((proxy, self._use_times.get(proxy, 0)) for proxy in proxy_list)
+                self._next_index = 0
+                self._expire_time = time.time() + self.cache_ttl
+                self._refresh_times += 1
+            self.logger.debug('Successfully refresh proxy list from proxy_url:{proxy_url}, proxy size: {size}'.format(
+                proxy_url=self.proxy_url, size=len(proxy_list)))
+
+    def _prefetch(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self.logger.warning('Failed to prefetch proxy list from proxy_url:{proxy_url}, error:{err}'.format(
+                proxy_url=self.proxy_url, err=e))
+
+    def _healthy_proxy_list(self):
+        now = time.time()
+        for proxy, release_time in list(self._quarantine.items()):
+            if release_time <= now:
+                del self._quarantine[proxy]
+        return [proxy for proxy in self._proxy_list if proxy not in self._quarantine]
+
+    def _choose(self, healthy_proxy_list):
+        if self.strategy == "least_used":
+            return min(healthy_proxy_list, key=lambda proxy: self._use_times[proxy])
+        proxy = healthy_proxy_list[self._next_index % len(healthy_proxy_list)]
+        self._next_index += 1
+        return proxy
+
+    def get_proxy(self):
+        """
+        :return: (ip, port) from the cached proxy list, the list is fetched again when it is expired or all the
+                 proxies are quarantined
+        """
+        with self._lock:
+            now = time.time()
+            healthy_proxy_list = self._healthy_proxy_list() if now < self._expire_time else []
+            if healthy_proxy_list and not self._prefetching \
+                    and self._expire_time - now < self.cache_ttl * self.prefetch_ratio:
+                self._prefetching = True
+                prefetch_thd = threading.Thread(target=self._prefetch)
+                prefetch_thd.setDaemon(True)
+                prefetch_thd.start()
+        if not healthy_proxy_list:
+            # the callers of a cold cache share one request
+            self.refresh(force=False)
+        with self._lock:
+            healthy_proxy_list = self._healthy_proxy_list()
+            if not healthy_proxy_list:
+                raise Exception("all the proxies are quarantined")
+            proxy = self._choose(healthy_proxy_list)
+            self._use_times[proxy] += 1
+        return proxy
+
+    def report_failure(self, proxy):
+        """
+        stop handing out the proxy for quarantine_time seconds
+        """
+        if not proxy:
+            return
+        with self._lock:
+            self._quarantine[tuple(proxy)] = time.time() + self.quarantine_time
+        self.logger.warning('the proxy {proxy} is quarantined for {seconds} seconds'.format(
+            proxy=":".join(proxy), seconds=self.quarantine_time))
+
+    def close(self):
+        self._session.close()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import time
+import uuid
+from .common.log import Logger
+
+_logger = Logger(__name__).logger
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # the process exists but belongs to another user
+        return True
+    return True
+
+
+class RedisTaskIntake(object):
+    def __init__(self, redis_cursor, redis_key, worker_id=None, block_timeout=1, lease_time=60, logger=None):
+        """
+        a reliable queue on the redis list redis_key, the fetched tasks are moved to a processing list of this worker
+        and stay there until they are acked, needs redis server 6.2+ for LMOVE.
+        a worker crashed for good leaves its unacked tasks in <redis_key>:processing:<worker_id>, start a worker with
+        the same worker_id to requeue them, or move them back by hand with
+        LMOVE <redis_key>:processing:<worker_id> <redis_key> RIGHT LEFT until it returns nil
+        :param redis_cursor: the StrictRedis (or a compatible fake redis) client
+        :param redis_key: the redis list the tasks are pushed to, the tasks are popped from the left
+        :param worker_id: the id of the processing list, a restarted worker with the same id recovers the tasks
+                          it did not ack, default None the host name. the running worker holds a lease on the
+                          processing list, a second worker started with the same id while the lease is held gets a
+                          processing list of its own and recovers nothing
+        :param block_timeout: seconds to block on an empty task list before return, default 1 second
+        :param lease_time: seconds the lease on the processing list lasts without a fetch or a heartbeat, a worker
+                           restarted on another host recovers the tasks of a crashed one after it, default 60 seconds
+        :param logger: the log logger, default
+        """
+        self._redis = redis_cursor
+        self.redis_key = redis_key
+        self.worker_id = worker_id if worker_id else socket.gethostname()
+        self.processing_key = self._processing_key(self.worker_id)
+        self.block_timeout = block_timeout
+        self.lease_time = lease_time
+        self.logger = _logger if not logger else logger
+        self.recoverable = True
+        self._owner = "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        # the time the lease is renewed next, None until recover takes the lease
+        self._lease_time_left = None
+
+    def _processing_key(self, worker_id):
+        return "{redis_key}:processing:{worker_id}".format(redis_key=self.redis_key, worker_id=worker_id)
+
+    @property
+    def _owner_key(self):
+        return self.processing_key + ":owner"
+
+    def _claim(self):
+        """
+        take the lease on the processing list
+        :return: False if a running worker holds it
+        """
+        if self._redis.set(self._owner_key, self._owner, nx=True, ex=self.lease_time):
+            return True
+        owner = self._redis.get(self._owner_key)
+        owner = owner.decode("utf-8") if isinstance(owner, bytes) else owner
+        if owner:
+            host, _, rest = owner.partition(":")
+            pid = rest.partition(":")[0]
+            if host != socket.gethostname() or not pid.isdigit() or _pid_alive(int(pid)):
+                return False
+        # the worker holding the lease crashed on this host, its lease is not expired yet
+        self._redis.set(self._owner_key, self._owner, ex=self.lease_time)
+        return True
+
+    def recover(self):
+        """
+        take the processing list of the worker_id and move the tasks left in it by a crashed worker back to the head
+        of the task list
+        :return: the number of the recovered tasks, 0 if another running worker holds the processing list
+        """
+        if not self._claim():
+            worker_id = "{}:{}".format(self.worker_id, self._owner)
+            self.logger.warning("the processing list {key} is held by a running worker, the unacked tasks of this "
+                                "worker are kept in {own_key} and are not recovered by a restart.".format(
+                                    key=self.processing_key, own_key=self._processing_key(worker_id)))
+            self.recoverable = False
+            self.processing_key = self._processing_key(worker_id)
+            return 0
+        self._lease_time_left = time.time() + self.lease_time / 3.0
+        self.logger.info("the unacked tasks of this worker are kept in {key}, a worker with the worker_id {worker_id} "
+                         "requeues them when it starts.".format(key=self.processing_key, worker_id=self.worker_id))
+        recover_size = 0
+        while self._redis.lmove(self.processing_key, self.redis_key, "RIGHT", "LEFT") is not None:
+            recover_size += 1
+        if recover_size:
+            self.logger.info("recover {size} unacked tasks from {key}".format(size=recover_size,
+                                                                           key=self.processing_key))
+        return recover_size
+
+    def heartbeat(self):
+        """
+        renew the lease on the processing list, it is renewed at most every lease_time / 3 seconds
+        """
+        if self._lease_time_left is None or time.time() < self._lease_time_left:
+            return
+        self._redis.set(self._owner_key, self._owner, ex=self.lease_time)
+        self._lease_time_left = time.time() + self.lease_time / 3.0
+
+    def fetch(self, size):
+        """
+        move up to size tasks to the processing list in one round trip, block for block_timeout seconds if the task
+        list is empty
+        :rtype: list
+        """
+        self.heartbeat()
+        pipe = self._redis.pipeline(transaction=False)
+        for _ in range(size):
+            pipe.lmove(self.redis_key, self.processing_key, "LEFT", "RIGHT")
+        raw_list = [raw for raw in pipe.execute() if raw is not None]
+        if not raw_list and self.block_timeout:
+            raw = self._redis.blmove(self.redis_key, self.processing_key, self.block_timeout, "LEFT", "RIGHT")
+            if raw is not None:
+                raw_list.append(raw)
+        return raw_list
+
+    def ack(self, raw):
+        self._redis.lrem(self.processing_key, 1, raw)
+
+    def close(self):
+        """
+        give the lease up, so that a restarted worker recovers the unacked tasks at once
+        """
+        if self._lease_time_left is None:
+            return
+        self._lease_time_left = None
+        owner = self._redis.get(self._owner_key)
+        if (owner.decode("utf-8") if isinstance(owner, bytes) else owner) == self._owner:
+            self._redis.delete(self._owner_key)
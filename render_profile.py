@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from .common.log import Logger
+
+_logger = Logger(__name__).logger
+
+FONT_URL_PATTERNS = ("*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot")
+MEDIA_URL_PATTERNS = ("*.mp4", "*.webm", "*.ogg", "*.mp3", "*.wav", "*.m4a", "*.m3u8", "*.flv")
+STYLESHEET_URL_PATTERNS = ("*.css", )
+IMAGE_URL_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp")
+
+LEAN_CHROME_ARGUMENTS = (
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-translate",
+    "--disable-component-update",
+    "--metrics-recording-only",
+    "--no-first-run",
+    "--mute-audio",
+)
+
+LEAN_FIREFOX_PREFERENCES = {
+    "layers.acceleration.disabled": True,
+    "extensions.update.enabled": False,
+    "app.update.enabled": False,
+    "browser.search.update": False,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "network.http.speculative-parallel-limit": 0,
+    "datareporting.healthreport.uploadEnabled": False,
+    "toolkit.telemetry.enabled": False,
+    "media.autoplay.default": 5,
+}
+
+
+class RenderProfile(object):
+    def __init__(self, block_images=False, block_fonts=False, block_media=False, block_stylesheets=False,
+                 no_js=False, block_url_patterns=None, lean=False, logger=None):
+        """
+        the browser settings of the drivers, only the resources the spider needs are loaded
+        :param block_images: do not load the images
+        :param block_fonts: do not load the web fonts
+        :param block_media: do not load the audio and the video
+        :param block_stylesheets: do not load the css
+        :param no_js: do not run javascript
+        :param block_url_patterns: the url patterns never loaded, e.g. the ads and the trackers, * matches any
+                                   characters, only the chrome driver supports them
+        :param lean: turn off the gpu, the extensions and the background networking of the browser
+        """
+        self.block_images = block_images
+        self.block_fonts = block_fonts
+        self.block_media = block_media
+        self.block_stylesheets = block_stylesheets
+        self.no_js = no_js
+        self.block_url_patterns = list(block_url_patterns) if block_url_patterns else []
+        self.lean = lean
+        self.logger = _logger if not logger else logger
+
+    @classmethod
+    def from_flags(cls, only_html=False, no_js=False, block_url_patterns=None, lean=None, logger=None):
+        """
+        the profile of the only_html and no_js flags of DriverPoll, only_html blocks every resource but the html
+        and turns the lean mode on unless lean is set to False
+        """
+        return cls(block_images=only_html, block_fonts=only_html, block_media=only_html,
+                   block_stylesheets=only_html, no_js=no_js, block_url_patterns=block_url_patterns,
+                   lean=only_html if lean is None else lean, logger=logger)
+
+    def blocked_url_patterns(self):
+        patterns = list(self.block_url_patterns)
+        if self.block_images:
+            patterns.extend(IMAGE_URL_PATTERNS)
+        if self.block_fonts:
+            patterns.extend(FONT_URL_PATTERNS)
+        if self.block_media:
+            patterns.extend(MEDIA_URL_PATTERNS)
+        if self.block_stylesheets:
+            patterns.extend(STYLESHEET_URL_PATTERNS)
+        return patterns
+
+    def chrome_prefs(self, save_path=None):
+        """
+        all the chrome prefs in one dict, chrome keeps only the last prefs option set
+        """
+        prefs = {}
+        content_settings = {}
+        if self.block_images:
+            content_settings["images"] = 2
+        if self.no_js:
+            content_settings["javascript"] = 2
+        if self.block_media or self.block_images:
+            content_settings["plugins"] = 2
+        for name, value in content_settings.items():
+            prefs["profile.managed_default_content_settings.{}".format(name)] = value
+        if save_path:
+            prefs["profile.default_content_settings.popups"] = 0
+            prefs["download.default_directory"] = save_path
+        return prefs
+
+    def chrome_arguments(self):
+        arguments = []
+        if self.lean:
+            arguments.extend(LEAN_CHROME_ARGUMENTS)
+        if self.block_images:
+            arguments.append("--blink-settings=imagesEnabled=false")
+        if self.block_media:
+            arguments.append("--autoplay-policy=user-gesture-required")
+        return arguments
+
+    def apply_chrome_options(self, chrome_options, save_path=None):
+        for argument in self.chrome_arguments():
+            chrome_options.add_argument(argument)
+        prefs = self.chrome_prefs(save_path=save_path)
+        if prefs:
+            chrome_options.add_experimental_option("prefs", prefs)
+
+    def firefox_preferences(self):
+        preferences = {}
+        if self.block_images:
+            preferences["permissions.default.image"] = 2
+        if self.block_stylesheets:
+            preferences["permissions.default.stylesheet"] = 2
+        if self.block_fonts:
+            preferences["gfx.downloadable_fonts.enabled"] = False
+            preferences["browser.display.use_document_fonts"] = 0
+        if self.block_media:
+            preferences["media.autoplay.default"] = 5
+            preferences["media.play-stand-alone"] = False
+        if self.no_js:
+            preferences["javascript.enabled"] = False
+        if self.lean:
+            for name, value in LEAN_FIREFOX_PREFERENCES.items():
+                preferences.setdefault(name, value)
+        return preferences
+
+    def apply_firefox_options(self, firefox_options):
+        for name, value in self.firefox_preferences().items():
+            firefox_options.set_preference(name, value)
+        if self.block_url_patterns:
+            self.logger.warning("the firefox driver can not block the url patterns, they are ignored.")
+
+    def apply_driver(self, driver):
+        """
+        block the resource urls through the devtools protocol of a launched chrome driver
+        """
+        patterns = self.blocked_url_patterns()
+        if not patterns or not hasattr(driver, "execute_cdp_cmd"):
+            return
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        except Exception as e:
+            self.logger.warning("Fail to block the resource urls of the driver, error info: {}".format(e))
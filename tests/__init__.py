@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# the tests run with fake drivers, no browser is needed, run them from the parent folder with
+# python -m unittest discover -s <package>/tests -t .
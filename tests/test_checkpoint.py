@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from ..benchmarks import FakeDriverSettings, fake_webdriver
+from ..checkpoint import TaskJournal
+from ..core_spider import CoreSpider, Task
+
+
+class _Task(object):
+    def __init__(self, kw, url=None):
+        self.kw = kw
+        self.url = url
+
+
+class TaskJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        self.path = os.path.join(self.folder, "journal.log")
+
+    def make_journal(self):
+        journal = TaskJournal(self.path, compact_threshold=1000)
+        self.addCleanup(journal.close)
+        return journal
+
+    def test_pending_tasks_are_loaded(self):
+        journal = self.make_journal()
+        tasks = [_Task(index) for index in range(3)]
+        for task in tasks:
+            journal.assign_id(task)
+            self.assertTrue(journal.put(task, {"kw": task.kw}))
+        journal.done(tasks[1].journal_id)
+        journal.close()
+        pending_states, _, _ = TaskJournal(self.path).load()
+        self.assertEqual(sorted(state["kw"] for state in pending_states), [0, 2])
+
+    def test_done_before_put_is_not_pending(self):
+        journal = self.make_journal()
+        task = _Task(1)
+        journal.assign_id(task)
+        journal.done(task.journal_id)
+        journal.put(task, {"kw": task.kw})
+        journal.close()
+        self.assertEqual(TaskJournal(self.path).load()[0], [])
+
+    def test_unserializable_task_is_forgotten(self):
+        journal = self.make_journal()
+        task = _Task({1, 2})
+        journal.assign_id(task)
+        self.assertFalse(journal.put(task, {"kw": task.kw}))
+        self.assertIsNone(task.journal_id)
+        journal.done(task.journal_id)
+        self.assertEqual(journal._early_done_ids, set())
+        self.assertEqual(journal._putting_ids, set())
+
+    def test_cancelled_id_is_forgotten(self):
+        journal = self.make_journal()
+        task = _Task(1)
+        journal.assign_id(task)
+        journal.cancel(task)
+        self.assertIsNone(task.journal_id)
+        self.assertEqual(journal._putting_ids, set())
+
+    def test_cut_last_line_is_skipped(self):
+        journal = self.make_journal()
+        task = _Task(1)
+        journal.put(task, {"kw": task.kw})
+        journal.close()
+        with open(self.path, "a") as f:
+            f.write('{"op": "put", "id": "cut')
+        self.assertEqual([state["kw"] for state in TaskJournal(self.path).load()[0]], [1])
+
+
+class _TreeSpider(CoreSpider):
+    """
+    crawls a binary tree of tasks, kill_after tasks are handled before the spider is killed, the tasks take long
+    enough that the killed spider leaves some of them
+    """
+
+    def __init__(self, done_list, kill_after=None, **kwargs):
+        super(_TreeSpider, self).__init__(**kwargs)
+        self.done_list = done_list
+        self.kill_after = kill_after
+        self._done_lock = threading.Lock()
+
+    def task_create(self):
+        return Task(self.parse, url="http://tree.com/1", kw=1)
+
+    def parse(self, task, driver):
+        time.sleep(0.05)
+        if task.kw < 32:
+            yield Task(self.parse, url="http://tree.com/{}".format(task.kw * 2), kw=task.kw * 2)
+            yield Task(self.parse, url="http://tree.com/{}".format(task.kw * 2 + 1), kw=task.kw * 2 + 1)
+        with self._done_lock:
+            self.done_list.append(task.kw)
+            if self.kill_after is not None and len(self.done_list) >= self.kill_after:
+                self.killed._kill_now = True
+
+
+_module_done_list = []
+# the killer of the running _ModuleHandlerSpider and the task size it is killed after
+_module_kill = {"killer": None, "after": None}
+
+
+def parse_module_level(task, driver):
+    """
+    a module level handle_func, it is saved to the journal as module:qualname
+    """
+    time.sleep(0.05)
+    if task.kw < 32:
+        yield Task(parse_module_level, url="http://tree.com/{}".format(task.kw * 2), kw=task.kw * 2)
+        yield Task(parse_module_level, url="http://tree.com/{}".format(task.kw * 2 + 1), kw=task.kw * 2 + 1)
+    _module_done_list.append(task.kw)
+    if _module_kill["after"] is not None and len(_module_done_list) >= _module_kill["after"]:
+        _module_kill["killer"]._kill_now = True
+
+
+class _ModuleHandlerSpider(CoreSpider):
+    def __init__(self, kill_after=None, **kwargs):
+        super(_ModuleHandlerSpider, self).__init__(**kwargs)
+        _module_kill.update(killer=self.killed, after=kill_after)
+
+    def task_create(self):
+        return Task(parse_module_level, url="http://tree.com/1", kw=1)
+
+
+class TaskStateTest(unittest.TestCase):
+    def test_module_level_handle_func_is_referenced_by_name(self):
+        task = Task(parse_module_level, kw=1)
+        state = json.loads(json.dumps(task.journal_state()))
+        self.assertEqual(state["handle_func"], "{}:parse_module_level".format(__name__))
+        self.assertIs(Task.from_state(state, None).handle_func, parse_module_level)
+
+    def test_spider_method_is_referenced_by_its_name(self):
+        spider = _TreeSpider([], pre_warm=False, save_folder=tempfile.gettempdir())
+        self.addCleanup(spider.driver_poll.clear_driver_pool)
+        state = Task(spider.parse, kw=1).journal_state()
+        self.assertEqual(state["handle_func"], "parse")
+        self.assertEqual(Task.from_state(state, spider).handle_func, spider.parse)
+
+    def test_lambda_can_not_be_saved(self):
+        journal = TaskJournal(os.path.join(tempfile.mkdtemp(), "journal.log"))
+        self.addCleanup(journal.close, remove=True)
+        task = Task(lambda task, driver: None, kw=1)
+        with self.assertLogs(journal.logger, "WARNING") as logs:
+            self.assertFalse(journal.put(task, task.journal_state()))
+        self.assertIn("module level function", logs.output[0])
+
+
+class SpiderResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        webdriver_patch = fake_webdriver(FakeDriverSettings(launch_latency=0, page_load_latency=0))
+        webdriver_patch.__enter__()
+        self.addCleanup(webdriver_patch.__exit__, None, None, None)
+
+    def run_spider(self, done_list, kill_after=None):
+        spider = _TreeSpider(done_list, kill_after=kill_after, concurrent=2, pre_warm=False,
+                             save_folder=self.folder, checkpoint_path=os.path.join(self.folder, "journal.log"))
+        spider.schedule()
+        return spider
+
+    def test_killed_spider_resumes_every_task_once(self):
+        first_run, second_run = [], []
+        self.run_spider(first_run, kill_after=4)
+        self.assertLess(len(first_run), 63)
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "journal.log")))
+        self.run_spider(second_run)
+        self.assertEqual(sorted(first_run + second_run), list(range(1, 64)))
+        # the journal is removed once every task is done
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "journal.log")))
+
+    def test_killed_spider_with_a_module_level_handler_resumes(self):
+        journal_path = os.path.join(self.folder, "journal.log")
+        del _module_done_list[:]
+        _ModuleHandlerSpider(kill_after=4, concurrent=2, pre_warm=False, save_folder=self.folder,
+                             checkpoint_path=journal_path).schedule()
+        first_run = list(_module_done_list)
+        self.assertLess(len(first_run), 63)
+        self.assertTrue(os.path.exists(journal_path))
+        del _module_done_list[:]
+        _ModuleHandlerSpider(concurrent=2, pre_warm=False, save_folder=self.folder,
+                             checkpoint_path=journal_path).schedule()
+        self.assertEqual(sorted(first_run + _module_done_list), list(range(1, 64)))
+
+    def test_finished_spider_starts_over(self):
+        first_run, second_run = [], []
+        self.run_spider(first_run)
+        self.run_spider(second_run)
+        self.assertEqual(sorted(first_run), list(range(1, 64)))
+        self.assertEqual(sorted(second_run), list(range(1, 64)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from ..benchmarks import FakeDriverSettings, fake_webdriver
+from ..core_spider import CoreSpider, Task
+from ..download_manager import DownloadManager, DownloadTimeout
+
+
+def _write(directory, name, content="data"):
+    with open(os.path.join(directory, name), "w") as f:
+        f.write(content)
+
+
+def _read(file_path):
+    with open(file_path) as f:
+        return f.read()
+
+
+class DownloadManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        self.save_folder = os.path.join(self.folder, "downloads")
+
+    def make_manager(self, **kwargs):
+        kwargs.setdefault("poll_interval", 0.01)
+        kwargs.setdefault("stable_time", 0.05)
+        return DownloadManager(self.save_folder, **kwargs)
+
+
+class CompletionTest(DownloadManagerTestCase):
+    def test_partial_files_are_left_out(self):
+        manager = self.make_manager()
+        directory = manager.new_directory()
+        _write(directory, "done.csv")
+        _write(directory, "chrome.zip.crdownload")
+        # firefox writes the empty final file next to the partial one
+        _write(directory, "firefox.zip", "")
+        _write(directory, "firefox.zip.part")
+        self.assertEqual(manager.completed_files(directory), [os.path.join(directory, "done.csv")])
+        self.assertTrue(manager.downloading(directory))
+
+    def test_wait_for_downloads(self):
+        manager = self.make_manager()
+        directory = manager.new_directory()
+        _write(directory, "report.csv.crdownload")
+
+        def _complete():
+            os.rename(os.path.join(directory, "report.csv.crdownload"), os.path.join(directory, "report.csv"))
+
+        threading.Timer(0.1, _complete).start()
+        self.assertEqual(manager.wait_for_downloads(directory, timeout=5), [os.path.join(directory, "report.csv")])
+
+    def test_wait_for_downloads_times_out(self):
+        manager = self.make_manager()
+        directory = manager.new_directory()
+        _write(directory, "report.csv.crdownload")
+        with self.assertRaises(DownloadTimeout):
+            manager.wait_for_downloads(directory, timeout=0.1)
+        with self.assertRaises(DownloadTimeout):
+            manager.wait_for_downloads(directory, timeout=0.1, expected=2)
+
+
+class HandoffTest(DownloadManagerTestCase):
+    def test_files_are_kept_without_a_handler_and_a_done_folder(self):
+        manager = self.make_manager()
+        directory = manager.new_directory()
+        _write(directory, "report.csv")
+        manager.handoff(directory)
+        manager.join()
+        self.assertEqual(os.listdir(directory), ["report.csv"])
+        # the directory of a quit driver is kept with its files, an empty one is removed
+        manager.handoff(directory, remove=True)
+        self.assertTrue(os.path.exists(os.path.join(directory, "report.csv")))
+        empty_directory = manager.new_directory()
+        manager.handoff(empty_directory, remove=True)
+        self.assertFalse(os.path.exists(empty_directory))
+
+    def test_files_are_moved_to_the_done_folder(self):
+        done_folder = os.path.join(self.folder, "done")
+        manager = self.make_manager(done_folder=done_folder)
+        for _ in range(2):
+            directory = manager.new_directory()
+            _write(directory, "report.csv")
+            manager.handoff(directory)
+            self.assertEqual(os.listdir(directory), [])
+        manager.join()
+        self.assertEqual(sorted(os.listdir(done_folder)), ["report(1).csv", "report.csv"])
+
+    def test_handler_gets_every_completed_file(self):
+        handled = []
+        manager = self.make_manager(handler=lambda file_path: handled.append(
+            (os.path.basename(file_path), _read(file_path))))
+        directory = manager.new_directory()
+        _write(directory, "a.csv", "a")
+        _write(directory, "b.csv", "b")
+        manager.handoff(directory)
+        manager.join()
+        self.assertEqual(sorted(handled), [("a.csv", "a"), ("b.csv", "b")])
+        # the handed off files are deleted after the handler returns
+        self.assertEqual(os.listdir(os.path.join(self.save_folder, ".handoff")), [])
+
+    def test_directory_is_not_handed_off_while_downloading(self):
+        handled = []
+        manager = self.make_manager(handler=handled.append)
+        directory = manager.new_directory()
+        _write(directory, "done.csv")
+        _write(directory, "big.zip.crdownload")
+        manager.handoff(directory)
+        manager.join()
+        self.assertEqual(handled, [])
+        self.assertEqual(sorted(os.listdir(directory)), ["big.zip.crdownload", "done.csv"])
+        os.rename(os.path.join(directory, "big.zip.crdownload"), os.path.join(directory, "big.zip"))
+        manager.handoff(directory)
+        manager.join()
+        self.assertEqual(sorted(os.path.basename(file_path) for file_path in handled), ["big.zip", "done.csv"])
+
+
+class _DownloadSpider(CoreSpider):
+    def task_create(self):
+        return Task(self.start, url="http://files.com/")
+
+    def start(self, task, driver):
+        for index in range(3):
+            yield Task(self.download, url="http://files.com/{}".format(index), kw=index)
+
+    def download(self, task, driver):
+        driver.get(task.url)
+        _write(driver.save_path, "file-{}.csv".format(task.kw))
+
+
+class SpiderDownloadTest(DownloadManagerTestCase):
+    def setUp(self):
+        super(SpiderDownloadTest, self).setUp()
+        webdriver_patch = fake_webdriver(FakeDriverSettings(launch_latency=0, page_load_latency=0))
+        webdriver_patch.__enter__()
+        self.addCleanup(webdriver_patch.__exit__, None, None, None)
+
+    def downloaded_names(self, folder):
+        return sorted(name for _, _, names in os.walk(folder) for name in names)
+
+    def test_spider_keeps_the_downloads_by_default(self):
+        _DownloadSpider(concurrent=2, pre_warm=False, save_folder=self.save_folder).schedule()
+        self.assertEqual(self.downloaded_names(self.save_folder), ["file-0.csv", "file-1.csv", "file-2.csv"])
+
+    def test_spider_moves_the_downloads_to_the_done_folder(self):
+        done_folder = os.path.join(self.folder, "done")
+        spider = _DownloadSpider(concurrent=2, pre_warm=False, save_folder=self.save_folder,
+                                 download_done_folder=done_folder)
+        spider.schedule()
+        self.assertEqual(sorted(os.listdir(done_folder)), ["file-0.csv", "file-1.csv", "file-2.csv"])
+        self.assertEqual(self.downloaded_names(self.save_folder), [])
+
+    def test_spider_passes_the_downloads_to_the_handler(self):
+        handled = []
+        spider = _DownloadSpider(concurrent=2, pre_warm=False, save_folder=self.save_folder,
+                                 download_handler=lambda file_path: handled.append(os.path.basename(file_path)))
+        spider.schedule()
+        self.assertEqual(sorted(handled), ["file-0.csv", "file-1.csv", "file-2.csv"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from ..benchmarks import FakeDriverSettings, fake_webdriver
+from ..driver_pool import DriverPoll, LazyDriver, QueryDriverTimeout
+from ..page_cache import PageCache
+
+
+class DriverPoolTestCase(unittest.TestCase):
+    launch_latency = 0.01
+
+    def setUp(self):
+        self.save_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_folder, True)
+        webdriver_patch = fake_webdriver(FakeDriverSettings(launch_latency=self.launch_latency, page_load_latency=0,
+                                                            seed=0))
+        self.settings = webdriver_patch.__enter__()
+        self.addCleanup(webdriver_patch.__exit__, None, None, None)
+
+    def make_pool(self, **kwargs):
+        kwargs.setdefault("driver_size", 2)
+        pool = DriverPoll(save_folder=self.save_folder, **kwargs)
+        self.addCleanup(pool.clear_driver_pool)
+        return pool
+
+    def wait_until(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+
+class CheckoutTest(DriverPoolTestCase):
+    def test_query_launches_and_returns_driver(self):
+        pool = self.make_pool()
+        driver = pool.query_driver(timeout=5)
+        self.assertIsNotNone(driver)
+        self.assertEqual(pool.pool_stats()["busy"], 1)
+        pool.out_of_use(driver)
+        self.assertEqual(pool.pool_stats()["idle"], 1)
+        # the idle driver is reused instead of launching another one
+        self.assertIs(pool.query_driver(timeout=5), driver)
+        self.assertEqual(self.settings.launched_size, 1)
+
+    def test_query_times_out_when_every_driver_is_used(self):
+        pool = self.make_pool(driver_size=1)
+        pool.query_driver(timeout=5)
+        start_time = time.time()
+        with self.assertRaises(QueryDriverTimeout):
+            pool.query_driver(timeout=0.3)
+        self.assertGreaterEqual(time.time() - start_time, 0.3)
+        self.assertEqual(pool.metrics.snapshot()["counters"].get("checkout_timeouts_total"), 1)
+
+    def test_non_blocking_query_returns_none(self):
+        pool = self.make_pool(driver_size=1)
+        self.assertIsNone(pool.query_driver(block=False))
+        driver = pool.query_driver(timeout=5)
+        pool.out_of_use(driver)
+        self.assertIs(pool.query_driver(block=False), driver)
+
+    def test_waiter_gets_returned_driver(self):
+        pool = self.make_pool(driver_size=1)
+        driver = pool.query_driver(timeout=5)
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(pool.query_driver(timeout=5)))
+        waiter.start()
+        time.sleep(0.1)
+        pool.out_of_use(driver)
+        waiter.join(5)
+        self.assertEqual(result, [driver])
+
+    def test_concurrent_checkouts_never_share_a_driver(self):
+        pool = self.make_pool(driver_size=3)
+        lock = threading.Lock()
+        used, errors = set(), []
+
+        def _client():
+            for _ in range(20):
+                driver = pool.query_driver(timeout=5)
+                with lock:
+                    if id(driver) in used:
+                        errors.append(driver)
+                    used.add(id(driver))
+                time.sleep(0.001)
+                with lock:
+                    used.discard(id(driver))
+                pool.out_of_use(driver)
+
+        clients = [threading.Thread(target=_client) for _ in range(6)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join(30)
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(pool.driver_pool), 3)
+
+
+class ReplenishTest(DriverPoolTestCase):
+    def test_dequeued_driver_is_replaced(self):
+        pool = self.make_pool(driver_size=1)
+        driver = pool.query_driver(timeout=5)
+        self.assertTrue(pool.dequeue_driver(driver))
+        self.assertFalse(pool.dequeue_driver(driver))
+        replacement = pool.query_driver(timeout=5)
+        self.assertIsNot(replacement, driver)
+        self.assertTrue(self.wait_until(lambda: driver.quitted))
+
+    def test_expired_driver_is_restarted(self):
+        pool = self.make_pool(driver_size=1, soft_reset=False, driver_use_limit=1)
+        driver = pool.query_driver(timeout=5)
+        pool.out_of_use(driver)
+        replacement = pool.query_driver(timeout=5)
+        self.assertIsNot(replacement, driver)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_recycle_total{reason="use_limit"}'), 1)
+        self.assertTrue(self.wait_until(lambda: driver.quitted))
+
+
+class SizingTest(DriverPoolTestCase):
+    def test_warm_up_launches_drivers(self):
+        pool = self.make_pool(driver_size=3)
+        self.assertEqual(pool.warm_up(5), 3)
+        self.assertEqual(pool.pool_stats()["idle"], 3)
+        self.assertEqual(pool.warm_up(3), 0)
+
+    def test_max_size_overrides_driver_size(self):
+        pool = self.make_pool(driver_size=1, max_size=3)
+        self.assertEqual(pool.warm_up(3), 3)
+
+    def test_min_idle_drivers_are_kept_ready(self):
+        pool = self.make_pool(driver_size=3, min_idle=2)
+        driver = pool.query_driver(timeout=5)
+        self.assertTrue(self.wait_until(lambda: pool.pool_stats()["idle"] == 2))
+        pool.out_of_use(driver)
+        self.assertEqual(pool.pool_stats()["size"], 3)
+
+    def test_idle_drivers_are_quit_down_to_min_idle(self):
+        pool = self.make_pool(driver_size=3, min_idle=1, idle_timeout=0.1)
+        pool.warm_up(3)
+        self.assertTrue(self.wait_until(lambda: pool.pool_stats()["size"] == 1))
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_recycle_total{reason="idle_timeout"}'), 2)
+
+
+class SoftResetTest(DriverPoolTestCase):
+    def record_cdp_cmds(self, driver):
+        cdp_cmd_list = []
+        driver.execute_cdp_cmd = lambda cmd, cmd_args: cdp_cmd_list.append((cmd, cmd_args))
+        return cdp_cmd_list
+
+    def test_stale_driver_is_soft_reset(self):
+        pool = self.make_pool(driver_size=1, driver_use_limit=2)
+        driver = pool.query_driver(timeout=5)
+        pool.out_of_use(driver)
+        driver = pool.query_driver(timeout=5)
+        pool.out_of_use(driver)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_reset_total{reason="use_limit"}'), 1)
+        # the browser is kept
+        self.assertIs(pool.query_driver(timeout=5), driver)
+        self.assertEqual(driver.current_url, "about:blank")
+
+    def test_reset_clears_the_storage_of_every_visited_origin(self):
+        pool = self.make_pool(driver_size=1, driver_use_limit=1)
+        driver = pool.query_driver(timeout=5)
+        cdp_cmd_list = self.record_cdp_cmds(driver)
+        pool.goto(driver, "http://a.com/1")
+        pool.goto(driver, "https://b.com:8443/2")
+        pool.out_of_use(driver)
+        cleared_origins = [cmd_args["origin"] for cmd, cmd_args in cdp_cmd_list if cmd == "Storage.clearDataForOrigin"]
+        self.assertEqual(cleared_origins, ["http://a.com", "https://b.com:8443"])
+        self.assertIn(("Network.clearBrowserCookies", {}), cdp_cmd_list)
+        # the origins are forgotten after the reset
+        driver = pool.query_driver(timeout=5)
+        del cdp_cmd_list[:]
+        driver.get("about:blank")
+        pool.out_of_use(driver)
+        self.assertEqual([cmd for cmd, _ in cdp_cmd_list if cmd == "Storage.clearDataForOrigin"], [])
+
+    def test_failed_cdp_command_does_not_fail_the_reset(self):
+        pool = self.make_pool(driver_size=1, driver_use_limit=1)
+        driver = pool.query_driver(timeout=5)
+
+        def _execute_cdp_cmd(cmd, cmd_args):
+            raise Exception("unknown command")
+
+        driver.execute_cdp_cmd = _execute_cdp_cmd
+        pool.out_of_use(driver)
+        self.assertIs(pool.query_driver(timeout=5), driver)
+
+    def test_driver_failing_the_reset_is_restarted(self):
+        pool = self.make_pool(driver_size=1, driver_use_limit=1)
+        driver = pool.query_driver(timeout=5)
+        driver.quit()
+        pool.out_of_use(driver)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_recycle_total{reason="reset_error"}'), 1)
+        self.assertIsNot(pool.query_driver(timeout=5), driver)
+
+    def test_expired_driver_is_restarted_instead_of_reset(self):
+        pool = self.make_pool(driver_size=1, driver_use_limit=1, driver_restart_use_limit=2)
+        driver = pool.query_driver(timeout=5)
+        pool.out_of_use(driver)
+        self.assertIs(pool.query_driver(timeout=5), driver)
+        pool.out_of_use(driver)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_recycle_total{reason="use_limit"}'), 1)
+        self.assertIsNot(pool.query_driver(timeout=5), driver)
+
+
+class PageCacheTest(DriverPoolTestCase):
+    def make_cache_pool(self, **kwargs):
+        page_cache = PageCache(os.path.join(self.save_folder, "pages.db"))
+        self.addCleanup(page_cache.close)
+        return self.make_pool(page_cache=page_cache, **kwargs)
+
+    def test_cached_page_needs_no_driver(self):
+        pool = self.make_cache_pool(driver_size=1)
+        driver = pool.query_driver(timeout=5)
+        page_source = pool.goto(driver, "http://a.com/1")
+        pool.out_of_use(driver)
+        lazy_driver = LazyDriver(pool)
+        self.assertEqual(pool.goto(lazy_driver, "http://a.com/1"), page_source)
+        self.assertFalse(lazy_driver.acquired)
+        self.assertEqual(self.settings.get_size, 1)
+
+    def test_failed_cache_write_does_not_fail_goto(self):
+        pool = self.make_cache_pool(driver_size=1, max_per_host=1)
+
+        def _put(url, page_source, **meta):
+            raise Exception("disk full")
+
+        pool.page_cache.put = _put
+        driver = pool.query_driver(timeout=5)
+        self.assertIn("http://a.com/1", pool.goto(driver, "http://a.com/1", retry_times=2))
+        self.assertEqual(self.settings.get_size, 1)
+        # the host is released once
+        self.assertTrue(pool.host_scheduler.ready("http://a.com/2"))
+        self.assertIn("http://a.com/2", pool.goto(driver, "http://a.com/2"))
+
+
+class LazyDriverTest(DriverPoolTestCase):
+    def test_driver_is_queried_on_first_use(self):
+        pool = self.make_pool(driver_size=1)
+        lazy_driver = LazyDriver(pool)
+        self.assertFalse(lazy_driver.acquired)
+        self.assertEqual(lazy_driver.current_url, "about:blank")
+        self.assertTrue(lazy_driver.acquired)
+        pool.out_of_use(lazy_driver)
+        self.assertEqual(pool.pool_stats()["idle"], 1)
+
+    def test_unused_lazy_driver_is_returned_without_a_driver(self):
+        pool = self.make_pool(driver_size=1)
+        pool.out_of_use(LazyDriver(pool))
+        self.assertEqual(self.settings.launched_size, 0)
+
+    def test_served_page_is_loaded_when_acquired(self):
+        pool = self.make_pool(driver_size=1)
+        lazy_driver = LazyDriver(pool)
+        lazy_driver.served("http://example.com/page")
+        self.assertEqual(lazy_driver.current_url, "http://example.com/page")
+
+    def test_dequeued_lazy_driver_is_unwrapped(self):
+        pool = self.make_pool(driver_size=1)
+        lazy_driver = LazyDriver(pool)
+        driver = lazy_driver.acquire()
+        self.assertTrue(pool.dequeue_driver(lazy_driver))
+        self.assertIsNone(pool._get_slot(driver))
+
+
+class AffinityTest(DriverPoolTestCase):
+    def test_pinned_driver_is_returned_to_its_key(self):
+        pool = self.make_pool(driver_size=2)
+        first = pool.query_driver(timeout=5, affinity="a")
+        pool.out_of_use(first)
+        self.assertIs(pool.query_driver(timeout=5, affinity="a"), first)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('affinity_checkout_total{result="hit"}'), 1)
+
+    def test_key_falls_back_after_affinity_wait(self):
+        pool = self.make_pool(driver_size=2, affinity_wait=0.3)
+        first = pool.query_driver(timeout=5, affinity="a")
+        start_time = time.time()
+        second = pool.query_driver(timeout=5, affinity="a")
+        self.assertIsNot(second, first)
+        self.assertGreaterEqual(time.time() - start_time, 0.3)
+
+    def test_query_without_key_launches_instead_of_stealing(self):
+        pool = self.make_pool(driver_size=2, affinity_wait=5)
+        pinned = pool.query_driver(timeout=5, affinity="a")
+        pool.out_of_use(pinned)
+        start_time = time.time()
+        driver = pool.query_driver(timeout=5)
+        self.assertIsNot(driver, pinned)
+        self.assertLess(time.time() - start_time, 2)
+
+    def test_pinned_driver_is_taken_when_the_pool_is_full(self):
+        pool = self.make_pool(driver_size=1, affinity_wait=0.2)
+        pinned = pool.query_driver(timeout=5, affinity="a")
+        pool.out_of_use(pinned)
+        self.assertIs(pool.query_driver(timeout=5, affinity="b"), pinned)
+        self.assertEqual(pool.metrics.snapshot()["counters"].get('affinity_checkout_total{result="miss"}'), 2)
+
+    def test_released_key_frees_its_driver(self):
+        pool = self.make_pool(driver_size=1, affinity_wait=5)
+        pinned = pool.query_driver(timeout=5, affinity="a")
+        pool.out_of_use(pinned)
+        pool.release_affinity("a")
+        start_time = time.time()
+        self.assertIs(pool.query_driver(timeout=5), pinned)
+        self.assertLess(time.time() - start_time, 1)
+
+
+class ResizeTest(DriverPoolTestCase):
+    def test_resize_retires_idle_drivers(self):
+        pool = self.make_pool(driver_size=3)
+        pool.warm_up(3)
+        self.assertEqual(pool.resize(1), 2)
+        self.assertEqual(pool.pool_stats()["size"], 1)
+
+    def test_used_driver_over_the_size_is_retired_when_returned(self):
+        pool = self.make_pool(driver_size=2)
+        first = pool.query_driver(timeout=5)
+        second = pool.query_driver(timeout=5)
+        self.assertEqual(pool.resize(1), 0)
+        pool.out_of_use(first)
+        pool.out_of_use(second)
+        self.assertEqual(pool.pool_stats()["size"], 1)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_recycle_total{reason="shrink"}'), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
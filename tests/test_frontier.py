@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from queue import Empty, Full
+from ..frontier import BloomFilter, TaskFrontier, canonicalize_url
+
+
+class _Task(object):
+    def __init__(self, url, kw=None, priority=0, depth=0, dont_filter=False):
+        self.url = url
+        self.kw = kw
+        self.priority = priority
+        self.depth = depth
+        self.dont_filter = dont_filter
+
+
+class DedupeTest(unittest.TestCase):
+    def test_duplicate_is_dropped(self):
+        frontier = TaskFrontier()
+        self.assertTrue(frontier.put(_Task("http://a.com/1")))
+        self.assertFalse(frontier.put(_Task("http://a.com/1")))
+        self.assertTrue(frontier.put(_Task("http://a.com/1", kw={"page": 2})))
+        self.assertEqual(frontier.qsize(), 2)
+
+    def test_dont_filter_and_no_url_are_never_dropped(self):
+        frontier = TaskFrontier()
+        frontier.put(_Task("http://a.com/1"))
+        self.assertTrue(frontier.put(_Task("http://a.com/1", dont_filter=True)))
+        self.assertTrue(frontier.put(_Task(None)))
+        self.assertTrue(frontier.put(_Task(None)))
+
+    def test_dedupe_off(self):
+        frontier = TaskFrontier(dedupe=False)
+        frontier.put(_Task("http://a.com/1"))
+        self.assertTrue(frontier.put(_Task("http://a.com/1")))
+
+    def test_canonical_urls_are_duplicates(self):
+        self.assertEqual(canonicalize_url("HTTP://A.com/x?b=2&a=1#top"), canonicalize_url("http://a.com/x?a=1&b=2"))
+        frontier = TaskFrontier()
+        frontier.put(_Task("http://a.com/x?b=2&a=1"))
+        self.assertFalse(frontier.put(_Task("http://A.com/x?a=1&b=2#top")))
+
+    def test_duplicate_does_not_wait_for_a_full_frontier(self):
+        frontier = TaskFrontier(max_size=1)
+        frontier.put(_Task("http://a.com/1"))
+        start_time = time.time()
+        self.assertFalse(frontier.put(_Task("http://a.com/1"), timeout=1))
+        self.assertLess(time.time() - start_time, 0.5)
+        with self.assertRaises(Full):
+            frontier.put(_Task("http://a.com/2"), timeout=0.1)
+
+    def test_seen_state_restores_the_filter(self):
+        frontier = TaskFrontier()
+        frontier.put(_Task("http://a.com/1"))
+        restored = TaskFrontier()
+        restored.restore_seen(frontier.seen_state())
+        self.assertFalse(restored.put(_Task("http://a.com/1")))
+        self.assertTrue(restored.put(_Task("http://a.com/2")))
+
+
+class OrderingTest(unittest.TestCase):
+    def test_priority_then_depth_then_fifo(self):
+        frontier = TaskFrontier()
+        tasks = [_Task("http://a.com/low", priority=0, depth=0), _Task("http://a.com/deep", priority=1, depth=2),
+                 _Task("http://a.com/first", priority=1, depth=1), _Task("http://a.com/second", priority=1, depth=1)]
+        for task in tasks:
+            frontier.put(task)
+        self.assertEqual([frontier.get().url for _ in tasks], ["http://a.com/first", "http://a.com/second",
+                                                               "http://a.com/deep", "http://a.com/low"])
+
+    def test_stop_signal_is_got_first(self):
+        frontier = TaskFrontier()
+        frontier.put(_Task("http://a.com/1"))
+        frontier.put(None)
+        self.assertIsNone(frontier.get())
+        self.assertEqual(frontier.get().url, "http://a.com/1")
+
+    def test_ready_host_is_got_before_a_busy_one(self):
+        frontier = TaskFrontier(host_ready=lambda url: "busy" not in url)
+        frontier.put(_Task("http://busy.com/1", priority=1))
+        frontier.put(_Task("http://free.com/1"))
+        self.assertEqual(frontier.get().url, "http://free.com/1")
+        self.assertEqual(frontier.get().url, "http://busy.com/1")
+
+    def test_get_blocks_until_put(self):
+        frontier = TaskFrontier()
+        with self.assertRaises(Empty):
+            frontier.get(timeout=0.05)
+        threading.Timer(0.05, frontier.put, args=(_Task("http://a.com/1"), )).start()
+        self.assertEqual(frontier.get(timeout=5).url, "http://a.com/1")
+
+    def test_join_returns_when_every_task_is_done(self):
+        frontier = TaskFrontier()
+        frontier.put(_Task("http://a.com/1"))
+        frontier.get()
+        self.assertEqual(frontier.unfinished_tasks, 1)
+        frontier.task_done()
+        frontier.join()
+        self.assertEqual(frontier.unfinished_tasks, 0)
+
+
+class BloomFilterTest(unittest.TestCase):
+    def test_added_keys_are_found(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.001)
+        self.assertTrue(bloom_filter.add("a"))
+        self.assertFalse(bloom_filter.add("a"))
+        self.assertIn("a", bloom_filter)
+        self.assertNotIn("b", bloom_filter)
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        for index in range(1000):
+            bloom_filter.add("key-{}".format(index))
+        false_positive_size = sum(1 for index in range(10000) if "other-{}".format(index) in bloom_filter)
+        self.assertLess(false_positive_size, 300)
+
+
+if __name__ == "__main__":
+    unittest.main()
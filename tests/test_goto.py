@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import unittest
+from selenium.common.exceptions import (InvalidArgumentException, NoSuchWindowException, TimeoutException,
+                                        WebDriverException)
+from .test_driver_pool import DriverPoolTestCase
+from ..driver_pool import DriverPoll
+
+
+class _FailingGet(object):
+    """
+    the driver.get raising the errors in turn before it loads the page
+    """
+
+    def __init__(self, driver, error_list):
+        self.get = driver.get
+        self.error_list = list(error_list)
+        self.call_size = 0
+
+    def __call__(self, url):
+        self.call_size += 1
+        if self.error_list:
+            raise self.error_list.pop(0)
+        return self.get(url)
+
+
+class RetryClassificationTest(unittest.TestCase):
+    def test_retryable_errors(self):
+        self.assertTrue(DriverPoll.is_retryable_error(TimeoutException("timeout")))
+        self.assertTrue(DriverPoll.is_retryable_error(WebDriverException("net::ERR_CONNECTION_RESET")))
+        self.assertTrue(DriverPoll.is_retryable_error(ValueError("anything else")))
+
+    def test_fatal_errors(self):
+        self.assertFalse(DriverPoll.is_retryable_error(InvalidArgumentException("invalid argument")))
+        self.assertFalse(DriverPoll.is_retryable_error(NoSuchWindowException("no such window")))
+        self.assertFalse(DriverPoll.is_retryable_error(WebDriverException("chrome not reachable")))
+        self.assertFalse(DriverPoll.is_retryable_error(WebDriverException("Session deleted because of page crash")))
+
+    def test_backoff_doubles_with_jitter_up_to_the_max(self):
+        pool = DriverPoll(save_folder="", retry_delay=1, retry_max_delay=5)
+        for err_times, delay in ((1, 1), (2, 2), (3, 4), (4, 5), (10, 5)):
+            for _ in range(20):
+                backoff = pool._retry_backoff(err_times)
+                self.assertTrue(delay / 2 <= backoff <= delay, (err_times, backoff))
+
+
+class GotoTest(DriverPoolTestCase):
+    def make_pool(self, **kwargs):
+        kwargs.setdefault("retry_delay", 0.01)
+        return super(GotoTest, self).make_pool(**kwargs)
+
+    def test_page_source_is_returned(self):
+        pool = self.make_pool()
+        driver = pool.query_driver(timeout=5)
+        self.assertIn("http://a.com/1", pool.goto(driver, "http://a.com/1"))
+        self.assertEqual(driver.current_url, "http://a.com/1")
+
+    def test_retryable_error_is_retried(self):
+        pool = self.make_pool()
+        driver = pool.query_driver(timeout=5)
+        driver.get = _FailingGet(driver, [TimeoutException("timeout"), TimeoutException("timeout")])
+        self.assertIn("http://a.com/1", pool.goto(driver, "http://a.com/1", retry_times=2))
+        self.assertEqual(driver.get.call_size, 3)
+        self.assertEqual(pool.metrics.snapshot()["counters"].get("goto_retries_total"), 2)
+
+    def test_error_is_raised_after_the_retries(self):
+        pool = self.make_pool()
+        driver = pool.query_driver(timeout=5)
+        driver.get = _FailingGet(driver, [TimeoutException("timeout")] * 3)
+        with self.assertRaises(TimeoutException):
+            pool.goto(driver, "http://a.com/1", retry_times=1)
+        self.assertEqual(driver.get.call_size, 2)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('goto_failures_total{error="retryable"}'), 1)
+
+    def test_fatal_error_is_never_retried(self):
+        pool = self.make_pool()
+        driver = pool.query_driver(timeout=5)
+        driver.get = _FailingGet(driver, [WebDriverException("chrome not reachable")])
+        with self.assertRaises(WebDriverException):
+            pool.goto(driver, "http://a.com/1", retry_times=3)
+        self.assertEqual(driver.get.call_size, 1)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('goto_failures_total{error="fatal"}'), 1)
+        self.assertIsNone(counters.get("goto_retries_total"))
+
+    def test_wait_for_timeout_is_retried(self):
+        pool = self.make_pool()
+        driver = pool.query_driver(timeout=5)
+        with self.assertRaises(TimeoutException):
+            pool.goto(driver, "http://a.com/1", wait_for=lambda _driver: False, wait_timeout=0.1)
+        driver.get = _FailingGet(driver, [])
+        # the content shows up only after the page is loaded again
+        self.assertIn("http://a.com/1", pool.goto(driver, "http://a.com/1", retry_times=1,
+                                                  wait_for=lambda _driver: _driver.get.call_size >= 2,
+                                                  wait_timeout=0.1))
+        self.assertEqual(driver.get.call_size, 2)
+
+    def test_page_load_strategy_is_set_on_the_driver(self):
+        pool = self.make_pool(page_load_strategy="eager")
+        driver = pool.query_driver(timeout=5)
+        self.assertEqual(driver.options.to_capabilities()["pageLoadStrategy"], "eager")
+
+
+if __name__ == "__main__":
+    unittest.main()
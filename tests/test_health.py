@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from .test_driver_pool import DriverPoolTestCase
+from ..common.process import children_map, kill_process_tree, process_info, process_tree, tree_rss
+
+HAS_PROC = os.path.isdir("/proc")
+
+
+class ProcessTestCase(DriverPoolTestCase):
+    def start_process(self, name="sleep"):
+        """
+        start a sleeping child process with the name, e.g. a fake chromedriver
+        """
+        executable = shutil.which("sleep")
+        if name != "sleep":
+            folder = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, folder, True)
+            shutil.copy(executable, os.path.join(folder, name))
+            executable = os.path.join(folder, name)
+        process = subprocess.Popen([executable, "30"])
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        return process
+
+
+@unittest.skipIf(not HAS_PROC, "the process helpers need /proc")
+class ProcessHelperTest(ProcessTestCase):
+    def test_process_info_and_tree(self):
+        process = self.start_process()
+        name, parent_pid, age = process_info(process.pid)
+        self.assertEqual((name, parent_pid), ("sleep", os.getpid()))
+        self.assertLess(age, 30)
+        self.assertIn(process.pid, process_tree(os.getpid()))
+        self.assertGreater(tree_rss(process.pid), 0)
+
+    def test_kill_process_tree(self):
+        process = self.start_process()
+        self.assertEqual(kill_process_tree(process.pid), 1)
+        process.wait(5)
+        self.assertIsNone(process_info(process.pid))
+        self.assertNotIn(process.pid, children_map().get(os.getpid(), []))
+
+
+class HealthCheckTest(ProcessTestCase):
+    def test_driver_not_answering_is_restarted(self):
+        pool = self.make_pool(driver_size=1, ping_timeout=0.1, kill_orphans=False)
+        driver = pool.query_driver(timeout=5)
+        driver.execute_script = lambda script, *args: time.sleep(1)
+        pool.out_of_use(driver)
+        pool.check_health()
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_recycle_total{reason="unhealthy"}'), 1)
+        self.assertIsNot(pool.query_driver(timeout=5), driver)
+
+    def test_healthy_driver_is_kept_in_the_free_list(self):
+        pool = self.make_pool(driver_size=2, kill_orphans=False)
+        pool.warm_up(2)
+        idle_drivers = [slot.driver for slot in pool._idle_slots.values()]
+        pool.check_health()
+        self.assertEqual([slot.driver for slot in pool._idle_slots.values()], idle_drivers)
+        self.assertEqual(pool.pool_stats()["idle"], 2)
+
+    @unittest.skipIf(not HAS_PROC, "the memory check needs /proc")
+    def test_driver_over_the_memory_limit_is_restarted(self):
+        pool = self.make_pool(driver_size=1, max_driver_memory=0.001, kill_orphans=False)
+        driver = pool.query_driver(timeout=5)
+        pool._get_slot(driver).service_pid = self.start_process().pid
+        pool.out_of_use(driver)
+        pool.check_health()
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_recycle_total{reason="memory"}'), 1)
+
+    @unittest.skipIf(not HAS_PROC, "killing the hung driver needs /proc")
+    def test_hung_driver_processes_are_killed(self):
+        pool = self.make_pool(driver_size=1, hang_timeout=0.1, kill_orphans=False)
+        driver = pool.query_driver(timeout=5)
+        process = self.start_process()
+        pool._get_slot(driver).service_pid = process.pid
+        time.sleep(0.2)
+        pool.check_health()
+        process.wait(5)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('driver_recycle_total{reason="hung"}'), 1)
+        self.assertIsNone(pool._get_slot(driver))
+
+
+@unittest.skipIf(not HAS_PROC, "the orphan check needs /proc")
+class OrphanTest(ProcessTestCase):
+    def test_unknown_driver_service_is_killed(self):
+        pool = self.make_pool(driver_size=1, orphan_grace=0)
+        orphan = self.start_process("chromedriver")
+        other = self.start_process()
+        time.sleep(0.05)
+        pool.check_health()
+        orphan.wait(5)
+        self.assertIsNone(other.poll())
+        self.assertEqual(pool.metrics.snapshot()["counters"].get("orphan_processes_killed_total"), 1)
+
+    def test_known_and_young_driver_services_are_kept(self):
+        pool = self.make_pool(driver_size=1, orphan_grace=0)
+        driver = pool.query_driver(timeout=5)
+        known = self.start_process("chromedriver")
+        pool._get_slot(driver).service_pid = known.pid
+        pool.orphan_grace = 60
+        young = self.start_process("chromedriver")
+        pool.check_health()
+        self.assertIsNone(known.poll())
+        self.assertIsNone(young.poll())
+
+    def test_queued_pid_is_killed_only_if_it_is_still_a_driver_service(self):
+        pool = self.make_pool(driver_size=1, orphan_grace=60)
+        # the pid of the service a failed quit left behind, reused by another process
+        reused = self.start_process()
+        pool._orphan_pids.append(reused.pid)
+        pool.check_health()
+        self.assertIsNone(reused.poll())
+        failed_quit = self.start_process("geckodriver")
+        pool._orphan_pids.append(failed_quit.pid)
+        pool.check_health()
+        failed_quit.wait(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from ..common.metrics import Metrics
+from ..host_scheduler import HostScheduler, url_host, url_origin
+
+
+class HostSchedulerTest(unittest.TestCase):
+    def test_max_per_host(self):
+        scheduler = HostScheduler(max_per_host=2)
+        self.assertTrue(scheduler.acquire("http://a.com/1"))
+        self.assertTrue(scheduler.acquire("http://a.com/2"))
+        self.assertFalse(scheduler.ready("http://a.com/3"))
+        self.assertFalse(scheduler.acquire("http://a.com/3", timeout=0.1))
+        # the other hosts are not limited
+        self.assertTrue(scheduler.acquire("http://b.com/1", timeout=0.1))
+        scheduler.release("http://a.com/1")
+        self.assertTrue(scheduler.acquire("http://a.com/3", timeout=0.1))
+
+    def test_min_delay_between_requests(self):
+        scheduler = HostScheduler(min_delay=0.2)
+        scheduler.acquire("http://a.com/1")
+        scheduler.release("http://a.com/1")
+        self.assertFalse(scheduler.ready("http://a.com/2"))
+        start_time = time.time()
+        scheduler.acquire("http://a.com/2")
+        self.assertGreaterEqual(time.time() - start_time, 0.15)
+
+    def request(self, scheduler, url, **kwargs):
+        state = scheduler._host_states.get(url_host(url))
+        if state is not None:
+            # skip the delay of the host instead of sleeping it
+            state.next_time = 0
+        self.assertTrue(scheduler.acquire(url, timeout=0))
+        scheduler.release(url, **kwargs)
+
+    def test_failed_request_backs_off_and_recovers(self):
+        metrics = Metrics()
+        scheduler = HostScheduler(min_delay=0.01, max_delay=8, metrics=metrics)
+        self.request(scheduler, "http://a.com/1", elapsed=0.1, ok=False)
+        # the backoff delay is at least 1 second
+        self.assertEqual(scheduler.host_delay("http://a.com/"), 1)
+        self.assertFalse(scheduler.ready("http://a.com/2"))
+        self.assertTrue(scheduler.ready("http://b.com/1"))
+        self.assertEqual(metrics.snapshot()["counters"].get("host_backoff_total"), 1)
+        for _ in range(4):
+            self.request(scheduler, "http://a.com/1", elapsed=0.1, ok=False)
+        self.assertEqual(scheduler.host_delay("http://a.com/"), 8)
+        for _ in range(12):
+            self.request(scheduler, "http://a.com/1", elapsed=0.1)
+        self.assertEqual(scheduler.host_delay("http://a.com/"), 0.01)
+        self.assertEqual(metrics.snapshot()["counters"].get("host_backoff_total"), 5)
+
+    def test_slow_request_backs_off(self):
+        scheduler = HostScheduler(slow_threshold=1)
+        self.request(scheduler, "http://a.com/1", elapsed=0.5)
+        self.assertEqual(scheduler.host_delay("http://a.com/"), 0)
+        self.request(scheduler, "http://a.com/1", elapsed=2)
+        self.assertEqual(scheduler.host_delay("http://a.com/"), 1)
+
+    def test_idle_host_is_forgotten(self):
+        scheduler = HostScheduler(max_per_host=1)
+        scheduler.acquire("http://a.com/1")
+        self.assertIn("a.com", scheduler._host_states)
+        scheduler.release("http://a.com/1")
+        self.assertNotIn("a.com", scheduler._host_states)
+
+    def test_url_host_and_origin(self):
+        self.assertEqual(url_host("http://User@A.com:8080/x"), "a.com")
+        self.assertEqual(url_origin("https://user:pw@A.com:8080/x?y=1"), "https://a.com:8080")
+        self.assertIsNone(url_origin("about:blank"))
+        self.assertIsNone(url_origin(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import requests
+from .test_driver_pool import DriverPoolTestCase
+from ..driver_pool import LazyDriver
+from ..http_fetcher import HttpFetcher
+
+STATIC_PAGE = "<html><body><p>{}</p></body></html>".format("static text " * 40)
+JS_PAGE = "<html><body><div id='app'></div><noscript>Please enable JavaScript</noscript></body></html>"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, body = (200, STATIC_PAGE) if self.path.startswith("/static") else \
+            (200, JS_PAGE) if self.path.startswith("/js") else (404, "not found")
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def _closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:{}/static".format(sock.getsockname()[1])
+
+
+class HttpTestCase(DriverPoolTestCase):
+    def setUp(self):
+        super(HttpTestCase, self).setUp()
+        server = _ThreadingHTTPServer(("127.0.0.1", 0), _PageHandler)
+        server_thd = threading.Thread(target=server.serve_forever)
+        server_thd.setDaemon(True)
+        server_thd.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+class HttpFetcherTest(HttpTestCase):
+    def make_fetcher(self, **kwargs):
+        fetcher = HttpFetcher(self.make_pool(), timeout=5, **kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_static_page_is_fetched(self):
+        self.assertEqual(self.make_fetcher().fetch(self.base_url + "/static"), STATIC_PAGE)
+
+    def test_page_needing_javascript_is_escalated(self):
+        fetcher = self.make_fetcher()
+        self.assertIsNone(fetcher.fetch(self.base_url + "/js"))
+        self.assertIsNone(fetcher.fetch(self.base_url + "/missing"))
+        # the caller decides what needs the browser
+        self.assertEqual(fetcher.fetch(self.base_url + "/js", needs_browser=lambda response: False), JS_PAGE)
+        counters = fetcher.driver_poll.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('http_fetch_total{result="escalated"}'), 2)
+
+    def test_failed_request_raises(self):
+        fetcher = self.make_fetcher()
+        with self.assertRaises(requests.RequestException):
+            fetcher.fetch(_closed_port_url())
+        counters = fetcher.driver_poll.metrics.snapshot()["counters"]
+        self.assertEqual(counters.get('http_fetch_total{result="error"}'), 1)
+
+    def test_auto_mode_learns_the_hosts_needing_the_browser(self):
+        fetcher = self.make_fetcher(learn_threshold=2, probe_interval=3)
+        url = self.base_url + "/js"
+        self.assertTrue(fetcher.use_http(url, "http"))
+        self.assertFalse(fetcher.use_http(url, "browser"))
+        for _ in range(2):
+            self.assertTrue(fetcher.use_http(url, "auto"))
+            fetcher.fetch(url)
+        self.assertEqual([fetcher.use_http(url, "auto") for _ in range(3)], [False, False, True])
+        # a static page from the host resets what is learned
+        fetcher.fetch(self.base_url + "/static")
+        self.assertTrue(fetcher.use_http(url, "auto"))
+
+
+class GotoEscalationTest(HttpTestCase):
+    def test_static_page_needs_no_driver(self):
+        pool = self.make_pool(fetch_mode="http")
+        lazy_driver = LazyDriver(pool)
+        self.assertEqual(pool.goto(lazy_driver, self.base_url + "/static"), STATIC_PAGE)
+        self.assertFalse(lazy_driver.acquired)
+        self.assertEqual(self.settings.get_size, 0)
+
+    def test_escalated_page_does_not_back_the_host_off(self):
+        pool = self.make_pool(fetch_mode="http", host_delay=0.05)
+        lazy_driver = LazyDriver(pool)
+        start_time = time.time()
+        for index in range(3):
+            url = "{}/js/{}".format(self.base_url, index)
+            self.assertIn(url, pool.goto(lazy_driver, url))
+        self.assertLess(time.time() - start_time, 1)
+        self.assertEqual(self.settings.get_size, 3)
+        counters = pool.metrics.snapshot()["counters"]
+        self.assertIsNone(counters.get("host_backoff_total"))
+        self.assertEqual(counters.get('http_fetch_total{result="escalated"}'), 3)
+
+    def test_failed_request_backs_the_host_off_and_uses_the_browser(self):
+        pool = self.make_pool(fetch_mode="http", host_delay=0.01)
+        driver = pool.query_driver(timeout=5)
+        url = _closed_port_url()
+        self.assertIn(url, pool.goto(driver, url))
+        self.assertEqual(self.settings.get_size, 1)
+        self.assertEqual(pool.metrics.snapshot()["counters"].get("host_backoff_total"), 1)
+
+    def test_wait_for_always_uses_the_browser(self):
+        pool = self.make_pool(fetch_mode="http")
+        driver = pool.query_driver(timeout=5)
+        pool.goto(driver, self.base_url + "/static", wait_for=lambda _driver: True)
+        self.assertEqual(self.settings.get_size, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from ..common import log
+from ..common.log import Logger, dropped_log_size, setup_logging, stop_logging
+
+
+class _BlockedStream(io.StringIO):
+    """
+    the stream of a slow disk, the writes wait until it is unblocked
+    """
+
+    def __init__(self):
+        super(_BlockedStream, self).__init__()
+        self.unblocked = threading.Event()
+
+    def write(self, text):
+        self.unblocked.wait(5)
+        return super(_BlockedStream, self).write(text)
+
+
+class SetupLoggingTest(unittest.TestCase):
+    def setUp(self):
+        # setup_logging is global, the handlers of the loggers are restored after the test
+        with log._log_config_lock:
+            saved_config = log._log_config
+            saved_handlers = dict((name, list(handlers)) for name, handlers in log._logger_handlers.items())
+        self.addCleanup(self.restore_logging, saved_config, saved_handlers)
+
+    @staticmethod
+    def restore_logging(saved_config, saved_handlers):
+        stop_logging()
+        with log._log_config_lock:
+            if log._log_config is not saved_config:
+                for handler in log._log_config["target_handlers"]:
+                    handler.close()
+            for name in list(log._logger_handlers):
+                logger = logging.getLogger(name)
+                for handler in log._logger_handlers[name]:
+                    logger.removeHandler(handler)
+                if name not in saved_handlers:
+                    del log._logger_handlers[name]
+                    continue
+                for handler in saved_handlers[name]:
+                    logger.addHandler(handler)
+                log._logger_handlers[name] = saved_handlers[name]
+                logger.setLevel(logging.DEBUG)
+            log._log_config = saved_config
+
+    def make_logger(self, suffix):
+        return Logger("{}.{}.{}".format(__name__, self._testMethodName, suffix)).logger
+
+    def test_json_records_keep_the_extra_fields(self):
+        logger = self.make_logger("json")
+        stream = io.StringIO()
+        setup_logging(async_mode=False, json_format=True, stream=stream)
+        logger.info("task %s is queued", 1, extra={"event": "task_enqueue", "task_url": "http://a.com/1"})
+        data = json.loads(stream.getvalue())
+        self.assertEqual(data["message"], "task 1 is queued")
+        self.assertEqual(data["level"], "INFO")
+        self.assertEqual(data["logger"], logger.name)
+        self.assertEqual((data["event"], data["task_url"]), ("task_enqueue", "http://a.com/1"))
+
+    def test_levels_apply_to_the_logger_and_its_children(self):
+        quiet_logger = self.make_logger("quiet")
+        stream = io.StringIO()
+        setup_logging(async_mode=False, level=logging.INFO, levels={quiet_logger.name: "WARNING"}, stream=stream)
+        # a logger created after the call gets the config too
+        child_logger = Logger(quiet_logger.name + ".child").logger
+        other_logger = self.make_logger("other")
+        child_logger.info("hidden info")
+        child_logger.warning("shown warning")
+        other_logger.debug("hidden debug")
+        other_logger.info("shown info")
+        output = stream.getvalue()
+        self.assertNotIn("hidden", output)
+        self.assertIn("shown warning", output)
+        self.assertIn("shown info", output)
+
+    def test_sampled_event_keeps_one_of_every_n_records(self):
+        logger = self.make_logger("sample")
+        stream = io.StringIO()
+        setup_logging(async_mode=False, json_format=True, sample={"task_enqueue": 3}, stream=stream)
+        for index in range(7):
+            logger.info("task %s is queued", index, extra={"event": "task_enqueue"})
+        logger.info("task error", extra={"event": "task_error"})
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([record["message"] for record in records],
+                         ["task 0 is queued", "task 3 is queued", "task 6 is queued", "task error"])
+        self.assertEqual([record.get("sampled") for record in records], [3, 3, 3, None])
+
+    def test_async_records_are_written_by_the_listener(self):
+        logger = self.make_logger("async")
+        log_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_folder, True)
+        stream = io.StringIO()
+        setup_logging(json_format=True, log_folder=log_folder, stream=stream)
+        try:
+            raise ValueError("bad page")
+        except ValueError:
+            logger.exception("fail to handle task %s", 1)
+        stop_logging()
+        data = json.loads(stream.getvalue())
+        self.assertEqual(data["message"], "fail to handle task 1")
+        self.assertIn("ValueError: bad page", data["exc_info"])
+        file_name = "driver_pool_pid_{}.log".format(os.getpid())
+        with open(os.path.join(log_folder, file_name)) as log_file:
+            self.assertEqual(json.loads(log_file.read())["message"], "fail to handle task 1")
+        # the loggers write synchronously after stop_logging
+        logger.info("after the stop")
+        self.assertIn("after the stop", stream.getvalue())
+
+    def test_records_are_dropped_when_the_queue_is_full(self):
+        logger = self.make_logger("dropped")
+        stream = _BlockedStream()
+        setup_logging(queue_size=1, stream=stream)
+        for index in range(10):
+            logger.info("record %s", index)
+        # the listener holds one record and the queue another, the others are dropped instead of blocking
+        self.assertGreaterEqual(dropped_log_size(), 8)
+        stream.unblocked.set()
+        stop_logging()
+        self.assertIn("record 0", stream.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
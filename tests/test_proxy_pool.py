@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from ..benchmarks import FakeProxyServer
+from ..proxy_pool import ProxyPool
+
+
+class ProxyPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeProxyServer(size=3).start()
+        self.addCleanup(self.server.close)
+
+    def make_proxy_pool(self, **kwargs):
+        proxy_pool = ProxyPool(self.server.url, **kwargs)
+        self.addCleanup(proxy_pool.close)
+        return proxy_pool
+
+    def test_proxy_list_is_cached(self):
+        proxy_pool = self.make_proxy_pool(cache_ttl=60)
+        proxies = [proxy_pool.get_proxy() for _ in range(6)]
+        self.assertEqual(self.server.request_size, 1)
+        # round robin over the list
+        self.assertEqual(proxies[:3], proxies[3:])
+        self.assertEqual(len(set(proxies)), 3)
+
+    def test_expired_list_is_fetched_again(self):
+        proxy_pool = self.make_proxy_pool(cache_ttl=0.1, prefetch_ratio=0)
+        proxy_pool.get_proxy()
+        time.sleep(0.15)
+        proxy_pool.get_proxy()
+        self.assertEqual(self.server.request_size, 2)
+
+    def test_list_is_prefetched_before_it_expires(self):
+        proxy_pool = self.make_proxy_pool(cache_ttl=0.5, prefetch_ratio=1)
+        proxy_pool.get_proxy()
+        proxy_pool.get_proxy()
+        deadline = time.time() + 5
+        while self.server.request_size < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.request_size, 2)
+
+    def test_least_used_strategy(self):
+        proxy_pool = self.make_proxy_pool(strategy="least_used")
+        first = proxy_pool.get_proxy()
+        self.assertNotEqual(proxy_pool.get_proxy(), first)
+        self.assertEqual(len(set(proxy_pool.get_proxy() for _ in range(4))), 3)
+
+    def test_unknown_strategy_is_rejected(self):
+        with self.assertRaises(Exception):
+            ProxyPool(self.server.url, strategy="random")
+
+    def test_failed_proxy_is_quarantined(self):
+        proxy_pool = self.make_proxy_pool(quarantine_time=0.2)
+        failed_proxy = proxy_pool.get_proxy()
+        proxy_pool.report_failure(failed_proxy)
+        self.assertNotIn(failed_proxy, [proxy_pool.get_proxy() for _ in range(6)])
+        time.sleep(0.25)
+        self.assertIn(failed_proxy, [proxy_pool.get_proxy() for _ in range(3)])
+
+    def test_every_proxy_quarantined_raises(self):
+        proxy_pool = self.make_proxy_pool()
+        for _ in range(3):
+            proxy_pool.report_failure(proxy_pool.get_proxy())
+        with self.assertRaises(Exception):
+            proxy_pool.get_proxy()
+
+    def test_callers_of_a_cold_cache_share_one_request(self):
+        proxy_pool = self.make_proxy_pool()
+        start_event = threading.Event()
+        results = []
+
+        def _caller():
+            start_event.wait()
+            results.append(proxy_pool.get_proxy())
+
+        callers = [threading.Thread(target=_caller) for _ in range(16)]
+        for caller in callers:
+            caller.start()
+        start_event.set()
+        for caller in callers:
+            caller.join(10)
+        self.assertEqual(len(results), 16)
+        self.assertEqual(self.server.request_size, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
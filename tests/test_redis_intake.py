@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from ..benchmarks import FakeDriverSettings, fake_webdriver
+from ..core_spider import CoreRedisSpider, Task
+from ..redis_intake import RedisTaskIntake
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisTaskIntakeTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.redis.rpush("tasks", *["task-{}".format(index) for index in range(5)])
+
+    def make_intake(self, redis_key="tasks", **kwargs):
+        kwargs.setdefault("block_timeout", 0)
+        intake = RedisTaskIntake(self.redis, redis_key, **kwargs)
+        intake.recover()
+        return intake
+
+    def test_fetched_tasks_stay_in_processing_until_acked(self):
+        intake = self.make_intake(worker_id="w1")
+        raw_list = intake.fetch(3)
+        self.assertEqual(raw_list, [b"task-0", b"task-1", b"task-2"])
+        self.assertEqual(self.redis.llen(intake.processing_key), 3)
+        intake.ack(raw_list[0])
+        self.assertEqual(self.redis.lrange(intake.processing_key, 0, -1), [b"task-1", b"task-2"])
+
+    def test_restarted_worker_recovers_unacked_tasks(self):
+        intake = self.make_intake(worker_id="w1")
+        intake.ack(intake.fetch(2)[0])
+        intake.close()
+        restarted = RedisTaskIntake(self.redis, "tasks", worker_id="w1", block_timeout=0)
+        self.assertEqual(restarted.recover(), 1)
+        self.assertEqual(self.redis.lindex("tasks", 0), b"task-1")
+        self.assertEqual(self.redis.llen(restarted.processing_key), 0)
+
+    def test_default_worker_id_is_stable(self):
+        first = RedisTaskIntake(self.redis, "tasks")
+        second = RedisTaskIntake(self.redis, "tasks")
+        self.assertEqual(first.processing_key, second.processing_key)
+        self.assertIn(socket.gethostname(), first.processing_key)
+
+    def test_crashed_worker_on_this_host_is_recovered_before_its_lease_expires(self):
+        intake = self.make_intake()
+        intake.fetch(2)
+        # a worker killed without close, its pid is gone
+        self.redis.set(intake.processing_key + ":owner", "{}:999999999:dead".format(socket.gethostname()))
+        restarted = RedisTaskIntake(self.redis, "tasks", block_timeout=0)
+        self.assertEqual(restarted.recover(), 2)
+        self.assertTrue(restarted.recoverable)
+
+    def test_crashed_worker_is_recovered_after_its_lease_expires(self):
+        intake = self.make_intake(worker_id="w1", lease_time=60)
+        intake.fetch(2)
+        self.redis.set(intake.processing_key + ":owner", "other-host:1:dead", ex=60)
+        self.assertEqual(RedisTaskIntake(self.redis, "tasks", worker_id="w1", block_timeout=0).recover(), 0)
+        self.redis.delete(intake.processing_key + ":owner")
+        self.assertEqual(RedisTaskIntake(self.redis, "tasks", worker_id="w1", block_timeout=0).recover(), 2)
+
+    def test_running_worker_is_never_recovered_by_another(self):
+        first = self.make_intake(worker_id="w1")
+        first.fetch(2)
+        second = RedisTaskIntake(self.redis, "tasks", worker_id="w1", block_timeout=0)
+        self.assertEqual(second.recover(), 0)
+        self.assertFalse(second.recoverable)
+        self.assertNotEqual(first.processing_key, second.processing_key)
+        self.assertEqual(self.redis.llen(first.processing_key), 2)
+        second.fetch(1)
+        self.assertEqual(self.redis.llen(second.processing_key), 1)
+
+    def test_fetch_returns_empty_list_when_no_task(self):
+        intake = self.make_intake(redis_key="empty", worker_id="w1")
+        self.assertEqual(intake.fetch(4), [])
+
+
+class _RedisSpider(CoreRedisSpider):
+    redis_key = "pages"
+
+    def __init__(self, handled_list, stop_size, **kwargs):
+        super(_RedisSpider, self).__init__(**kwargs)
+        self.handled_list = handled_list
+        self.stop_size = stop_size
+        self._handled_lock = threading.Lock()
+
+    def task_create(self, kw):
+        return Task(self.parse, url="http://pages.com/{}".format(kw), kw=kw)
+
+    def parse(self, task, driver):
+        # every page links to the same page, the link is crawled once
+        if task.kw != "linked":
+            yield Task(self.parse, url="http://pages.com/linked", kw="linked")
+        with self._handled_lock:
+            self.handled_list.append(task.kw)
+            if len(self.handled_list) >= self.stop_size:
+                self.killed._kill_now = True
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisSpiderTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        webdriver_patch = fake_webdriver(FakeDriverSettings(launch_latency=0, page_load_latency=0))
+        webdriver_patch.__enter__()
+        self.addCleanup(webdriver_patch.__exit__, None, None, None)
+        self.redis = fakeredis.FakeStrictRedis()
+
+    def test_submitted_again_task_is_crawled_again(self):
+        handled_list = []
+        self.redis.rpush("pages", "a", "b", "a")
+        spider = _RedisSpider(handled_list, 4, concurrent=1, pre_warm=False, save_folder=self.folder,
+                              redis_cursor=self.redis)
+        spider.schedule()
+        self.assertEqual(sorted(handled_list), ["a", "a", "b", "linked"])
+        self.assertEqual(self.redis.llen("pages"), 0)
+        self.assertEqual(self.redis.llen(spider._redis_intake.processing_key), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from selenium import webdriver
+from ..benchmarks import FakeDriverSettings, fake_webdriver
+from ..driver_pool import DriverPoll
+from ..render_profile import IMAGE_URL_PATTERNS, LEAN_CHROME_ARGUMENTS, RenderProfile
+
+
+class _CdpDriver(object):
+    def __init__(self):
+        self.cdp_cmd_list = []
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        self.cdp_cmd_list.append((cmd, cmd_args))
+        return {}
+
+
+class RenderProfileTest(unittest.TestCase):
+    def test_only_html_blocks_every_resource_but_the_html(self):
+        profile = RenderProfile.from_flags(only_html=True)
+        self.assertTrue(profile.block_images and profile.block_fonts and profile.block_media and
+                        profile.block_stylesheets and profile.lean)
+        self.assertFalse(profile.no_js)
+        self.assertFalse(RenderProfile.from_flags(only_html=True, lean=False).lean)
+        self.assertEqual(RenderProfile.from_flags().blocked_url_patterns(), [])
+
+    def test_chrome_prefs_are_merged_into_one_option(self):
+        profile = RenderProfile.from_flags(only_html=True, no_js=True)
+        chrome_options = webdriver.ChromeOptions()
+        profile.apply_chrome_options(chrome_options, save_path="/tmp/downloads")
+        prefs = chrome_options.experimental_options["prefs"]
+        self.assertEqual(prefs["download.default_directory"], "/tmp/downloads")
+        self.assertEqual(prefs["profile.managed_default_content_settings.images"], 2)
+        self.assertEqual(prefs["profile.managed_default_content_settings.javascript"], 2)
+        for argument in LEAN_CHROME_ARGUMENTS:
+            self.assertIn(argument, chrome_options.arguments)
+
+    def test_default_profile_sets_no_chrome_prefs(self):
+        chrome_options = webdriver.ChromeOptions()
+        RenderProfile().apply_chrome_options(chrome_options)
+        self.assertNotIn("prefs", chrome_options.experimental_options)
+        self.assertEqual(chrome_options.arguments, [])
+
+    def test_firefox_preferences(self):
+        preferences = RenderProfile(block_images=True, no_js=True, lean=True).firefox_preferences()
+        self.assertEqual(preferences["permissions.default.image"], 2)
+        self.assertIs(preferences["javascript.enabled"], False)
+        self.assertIs(preferences["layers.acceleration.disabled"], True)
+        self.assertNotIn("permissions.default.stylesheet", preferences)
+
+    def test_blocked_urls_are_sent_to_chrome(self):
+        driver = _CdpDriver()
+        RenderProfile(block_images=True, block_url_patterns=["*ads.com*"]).apply_driver(driver)
+        self.assertEqual(driver.cdp_cmd_list[0], ("Network.enable", {}))
+        self.assertEqual(driver.cdp_cmd_list[1],
+                         ("Network.setBlockedURLs", {"urls": ["*ads.com*"] + list(IMAGE_URL_PATTERNS)}))
+        driver = _CdpDriver()
+        RenderProfile().apply_driver(driver)
+        self.assertEqual(driver.cdp_cmd_list, [])
+
+
+class LaunchedDriverTest(unittest.TestCase):
+    def setUp(self):
+        self.save_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_folder, True)
+        webdriver_patch = fake_webdriver(FakeDriverSettings(launch_latency=0, page_load_latency=0))
+        webdriver_patch.__enter__()
+        self.addCleanup(webdriver_patch.__exit__, None, None, None)
+
+    def test_launched_chrome_keeps_the_download_directory_and_the_blocking_prefs(self):
+        pool = DriverPoll(save_folder=self.save_folder, only_html=True, driver_size=1)
+        self.addCleanup(pool.clear_driver_pool)
+        driver = pool.query_driver(timeout=5)
+        prefs = driver.options.experimental_options["prefs"]
+        self.assertEqual(prefs["download.default_directory"], driver.save_path)
+        self.assertEqual(prefs["profile.managed_default_content_settings.images"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()